@@ -25,6 +25,7 @@ import qc
 from qc.db import report
 from qc import dhmqc_constants as constants
 from qc.utils import osutils
+from qc.thatsDEM import array_geometry
 import psycopg2 as db
 import platform
 import random
@@ -48,9 +49,10 @@ STATUS_ERROR=3
 #status INTEGER, rcode INTEGER, msg TEXT, client TEXT, priority INTEGER, version INTEGER)"""
 #CREATE_SCRIPT_TABLE="CREATE TABLE proc_scripts(id INTEGER PRIMARY KEY, name TEXT UNIQUE, code TEXT)"
 
-def proc_client(p_number,db_cstr,lock):
+def proc_client(p_number,db_cstr,lock,filter_threads=1):
     #The processing client which should be importable from all processes.
     client=platform.node()+":%d"%p_number
+    array_geometry.set_filter_threads(filter_threads)
     logger = multiprocessing.log_to_stderr()
     logger.setLevel(logging.INFO)
     try:
@@ -109,8 +111,9 @@ def proc_client(p_number,db_cstr,lock):
                 send_args.append(ref_path)
             send_args+=targs
             rc=test_func(send_args)
-
+            report.flush_all() #reporting is buffered - write it before the job is marked as done.
         except Exception as e:
+            report.discard_all()
             stderr.write("[proc_client]: Exception caught:\n"+str(e)+"\n")
             stderr.write("[proc_client]: Traceback:\n"+traceback.format_exc()+"\n")
             logger.error("Caught: \n"+str(e))
@@ -318,8 +321,10 @@ def main(args):
     print("Starting a pool of %d workers." %(pargs.MP,))
     workers=[]
     lock=multiprocessing.Lock()
+    #divide the cores between the workers - like qc_wrap
+    filter_threads=max(multiprocessing.cpu_count()//pargs.MP,1)
     for i in range(pargs.MP):
-        p = multiprocessing.Process(target=proc_client, args=(i,pargs.cstr,lock))
+        p = multiprocessing.Process(target=proc_client, args=(i,pargs.cstr,lock,filter_threads))
         workers.append(p)
         p.start()
     #Now watch the processing#
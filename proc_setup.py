@@ -41,10 +41,30 @@ NAMES WHICH CAN BE DEFINED IN PARAM-FILE:
     - Process specific controls:
         MP: Maximal number of processes to spawn - will use qc_wrap default if not defined.
         RUN_ID: Can be set to a number and passed on to reporting database.
+        INDEX_DIR: Directory for spatial index sidecar files. Sorting of pointclouds
+                   (e.g. for filtering) is then stored and reused by later runs on the same tiles.
+        TIN_CACHE_DIR: Directory for triangulation cache files. Triangulations of pointclouds
+                       (e.g. strips in z_precision_roads / _buildings) are then stored and reused
+                       by later runs on the same tiles.
+        MAX_TILES: Replace each process by a new one after this many tiles (qc_wrap only).
+        TILE_TIMEOUT: Stop processing a tile after this many seconds and mark it as failed
+                      (qc_wrap only).
+        MAX_RSS: Stop processing a tile if the process uses more than this many MB of memory
+                 and mark it as failed (qc_wrap only).
+        RESUME: Process db of an interrupted run to continue (qc_wrap only). Tiles already done
+                are skipped.
+        RETRIES: Used with RESUME - retry failed tiles which have been retried less than this
+                 many times.
 
     - Additional arguments to pass on to test:
         TARGS: List of test-specific command line arguments, for example
                ['-tiledb', 'C:/path/to/tiles.sqlite', '-zfactor', '15']
+
+    - Running several tests on each tile (qc_wrap only):
+        TESTS: List of tests to run on each tile, which is then only read once.
+               Entries are either a testname or a (testname, targs) pair, for example
+               [('spike_check', ['-zlim', '0.25']), 'count_classes']
+               Will take precedence over TESTNAME and TARGS.
 '''
 from __future__ import print_function
 
@@ -96,6 +116,14 @@ QC_WRAP_NAMES = {"TESTNAME": str,
                  "MP": int,
                  "RUN_ID": int,
                  "TARGS": list,
+                 "TESTS": list,
+                 "INDEX_DIR": str,
+                 "TIN_CACHE_DIR": str,
+                 "MAX_TILES": int,
+                 "TILE_TIMEOUT": float,
+                 "MAX_RSS": float,
+                 "RESUME": str,
+                 "RETRIES": int,
                  "post_execute": StatusUpdater,
                  "status_update": StatusUpdater,
                  "STATUS_INTERVAL": float}
@@ -117,6 +145,8 @@ PCM_NAMES = {"TESTNAME": str,
 # Placeholders for testname,n_done and n_exceptions
 # names that really must be defined
 MUST_BE_DEFINED = ["TESTNAME", "INPUT_TILE_CONNECTION"]
+# The name used for the process db when running several tests pr. tile
+MULTI_TESTNAME = "multi_check"
 # And for pcm
 # DEFAULTS FOR STUFF THATS NOT SPECIFIED (other than None):
 QC_WRAP_DEFAULTS = {
@@ -125,6 +155,7 @@ QC_WRAP_DEFAULTS = {
     "REF_TILE_NAME_FIELD": "tile_name",
     "REF_TILE_PATH_FIELD": "path",
     "TARGS": [],
+    "RETRIES": 0,
     "STATUS_INTERVAL": 3600,
 }
 # DEFAULTS FOR THE LISTENING CLIENT
@@ -164,6 +195,8 @@ def get_definitions(all_names, defaults, definitions, override=None):
             if key == "TARGS":
                 if isinstance(val, str) or isinstance(val, str):
                     val = shlex.split(val)
+            if key == "TESTS":
+                val = [parse_test_definition(test_def) for test_def in val]
             try:
                 val = all_names[key](val)
             except Exception as e:
@@ -176,33 +209,50 @@ def get_definitions(all_names, defaults, definitions, override=None):
     return args
 
 
+def parse_test_definition(test_def):
+    '''
+    Normalise an entry of TESTS to a (testname, targs) pair.
+    Accepts a testname, a 'testname:targs' string (as given on the command line)
+    or a (testname, targs) pair where targs is a list or a string.
+    '''
+    if isinstance(test_def, str):
+        testname, _, targs = test_def.partition(":")
+    else:
+        testname, targs = test_def
+    if isinstance(targs, str):
+        targs = shlex.split(targs)
+    testname = os.path.basename(testname.strip()).replace(".py", "")
+    return testname, list(targs)
+
+
+def get_tests(args):
+    '''
+    Return the list of (testname, targs) pairs defined for a job.
+    Will be the single TESTNAME unless several tests are defined in TESTS.
+    '''
+    if args.get("TESTS"):
+        return args["TESTS"]
+    return [(args["TESTNAME"], args["TARGS"])]
+
+
 def show_tests():
     print("Currently valid tests:")
     for t in qc.tests:
         print("               " + t)
 
 
-def validate_job_definition(args, must_be_defined, create_layers=True):
+def validate_test(testname, targs, args):
     '''
-    A refactored job def checker which can be usefull outside of qc_wrap.
-    For now simply print both user-info and error messages and return a boolean.
-    This is supposed to be executed from the command line.
+    Check that a test exists, that reference data is defined if needed and
+    that the test specific arguments can be parsed by the test.
     '''
-
-    # consider using a logger (info / warning / error).
-    for key in must_be_defined:
-        if args[key] is None:
-            print("ERROR: " + key + " must be defined.")
-            return False
-
-    if not args["TESTNAME"] in qc.tests:
+    if not testname in qc.tests:
         print("%s,defined in parameter file, not matched to any test (yet....)\n" %
-              args["TESTNAME"])
+              testname)
         show_tests()
         return False
     # see if test uses ref-data and reference data is defined..
-    use_ref_data = qc.tests[args["TESTNAME"]][0]
-    use_reporting = qc.tests[args["TESTNAME"]][1]
+    use_ref_data = qc.tests[testname][0]
     ref_data_defined = False
     for key in ["REF_DATA_CONNECTION", "REF_TILE_DB"]:
         ref_data_defined |= (args[key] is not None)
@@ -210,28 +260,49 @@ def validate_job_definition(args, must_be_defined, create_layers=True):
         if not ref_data_defined:
             msg = '''Sorry, {testname} uses reference data.
                      Must be defined in parameter file in either REF_DATA_CONNECTION
-                     or REF_TILE_DB!'''.format(testname=args["TESTNAME"])
+                     or REF_TILE_DB!'''.format(testname=testname)
             print(textwrap.dedent(msg))
             return False
 
     # import valid arguments from test
-    test_parser = qc.get_argument_parser(args["TESTNAME"])
-    if len(args["TARGS"]) > 0:  # validate targs
-        print("Validating arguments for " + args["TESTNAME"])
+    test_parser = qc.get_argument_parser(testname)
+    if len(targs) > 0:  # validate targs
+        print("Validating arguments for " + testname)
         if test_parser is not None:
             _targs = ["dummy"]
             if use_ref_data:
                 _targs.append("dummy")
-            _targs.extend(args["TARGS"])
+            _targs.extend(targs)
             try:
                 test_parser.parse_args(_targs)
             except Exception as e:
-                print("Error parsing arguments for test script " + args["TESTNAME"] + ":")
+                print("Error parsing arguments for test script " + testname + ":")
                 print(str(e))
                 return False
         else:
-            print("No argument parser in " + args["TESTNAME"] +
+            print("No argument parser in " + testname +
                   " - unable to check arguments to test.")
+    return True
+
+
+def validate_job_definition(args, must_be_defined, create_layers=True):
+    '''
+    A refactored job def checker which can be usefull outside of qc_wrap.
+    For now simply print both user-info and error messages and return a boolean.
+    This is supposed to be executed from the command line.
+    '''
+
+    # consider using a logger (info / warning / error).
+    for key in must_be_defined:
+        if args[key] is None:
+            print("ERROR: " + key + " must be defined.")
+            return False
+
+    use_reporting = False
+    for testname, targs in get_tests(args):
+        if not validate_test(testname, targs, args):
+            return False
+        use_reporting |= qc.tests[testname][1]
 
     if use_reporting:
         # this will not be supported for the listening client... so an optional keyword
@@ -380,15 +451,29 @@ def setup_job(all_names, defaults, cmdline_args, param_file=None):
     ## Get definitions with commandline taking precedence ##
     #######################################
     args = get_definitions(all_names, defaults, fargs, cmdline_args)
+    if args.get("TESTS"):
+        if args["TESTNAME"] is not None:
+            print("TESTS is defined - will ignore TESTNAME.")
+        args["TESTNAME"] = MULTI_TESTNAME
 
     ########################
     ## Validate sanity of definition   ##
     ########################
 
-    ok = validate_job_definition(args, MUST_BE_DEFINED)
+    resume = args.get("RESUME") is not None
+    if args.get("RETRIES") and not resume:
+        print("ERROR: RETRIES can only be used with RESUME.")
+        return 2, None, None
+    must_be_defined = MUST_BE_DEFINED
+    if resume:
+        # the tiles are taken from the process db
+        must_be_defined = [key for key in MUST_BE_DEFINED if key != "INPUT_TILE_CONNECTION"]
+    ok = validate_job_definition(args, must_be_defined)
     if not ok:
         return 2, None, None
-    use_ref_data = qc.tests[args["TESTNAME"]][0]
+    if resume:
+        return 0, [], args
+    use_ref_data = any(qc.tests[testname][0] for testname, _ in get_tests(args))
 
     #############
     ## Get input tiles#
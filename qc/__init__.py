@@ -56,6 +56,7 @@ tests={
 "colorize":(False,False),
 "time_stats":(False,True),
 "reproject":(False,False),
+"las2pcc":(False,False),
 }
 
 loaded_modules={}
@@ -76,57 +76,28 @@ def main(args):
     if n_points_total == 0:
         print("Something is terribly terribly wrong here! Simon - vi skal melde en fjel")
 
-    pc_temp = pc.cut_to_class(constants.created_unused)
-    n_created_unused = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.surface)
-    n_surface = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.terrain)
-    n_terrain = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.low_veg)
-    n_low_veg = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.high_veg)
-    n_high_veg = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.med_veg)
-    n_med_veg = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.building)
-    n_building = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.outliers)
-    n_outliers = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.mod_key)
-    n_mod_key = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.water)
-    n_water = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.ignored)
-    n_ignored = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.bridge)
-    n_bridge = pc_temp.get_size()
+    # one pass over the classes - no copying of points. As python ints for reporting.
+    hist = pc.class_histogram(minlength=constants.man_excl + 1).tolist()
+
+    n_created_unused = hist[constants.created_unused]
+    n_surface = hist[constants.surface]
+    n_terrain = hist[constants.terrain]
+    n_low_veg = hist[constants.low_veg]
+    n_high_veg = hist[constants.high_veg]
+    n_med_veg = hist[constants.med_veg]
+    n_building = hist[constants.building]
+    n_outliers = hist[constants.outliers]
+    n_mod_key = hist[constants.mod_key]
+    n_water = hist[constants.water]
+    n_ignored = hist[constants.ignored]
+    n_bridge = hist[constants.bridge]
 
     # new classes
-    pc_temp = pc.cut_to_class(constants.high_noise)
-    n_high_noise = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.power_line)
-    n_power_line = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.terrain_in_buildings)
-    n_terrain_in_buildings = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.low_veg_in_buildings)
-    n_low_veg_in_buildings = pc_temp.get_size()
-
-    pc_temp = pc.cut_to_class(constants.man_excl)
-    n_man_excl = pc_temp.get_size()
+    n_high_noise = hist[constants.high_noise]
+    n_power_line = hist[constants.power_line]
+    n_terrain_in_buildings = hist[constants.terrain_in_buildings]
+    n_low_veg_in_buildings = hist[constants.low_veg_in_buildings]
+    n_man_excl = hist[constants.man_excl]
 
     polywkt = tilename_to_extent(kmname, return_wkt=True)
     print(polywkt)
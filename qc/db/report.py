@@ -23,10 +23,14 @@ from __future__ import absolute_import
 from builtins import str
 from builtins import object
 import os
+import time
 import datetime
+import atexit
 
 from osgeo import ogr, osr, gdal
 
+from ..utils import profiling
+
 try:
     from  .pg_connection import PG_CONNECTION
 except ImportError:
@@ -54,6 +58,14 @@ else:
 RUN_ID = None   # A global id, which can be set from a wrapper script pr. process
 SCHEMA_NAME = None
 
+# Features are buffered and written in batches, each in one transaction. A batch is written when
+# it reaches BATCH_SIZE features, when the oldest feature is older than BATCH_TIME seconds, or by flush_all.
+# Set BATCH_SIZE to 0 to write each feature immediately.
+BATCH_SIZE = 1000
+BATCH_TIME = 10.0
+# Reporters with buffered features - kept alive here until flushed.
+PENDING = []
+
 # defining a special string type that let's you have longer strings without
 # breaking the existing architecture. Not exactly pretty, but it works.
 # Most strings in DHMQC fits in 32 bytes, but in certain cases that is not
@@ -74,6 +86,29 @@ def set_schema(name):
     SCHEMA_NAME = name
 
 
+def set_batching(batch_size, batch_time=None):
+    '''Set default batch size (0 to disable batching) and optionally max age in seconds of buffered features.'''
+    global BATCH_SIZE, BATCH_TIME
+    BATCH_SIZE = int(batch_size)
+    if batch_time is not None:
+        BATCH_TIME = float(batch_time)
+
+
+def flush_all():
+    '''Write all buffered features. Called at exit, and by wrappers when a tile is done.'''
+    while PENDING:
+        PENDING[0].flush()
+
+
+def discard_all():
+    '''Forget all buffered features, e.g. if the test reporting them failed.'''
+    while PENDING:
+        PENDING.pop().buffer = []
+
+
+atexit.register(flush_all)
+
+
 class LayerDefinition(object):
     '''Generic layer definition class.'''
 
@@ -549,8 +584,9 @@ def get_output_datasource(use_local=False):
     return data_source
 
 def close_datasource():
-    '''Close the connection to the reporting database.'''
+    '''Write buffered features and close the connection to the reporting database.'''
     global DATA_SOURCE
+    flush_all()
     DATA_SOURCE = None
     del DATA_SOURCE
 
@@ -559,8 +595,14 @@ class ReportBase(object):
     LAYER_DEFINITION = None
     STRING_LENGTH = 32
 
-    def __init__(self, use_local, run_id=None):
+    def __init__(self, use_local, run_id=None, batch_size=None):
         self.layername = self.LAYER_DEFINITION.name
+        # set batch_size=0 if features must be visible in the db as soon as they are reported.
+        if batch_size is None:
+            batch_size = BATCH_SIZE
+        self.batch_size = batch_size
+        self.buffer = []
+        self.buffer_time = None
  
         if DATA_SOURCE is not None:
             print("Using open data source for reporting.")
@@ -591,6 +633,7 @@ class ReportBase(object):
         self.run_id = run_id
         print("Run id is: %s" % self.run_id)
 
+    @profiling.profiled("report")
     def _report(self, *args, **kwargs):
         if self.layer is None:
             return 1
@@ -629,11 +672,43 @@ class ReportBase(object):
             geom = ogr.CreateGeometryFromWkt(kwargs["wkt_geom"])
         if geom is not None:
             feature.SetGeometry(geom)
+        if self.batch_size > 0:
+            if not self.buffer:
+                self.buffer_time = time.time()
+                PENDING.append(self)
+            self.buffer.append(feature)
+            if len(self.buffer) >= self.batch_size or time.time() - self.buffer_time > BATCH_TIME:
+                self.flush()
+            return 0
         res = self.layer.CreateFeature(feature)
         if res != 0:
             # fail utterly - better to rerun that tile...
             raise Exception("Failed to create feature - check connection!")
         return res
+
+    def flush(self):
+        '''Write buffered features in one transaction (if supported by the data source).'''
+        if self in PENDING:
+            PENDING.remove(self)
+        features, self.buffer = self.buffer, []
+        if not features:
+            return 0
+        with profiling.stage("report_flush", len(features)):
+            in_transaction = self.layer.StartTransaction() == 0
+            for feature in features:
+                res = self.layer.CreateFeature(feature)
+                if res != 0:
+                    if in_transaction:
+                        self.layer.RollbackTransaction()
+                    # fail utterly - better to rerun that tile...
+                    raise Exception("Failed to create feature - check connection!")
+            if in_transaction and self.layer.CommitTransaction() != 0:
+                raise Exception("Failed to commit features - check connection!")
+        return 0
+
+    def close(self):
+        '''Write buffered features.'''
+        return self.flush()
     # args must come in the order defined by layer definition above, geom
     # given in kwargs as ogr_geom og wkt_geom
 
@@ -62,6 +62,11 @@ DSM_TRIANGLE_LIMIT = 3 #LIMIT for large triangles
 H_SYS = "E" #default H_SYS - can be changed...
 SEA_TOLERANCE = 0.8  #this much away from sea_z or mean or something aint sea...
 LAKE_TOLERANCE = 0.45 #this much higher than lake_z is deemed not lake!
+CACHE_SIZE = 0 #MB of neighbour tiles (cut to classes) to keep in memory pr. process - disabled by default
+
+# Neighbour tiles are read for every tile in the 3x3 neighbourhood - optionally keep them around
+# pr. process, so that they can be reused when processing adjacent tiles.
+TILE_CACHE = pointcloud.PointcloudCache(CACHE_SIZE * 2**20)
 
 #TILE_COVERAGE DEFAULTS:
 ROW_COL_SQL = "SELECT row, col FROM coverage WHERE tile_name='{TILE_NAME}'"
@@ -189,6 +194,19 @@ parser.add_argument(
     "-no_expand_water",
     action="store_true",
     help="""Do not expand water mask.""")
+parser.add_argument(
+    "-cache_size",
+    type=float,
+    default=CACHE_SIZE,
+    help="""Specify how many MB of neighbour tiles to keep in memory (pr. process) for reuse
+            when processing adjacent tiles. Should hold at least 3 tiles cut to classes to be useful.
+            Defaults to %d MB - 0 disables caching.""" % CACHE_SIZE)
+parser.add_argument(
+    "-threads",
+    type=int,
+    default=1,
+    help="""Triangulate and grid in blocks using this many threads. The result is the same
+            as when triangulating the whole tile. Defaults to 1 (no blocks).""")
 parser.add_argument(
     "las_file",
     help="Input las tile (the important bit is tile name).")
@@ -239,7 +257,7 @@ def expand_water(add_mask, water_mask, element=None, verbose=False):
         print("Cells after expansion: %d" % water_mask.sum())
     return water_mask
 
-def gridit(points, extent, cell_size, g_warp=None, doround=False):
+def gridit(points, extent, cell_size, g_warp=None, doround=False, n_threads=1):
     '''
     Grid pointcloud within extent.
 
@@ -249,13 +267,15 @@ def gridit(points, extent, cell_size, g_warp=None, doround=False):
         cell_size:          Cell size of grid.
         g_warp:             Height transformation grid. Typically a geoid grid.
         doround:            Rounds grid-values to 3 decimals.
+        n_threads:          Triangulate and grid in blocks with this many threads
+                            if larger than 1 and points are not triangulated already.
 
     Returns:
         grid:               thatsDEM.grid.Grid object with heights in each grid cell.
         triangles:          thatsDEM.grid.Grid object with triangle sizes in grid cells.
                             Can be used to identify individual triangles in the grid.
     '''
-    if points.triangulation is None:
+    if points.triangulation is None and n_threads <= 1:
         points.triangulate()
 
     triangulated_grid, triangles = points.get_grid(
@@ -266,7 +286,8 @@ def gridit(points, extent, cell_size, g_warp=None, doround=False):
         cx=cell_size,
         cy=cell_size,
         nd_val=ND_VAL,
-        method="return_triangles")
+        method="return_triangles",
+        n_threads=n_threads if n_threads > 1 else None)
 
     mask = (triangulated_grid.grid != ND_VAL)
     if not mask.any():
@@ -327,6 +348,50 @@ def get_neighbours(connection_str, tilename, rowcol_sql, tile_sql, remove_bridge
 
     return data
 
+def load_neighbour(path, ground_cls, surf_cls, warp_to, geoid, xy_box):
+    '''
+    Load the part within xy_box of a neighbour tile cut to surface classes with ground classes
+    reclassified to SYNTH_TERRAIN and (if warp_to is not None) warped to the output height system.
+
+    If TILE_CACHE is enabled (-cache_size) the whole tile, cut to classes and reclassified, is cached,
+    keyed by path, modification time and classes. Only the part within xy_box is warped.
+    '''
+    use_cache = TILE_CACHE.max_bytes > 0
+    tile_pc = None
+    if use_cache:
+        key = (os.path.realpath(path), os.path.getmtime(path), tuple(sorted(ground_cls)), tuple(sorted(surf_cls)))
+        tile_pc = TILE_CACHE.get(key)
+        if tile_pc is not None:
+            print("Using cached " + path)
+
+    if tile_pc is None:
+        tile_pc = pointcloud.fromAny(path, include_return_number=True)
+        if not use_cache:
+            tile_pc = tile_pc.cut_to_box(*xy_box)
+        tile_pc = tile_pc.cut_to_class(surf_cls)
+
+        if tile_pc.get_size() > 0:
+            mask = np.zeros((tile_pc.get_size(),), dtype=np.bool_)
+            #reclass hack
+            for cls in ground_cls:
+                mask |= (tile_pc.c == cls)
+            tile_pc.c[mask] = SYNTH_TERRAIN
+        if use_cache:
+            TILE_CACHE.put(key, tile_pc)
+
+    if use_cache:
+        # cutting copies the points, so the cached pointcloud is left untouched
+        tile_pc = tile_pc.cut_to_box(*xy_box)
+
+    #warping to hsys
+    if tile_pc.get_size() > 0:
+        if warp_to == "E":
+            tile_pc.toE(geoid)
+        elif warp_to is not None:
+            tile_pc.toH(geoid)
+    return tile_pc
+
+
 def setup_masks(fargs, nrows, ncols, georef):
     '''
     Set up masks for water and buildings
@@ -546,30 +611,20 @@ def main(args):
     tiles = get_neighbours(pargs.tile_cstr, kmname, pargs.rowcol_sql, pargs.tile_sql, pargs.remove_bridges_in_dtm)
     bufpc = None
     geoid = grid.fromGDAL(GEOID_GRID, upcast=True)
+    TILE_CACHE.set_max_bytes(int(pargs.cache_size * 2**20))
     for path, ground_cls, surf_cls, h_system in tiles:
         if os.path.exists(path):
             #check sanity
             assert set(ground_cls).issubset(set(surf_cls))
             assert h_system in ["dvr90", "E"]
 
-            tile_pc = pointcloud.fromAny(path, include_return_number=True)
-            tile_pc = tile_pc.cut_to_box(*extent_buf)
-            tile_pc = tile_pc.cut_to_class(surf_cls)
+            if h_system != pargs.hsys and not pargs.nowarp:
+                warp_to = pargs.hsys
+            else:
+                warp_to = None
+            tile_pc = load_neighbour(path, ground_cls, surf_cls, warp_to, geoid, extent_buf)
 
             if tile_pc.get_size() > 0:
-                mask = np.zeros((tile_pc.get_size(),), dtype=np.bool_)
-                #reclass hack
-                for cls in ground_cls:
-                    mask |= (tile_pc.c == cls)
-                tile_pc.c[mask] = SYNTH_TERRAIN
-
-                #warping to hsys
-                if h_system != pargs.hsys and not pargs.nowarp:
-                    if pargs.hsys == "E":
-                        tile_pc.toE(geoid)
-                    else:
-                        tile_pc.toH(geoid)
-
                 if bufpc is None:
                     bufpc = tile_pc
                 else:
@@ -619,7 +674,12 @@ def main(args):
     if do_dtm:
         terr_pc = bufpc.cut_to_class(SYNTH_TERRAIN)
         if terr_pc.get_size() > 3:
-            dtm, trig_grid = gridit(terr_pc, grid_buf, pargs.cell_size, None, doround=pargs.round)
+            if water_mask.any():
+                # Filling in water (below) needs the triangulation of the whole tile - so
+                # triangulate once and grid from that, rather than also gridding in blocks.
+                terr_pc.triangulate()
+            dtm, trig_grid = gridit(terr_pc, grid_buf, pargs.cell_size, None, doround=pargs.round,
+                                    n_threads=pargs.threads)
         else:
             rc1 = 3
 
@@ -651,7 +711,8 @@ def main(args):
                 print(debug_difference.mean(), (debug_difference != 0).sum())
 
             terr_pc.z = zlow
-            dtm_low, trig_grid = gridit(terr_pc, grid_buf, pargs.cell_size, None, doround=pargs.round)
+            dtm_low, trig_grid = gridit(terr_pc, grid_buf, pargs.cell_size, None, doround=pargs.round,
+                                        n_threads=pargs.threads)
             dtm.grid[mask] = dtm_low.grid[mask]
             del dtm_low
 
@@ -693,7 +754,8 @@ def main(args):
         del bufpc
 
         if surf_pc.get_size() > 3:
-            dsm, trig_grid = gridit(surf_pc, grid_buf, pargs.cell_size, None, doround=pargs.round)
+            dsm, trig_grid = gridit(surf_pc, grid_buf, pargs.cell_size, None, doround=pargs.round,
+                                    n_threads=pargs.threads)
         else:
             rc2 = 3
 
@@ -19,15 +19,15 @@ Create density grids from las-files.
 from __future__ import print_function
 
 from builtins import str
-from builtins import range
 import os
 import sys
 import time
 
 import numpy as np
 from osgeo import gdal
-import laspy
 
+from qc.thatsDEM import pointcloud
+from qc.thatsDEM import grid
 from qc.thatsDEM import vector_io
 from qc.db import report
 from qc.utils.osutils import ArgumentParser
@@ -54,7 +54,8 @@ db_group.add_argument("-schema", help="Specify schema for PostGis db.")
 parser.add_argument(
     "-cs",
     type=float,
-    help="Specify cell size of grid. Default 100 m (TILE_SIZE must be divisible by cell_size)",
+    help="""Specify cell size of grid. Default 100 m. If TILE_SIZE is not divisible by cell size,
+    the last row and column will only partially cover the tile (and density is calculated over the covered area).""",
     default=CELL_SIZE,
 )
 parser.add_argument(
@@ -85,6 +86,32 @@ def usage():
     parser.print_help()
 
 
+def density_grid(xy, extent, cell_size):
+    '''
+    Calculate point densities in a grid covering a tile.
+
+    Cells include their lower/left edges, the last row/column also the tile edge. If the tile
+    size is not divisible by the cell size, the last row and column only partially cover the
+    tile and the density is calculated over the covered area.
+
+    Args:
+        xy: numpy array of shape (n, 2) of points in the tile.
+        extent: (x_min, y_min, x_max, y_max) of the tile.
+        cell_size: cell size of the grid.
+    Returns:
+        Density grid (points pr. square unit) of shape (ny, nx) and its GDAL style georeference.
+    '''
+    x_min, y_min, x_max, y_max = extent
+    nx = int(np.ceil((x_max - x_min) / cell_size))
+    ny = int(np.ceil((y_max - y_min) / cell_size))
+    georef = (x_min, cell_size, 0, y_max, 0, -cell_size)
+    counts = grid.count_points(xy, nx, ny, georef, include_edges=True)
+    # area of each cell covered by the tile
+    widths = np.minimum(cell_size, x_max - (x_min + np.arange(nx) * cell_size))
+    heights = np.minimum(cell_size, (y_max - np.arange(ny) * cell_size) - y_min)
+    return counts / np.outer(heights, widths), georef
+
+
 def main(args):
     '''
     Core function. Called either stand-alone or from qc_wrap.
@@ -98,10 +125,8 @@ def main(args):
     kmname = constants.get_tilename(pargs.las_file)
     print("Running %s on block: %s, %s" % (PROGNAME, kmname, time.asctime()))
     cell_size = pargs.cs
-    ncols_f = TILE_SIZE / cell_size
-    ncols = int(ncols_f)
-    if ncols != ncols_f:
-        print("TILE_SIZE: %d must be divisible by cell size..." % (TILE_SIZE))
+    if cell_size <= 0:
+        print("Cell size must be positive...")
         usage()
         return 1
 
@@ -130,39 +155,14 @@ def main(args):
         print("Bad 1km formatting of las file: %s" % lasname)
         return 1
 
-    las_file = laspy.read(lasname)
+    pc = pointcloud.fromAny(lasname, xy_box=(x_min, y_min, x_max, y_max))
 
-    nx = int((x_max - x_min) / cell_size)
-    ny = int((y_max - y_min) / cell_size)
+    den_grid, georef = density_grid(pc.xy, (x_min, y_min, x_max, y_max), cell_size)
+    ny, nx = den_grid.shape
     ds_grid = gdal.GetDriverByName('GTiff').Create(outname, nx, ny, 1, gdal.GDT_Float32)
-    georef = (x_min, cell_size, 0, y_max, 0, -cell_size)
     ds_grid.SetGeoTransform(georef)
     band = ds_grid.GetRasterBand(1)
     band.SetNoDataValue(ND_VAL)
-
-    # make local copies so we don't have to call the x and y getter functions
-    # of las_file a nx*ny times
-    xs = las_file.x
-    ys = las_file.y
-
-    # determine densities
-    den_grid = np.ndarray(shape=(nx, ny), dtype=float)
-    for i in range(nx):
-        for j in range(ny):
-            I = np.ones(las_file.header.point_count, dtype=bool)
-
-            if i < nx-1:
-                I &= np.logical_and(xs >= x_min+i*cell_size, xs < x_min+(i+1)*cell_size)
-            else:
-                I &= np.logical_and(xs >= x_min+i*cell_size, xs <= x_min+(i+1)*cell_size)
-
-            if j < ny-1:
-                I &= np.logical_and(ys >= y_min+j*cell_size, ys < y_min+(j+1)*cell_size)
-            else:
-                I &= np.logical_and(ys >= y_min+j*cell_size, ys <= y_min+(j+1)*cell_size)
-
-            den_grid[ny-j-1][i] = np.sum(I) / (cell_size*cell_size)
-
     band.WriteArray(den_grid)
 
     t1 = time.process_time()
@@ -213,8 +213,9 @@ def main(args):
     pc.sort_spatially(FRAD)
     print("Filtering..")
     # so 1 of two criteria should be fullfilled: low, low, density or high pointdistance...
-    d_in = pc.density_filter(FRAD, pc_ref.xy)
-    pd_in = pc.distance_filter(FRAD, pc_ref.xy)
+    stats_in = pc.multi_filter(FRAD, pc_ref.xy, stats=("count", "distance"))
+    d_in = stats_in["count"] / (np.pi * FRAD ** 2)
+    pd_in = stats_in["distance"]
     M = np.logical_or(d_in < DEN_LIM, pd_in > PDIST_LIM)
     pc_pot = pc_ref.cut(M)
     if pc_pot.get_size() == 0:
@@ -269,7 +270,6 @@ def main(args):
         nrows = int((extent[3] - extent[1]) / cs)
         assert((cs * ncols + extent[0]) == extent[2])
         pc_ref.sort_spatially(FRAD_IDW)
-        pc.sort_spatially(FRAD_IDW)
         xy = pointcloud.mesh_as_points((nrows, ncols), geo_ref)
         print("idw1")
         z_new = pc.idw_filter(FRAD_IDW, xy=xy, nd_val=-9999)
@@ -0,0 +1,81 @@
+# Copyright (c) 2015-2016, Danish Geodata Agency <gst@gst.dk>
+# Copyright (c) 2016, Danish Agency for Data Supply and Efficiency <sdfe@sdfe.dk>
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+'''
+las2pcc.py - Convert a las/laz tile to the memory mappable pointcloud cache format (.pcc).
+
+Checks which are run repeatedly on the same tiles can read the .pcc files instead of
+decompressing the las/laz files every time. Create a tile layer of the output with e.g.:
+python tile_coverage.py create <out_dir> pcc pcc_tiles.sqlite
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+from builtins import str
+import sys
+import os
+import time
+
+from .utils.osutils import ArgumentParser
+from . import dhmqc_constants as constants
+from .thatsDEM import pointcloud
+
+progname = os.path.basename(__file__).replace(".pyc", ".py")
+
+parser = ArgumentParser(
+    description='Convert a las/laz file to the pointcloud cache format (.pcc).',
+    prog=progname
+)
+
+parser.add_argument('las_file', help='Input las/laz file')
+parser.add_argument('out_dir', help='Output directory')
+parser.add_argument(
+    '-overwrite',
+    action='store_true',
+    help='Overwrite output files even if they are newer than the input file.')
+
+
+def usage():
+    parser.print_help()
+
+
+def main(args):
+    try:
+        pargs = parser.parse_args(args[1:])
+    except Exception as e:
+        print(str(e))
+        return 1
+
+    kmname = constants.get_tilename(pargs.las_file)
+    print("Running %s on block: %s, %s" % (progname, kmname, time.asctime()))
+
+    bname = os.path.splitext(os.path.basename(pargs.las_file))[0]
+    out_file = os.path.join(pargs.out_dir, bname + pointcloud.PCC_EXT)
+
+    if not os.path.exists(pargs.out_dir):
+        os.makedirs(os.path.abspath(pargs.out_dir))
+
+    if (not pargs.overwrite and os.path.exists(out_file) and
+            os.path.getmtime(out_file) >= os.path.getmtime(pargs.las_file)):
+        print("%s is up to date." % out_file)
+        return 0
+
+    pc = pointcloud.fromAny(pargs.las_file, include_return_number=True)
+    pc.dump_cache(out_file)
+    print("Wrote %d points to %s" % (pc.get_size(), out_file))
+    return 0
+
+
+if __name__ == '__main__':
+    main(sys.argv)
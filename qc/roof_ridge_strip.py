@@ -160,7 +160,7 @@ def main(args):
             print("Only houses with 4 corners accepted... continuing...")
             continue
         pcp = pc.cut_to_polygon(a_poly)
-        strips = pcp.get_pids()
+        strips = pcp.split_by("pid")
         if len(strips) != 2:
             print("Not exactly two overlapping strips... continuing...")
             continue
@@ -169,10 +169,9 @@ def main(args):
         xy_t = a_poly.mean(axis=0)  # center of mass system
         a_poly -= xy_t
         lines = []  # for storing the two found lines...
-        for sid in strips:
+        for sid, pcp_ in strips.items():
             print("-*-" * 15)
             print("Looking at strip %d" % sid)
-            pcp_ = pcp.cut_to_strip(sid)
             # hmmm, these consts should perhaps be made more visible...
             if (pcp_.get_size() < 500 and (not is_sloppy)) or (pcp_.get_size() < 10):
                 print("Few points in polygon... %d" % pcp_.get_size())
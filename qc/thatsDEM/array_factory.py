@@ -22,6 +22,7 @@
 import numpy as np
 
 # These functions should not copy data when input is ok....
+# Arrays which do not own their data (e.g. memory maps) are fine, as long as they are aligned and c-contiguous.
 
 
 def point_factory(xy):
@@ -32,11 +33,11 @@ def point_factory(xy):
             raise TypeError("Input must have size n*2")
         xy = xy.reshape((int(n / 2), 2))
     return np.require(xy, dtype=np.float64, requirements=[
-                      'A', 'O', 'C'])  # aligned, own_data, c-contiguous
+                      'A', 'C'])  # aligned, c-contiguous
 
 
 def z_factory(z):
-    return np.require(z, dtype=np.float64, requirements=['A', 'O', 'C'])
+    return np.require(z, dtype=np.float64, requirements=['A', 'C'])
 
 
 def int_array_factory(I):
@@ -45,4 +46,4 @@ def int_array_factory(I):
     I = np.asarray(I)
     if I.ndim > 1:
         I = np.flatten(I)
-    return np.require(I, dtype=np.int32, requirements=['A', 'O', 'C'])
+    return np.require(I, dtype=np.int32, requirements=['A', 'C'])
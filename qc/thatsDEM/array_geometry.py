@@ -16,6 +16,7 @@ from builtins import range
 import sys
 import os
 import ctypes
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from osgeo import ogr
 
@@ -23,20 +24,28 @@ ogr.UseExceptions()
 
 LIBDIR = os.path.realpath(os.path.join(os.path.dirname(__file__), "lib"))
 LIBNAME = "libfgeom"
-XY_TYPE = np.ctypeslib.ndpointer(dtype=np.float64, flags=['C', 'O', 'A', 'W'])
-GRID_TYPE = np.ctypeslib.ndpointer(dtype=np.float64, ndim=2, flags=['C', 'O', 'A', 'W'])
-GRID32_TYPE = np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags=['C', 'O', 'A', 'W'])
-Z_TYPE = np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags=['C', 'O', 'A', 'W'])
-MASK_TYPE = np.ctypeslib.ndpointer(dtype=np.bool_, ndim=1, flags=['C', 'O', 'A', 'W'])
-MASK2D_TYPE = np.ctypeslib.ndpointer(dtype=np.bool_, ndim=2, flags=['C', 'O', 'A', 'W'])
-UINT32_TYPE = np.ctypeslib.ndpointer(dtype=np.uint32, ndim=1, flags=['C', 'O', 'A'])
-HMAP_TYPE = np.ctypeslib.ndpointer(dtype=np.uint32, ndim=2, flags=['C', 'O', 'A'])
-UINT8_VOXELS = np.ctypeslib.ndpointer(dtype=np.uint8, ndim=3, flags=['C', 'O', 'A', 'W'])
-INT32_VOXELS = np.ctypeslib.ndpointer(dtype=np.int32, ndim=3, flags=['C', 'O', 'A', 'W'])
-INT32_TYPE = np.ctypeslib.ndpointer(dtype=np.int32, ndim=1, flags=['C', 'O', 'A', 'W'])
+# The c functions only need aligned, c-contiguous memory - views, like memory maps, are fine.
+XY_TYPE = np.ctypeslib.ndpointer(dtype=np.float64, flags=['C', 'A', 'W'])
+GRID_TYPE = np.ctypeslib.ndpointer(dtype=np.float64, ndim=2, flags=['C', 'A', 'W'])
+GRID32_TYPE = np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags=['C', 'A', 'W'])
+Z_TYPE = np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags=['C', 'A', 'W'])
+MASK_TYPE = np.ctypeslib.ndpointer(dtype=np.bool_, ndim=1, flags=['C', 'A', 'W'])
+MASK2D_TYPE = np.ctypeslib.ndpointer(dtype=np.bool_, ndim=2, flags=['C', 'A', 'W'])
+UINT32_TYPE = np.ctypeslib.ndpointer(dtype=np.uint32, ndim=1, flags=['C', 'A'])
+HMAP_TYPE = np.ctypeslib.ndpointer(dtype=np.uint32, ndim=2, flags=['C', 'A'])
+UINT8_VOXELS = np.ctypeslib.ndpointer(dtype=np.uint8, ndim=3, flags=['C', 'A', 'W'])
+INT32_VOXELS = np.ctypeslib.ndpointer(dtype=np.int32, ndim=3, flags=['C', 'A', 'W'])
+INT32_TYPE = np.ctypeslib.ndpointer(dtype=np.int32, ndim=1, flags=['C', 'A', 'W'])
+INT32_2D_TYPE = np.ctypeslib.ndpointer(dtype=np.int32, ndim=2, flags=['C', 'A', 'W'])
 LP_CINT = ctypes.POINTER(ctypes.c_int)
 LP_CCHAR = ctypes.POINTER(ctypes.c_char)
 lib = np.ctypeslib.load_library(LIBNAME, LIBDIR)
+# Number of threads used by the point filters (see run_filter) and the
+# smallest number of query points worth handing to a thread. Defaults to a
+# single thread since the checks usually run in a pool of processes - see
+# set_filter_threads.
+FILTER_THREADS = 1
+FILTER_MIN_CHUNK = 2**14
 ##############
 # corresponds to
 # array_geometry.h
@@ -49,7 +58,7 @@ lib.p_in_poly.restype = ctypes.c_int
 lib.get_triangle_geometry.argtypes = [
     XY_TYPE, Z_TYPE, LP_CINT, np.ctypeslib.ndpointer(
         dtype=np.float32, ndim=2, flags=[
-            'C', 'O', 'A', 'W']), ctypes.c_int]
+            'C', 'A', 'W']), ctypes.c_int]
 lib.get_triangle_geometry.restype = None
 lib.mark_bd_vertices.argtypes = [MASK_TYPE, MASK_TYPE, LP_CINT, MASK_TYPE, ctypes.c_int, ctypes.c_int]
 lib.mark_bd_vertices.restype = None
@@ -74,6 +83,8 @@ lib.pc_idw_filter.argtypes = STD_FILTER_ARGS
 lib.pc_idw_filter.restype = None
 lib.pc_median_filter.argtypes = STD_FILTER_ARGS
 lib.pc_median_filter.restype = None
+lib.pc_percentile_filter.argtypes = STD_FILTER_ARGS[:5] + [ctypes.c_double] + STD_FILTER_ARGS[5:]
+lib.pc_percentile_filter.restype = None
 lib.pc_var_filter.argtypes = STD_FILTER_ARGS
 lib.pc_var_filter.restype = None
 lib.pc_distance_filter.argtypes = STD_FILTER_ARGS
@@ -101,6 +112,14 @@ lib.pc_spike_filter.argtypes = [
     XY_TYPE,
     ctypes.c_int]
 lib.pc_spike_filter.restype = None
+# void pc_multi_filter(double *xy, double *pc_xy, double *pc_z, double *out, double filter_rad, double nd_val, double nd_dist,
+#                      int stats, int *spatial_index, double *header, int npoints)
+lib.pc_multi_filter.argtypes = [XY_TYPE, XY_TYPE, Z_TYPE, GRID_TYPE, ctypes.c_double, ctypes.c_double, ctypes.c_double,
+                                ctypes.c_int, INT32_TYPE, XY_TYPE, ctypes.c_int]
+lib.pc_multi_filter.restype = None
+# void pc_knn(double *xy, double *pc_xy, int k, int *idx_out, double *dist_out, int *spatial_index, double *header, int npoints)
+lib.pc_knn.argtypes = [XY_TYPE, XY_TYPE, ctypes.c_int, INT32_2D_TYPE, GRID_TYPE, INT32_TYPE, XY_TYPE, ctypes.c_int]
+lib.pc_knn.restype = None
 # void pc_noise_filter(double *pc_xy, double *pc_z, double *z_out, double filter_rad, double zlim, double den_cut, int *spatial_index, double *header, int npoints);
 # binning
 # void moving_bins(double *z, int *nout, double rad, int n);
@@ -125,6 +144,46 @@ lib.binary_fill_gaps.argtypes = [MASK2D_TYPE, MASK2D_TYPE, ctypes.c_int, ctypes.
 lib.binary_fill_gaps.restype = None
 
 
+def set_filter_threads(n_threads):
+    """
+    Set the number of threads used by the point filters, e.g. 1 when many processes are running already.
+    """
+    global FILTER_THREADS
+    FILTER_THREADS = max(int(n_threads), 1)
+
+
+def run_filter(func, args, chunked, n, n_threads=None):
+    """
+    Call one of the pc_*_filter functions from the library with the query points split in chunks,
+    which are handled concurrently in a pool of threads. Each output value only depends on its own
+    query point, and ctypes releases the GIL while in c, so this scales with the number of cores.
+    Args:
+        func: The library function. The last argument must be the number of query points.
+        args: List of the other arguments.
+        chunked: Indices in args of the arrays with a row pr. query point (input and output).
+        n: Number of query points.
+        n_threads: Number of threads. Defaults to FILTER_THREADS.
+    """
+    if n_threads is None:
+        n_threads = FILTER_THREADS
+    n_chunks = min(n_threads, n // FILTER_MIN_CHUNK)
+    if n_chunks <= 1:
+        func(*(list(args) + [n]))
+        return
+
+    def run_chunk(chunk):
+        i1 = (chunk * n) // n_chunks
+        i2 = ((chunk + 1) * n) // n_chunks
+        chunk_args = list(args)
+        for i in chunked:
+            chunk_args[i] = args[i][i1:i2]
+        func(*(chunk_args + [i2 - i1]))
+
+    with ThreadPoolExecutor(max_workers=n_chunks) as executor:
+        # list() to raise exceptions from the threads
+        list(executor.map(run_chunk, range(n_chunks)))
+
+
 def binary_fill_gaps(M):
     N = np.zeros_like(M)
     lib.binary_fill_gaps(M, N, M.shape[0], M.shape[1])
@@ -277,6 +336,51 @@ def get_triangle_geometry(xy, z, triangles, n_triangles):
     return out
 
 
+def convex_hull(xy):
+    """
+    Calculate the convex hull of a set of points. Points inside the octagon spanned by the extreme points
+    in 8 directions are discarded first, and the hull of the remaining points is found with Andrew's monotone chain.
+    Args:
+        xy: numpy array of shape (n,2).
+    Returns:
+        A closed ring (numpy array of shape (m,2)) of hull vertices in counter clockwise order.
+    """
+    if xy.shape[0] == 0:
+        raise ValueError("No points.")
+    candidates = xy
+    directions = ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1))  # counter clockwise
+    octagon = []
+    for dx, dy in directions:
+        p = xy[np.argmax(xy[:, 0] * dx + xy[:, 1] * dy)]
+        if not octagon or not (p == octagon[-1]).all():
+            octagon.append(p)
+    if len(octagon) > 1 and (octagon[0] == octagon[-1]).all():
+        octagon.pop()
+    if len(octagon) > 2:
+        inside = np.ones(xy.shape[0], dtype=np.bool_)
+        for i, p in enumerate(octagon):
+            q = octagon[(i + 1) % len(octagon)]
+            inside &= (q[0] - p[0]) * (xy[:, 1] - p[1]) - (q[1] - p[1]) * (xy[:, 0] - p[0]) > 0
+        candidates = xy[np.logical_not(inside)]
+    candidates = candidates[np.lexsort((candidates[:, 1], candidates[:, 0]))]
+
+    def half_hull(points):
+        hull = []
+        for p in points:
+            while len(hull) > 1 and ((hull[-1][0] - hull[-2][0]) * (p[1] - hull[-2][1]) -
+                                     (hull[-1][1] - hull[-2][1]) * (p[0] - hull[-2][0])) <= 0:
+                hull.pop()
+            hull.append((p[0], p[1]))
+        return hull
+    lower = half_hull(candidates)
+    upper = half_hull(candidates[::-1])
+    hull = lower[:-1] + upper[:-1]
+    if not hull:
+        hull = lower
+    hull.append(hull[0])
+    return np.array(hull, dtype=np.float64)
+
+
 def get_bounds(geom):
     """Just return the bounding box for a geometry represented as a numpy array (or a list of arrays correpsponding to a polygon)."""
     if isinstance(geom, list):
@@ -289,6 +393,76 @@ def get_bounds(geom):
     return bbox
 
 
+class BBoxTree(object):
+    """
+    Static R-tree over a set of bounding boxes, packed with the Sort-Tile-Recursive algorithm:
+    boxes are sorted into vertical slices by the x of their center and within each slice by y,
+    and consecutive runs of node_size boxes make up the nodes of the next level.
+    Queries are vectorised level by level.
+    """
+
+    def __init__(self, bboxes, node_size=16):
+        """
+        Args:
+            bboxes: Array like of shape (n,4) with boxes as (xmin,ymin,xmax,ymax).
+            node_size: Max. number of children of a node.
+        """
+        boxes = np.asarray(bboxes, dtype=np.float64).reshape((-1, 4))
+        self.node_size = node_size
+        self.size = boxes.shape[0]
+        # levels from the root down, each (node boxes, start and end of children in the level below)
+        self.levels = []
+        self.ids = self._str_order(boxes)
+        self.boxes = boxes[self.ids]
+        level_boxes = self.boxes
+        while level_boxes.shape[0] > 0:
+            starts = np.arange(0, level_boxes.shape[0], node_size)
+            ends = np.minimum(starts + node_size, level_boxes.shape[0])
+            node_boxes = np.column_stack((np.minimum.reduceat(level_boxes[:, 0], starts),
+                                          np.minimum.reduceat(level_boxes[:, 1], starts),
+                                          np.maximum.reduceat(level_boxes[:, 2], starts),
+                                          np.maximum.reduceat(level_boxes[:, 3], starts)))
+            order = self._str_order(node_boxes)
+            self.levels.append((node_boxes[order], starts[order], ends[order]))
+            if node_boxes.shape[0] == 1:
+                break
+            level_boxes = node_boxes[order]
+        self.levels.reverse()
+
+    def _str_order(self, boxes):
+        # Sort-Tile-Recursive order of boxes
+        n = boxes.shape[0]
+        n_slices = int(np.ceil(np.sqrt(np.ceil(n / float(self.node_size)))))
+        cx = boxes[:, 0] + boxes[:, 2]
+        cy = boxes[:, 1] + boxes[:, 3]
+        by_x = np.argsort(cx, kind="mergesort")
+        slice_id = np.arange(n) // max(n_slices * self.node_size, 1)
+        return by_x[np.lexsort((cy[by_x], slice_id))]
+
+    def query(self, bbox):
+        """
+        Find the boxes intersecting a box.
+        Args:
+            bbox: The box as (xmin,ymin,xmax,ymax).
+        Returns:
+            Sorted numpy array of indices of the boxes (in the input order).
+        """
+        idx = np.arange(1 if self.size > 0 else 0)
+        for boxes, starts, ends in self.levels:
+            idx = idx[self._intersects(boxes[idx], bbox)]
+            # all children of the nodes hit
+            counts = ends[idx] - starts[idx]
+            offsets = np.repeat(starts[idx] - np.cumsum(counts) + counts, counts)
+            idx = offsets + np.arange(counts.sum())
+        idx = idx[self._intersects(self.boxes[idx], bbox)]
+        return np.sort(self.ids[idx])
+
+    @staticmethod
+    def _intersects(boxes, bbox):
+        return ((boxes[:, 0] <= bbox[2]) & (boxes[:, 2] >= bbox[0]) &
+                (boxes[:, 1] <= bbox[3]) & (boxes[:, 3] >= bbox[1]))
+
+
 def points2ogr_polygon(points):
     """Construct a OGR polygon from an input point list (not closed)"""
     # input an iterable of 2d 'points', slow interface for large collections...
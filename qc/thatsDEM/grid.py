@@ -168,10 +168,58 @@ def resample_grid(grid, nd_val, geo_ref_in, geo_ref_out, ncols_out, nrows_out):
     return out
 
 
-# slow, but flexible method designed to calc. some algebraic quantity of q's within every single cell
-def make_grid(xy, q, ncols, nrows, georef, nd_val=-9999, method=np.mean, dtype=np.float32):  # gdal-style georef
+# Reductions which make_grid can do vectorised, by name and by the equivalent callables.
+GRID_REDUCTIONS = ("mean", "min", "max", "count", "sum", "var", "median", "percentile")
+GRID_REDUCTION_FUNCTIONS = {np.mean: "mean", np.min: "min", np.amin: "min", np.max: "max", np.amax: "max",
+                            np.sum: "sum", np.var: "var", np.median: "median", len: "count", np.size: "count"}
+
+
+def reduce_segments(q, starts, method, percentile=50.0):
+    """
+    Reduce consecutive segments of an array.
+    Args:
+        q: 1d numpy array, sorted so that the values of each segment are consecutive.
+        starts: start index of each (non empty) segment - increasing, starting at 0.
+        method: One of GRID_REDUCTIONS.
+        percentile: The percentile (0-100) to calculate, if method is 'percentile'.
+    Returns:
+        1d numpy array with one value pr. segment.
+    """
+    counts = np.diff(np.append(starts, q.shape[0]))
+    if method == "count":
+        return counts
+    if method == "min":
+        return np.minimum.reduceat(q, starts)
+    if method == "max":
+        return np.maximum.reduceat(q, starts)
+    if method == "sum":
+        return np.add.reduceat(q, starts)
+    q = q.astype(np.float64)
+    if method == "mean":
+        return np.add.reduceat(q, starts) / counts
+    if method == "var":
+        # two pass - numerically better than E(q^2)-E(q)^2
+        d = q - np.repeat(np.add.reduceat(q, starts) / counts, counts)
+        return np.add.reduceat(d * d, starts) / counts
+    if method == "median":
+        method, percentile = "percentile", 50.0
+    if method == "percentile":
+        # sort within each segment and interpolate linearly between closest ranks (like np.percentile).
+        seg = np.repeat(np.arange(starts.shape[0]), counts)
+        q = q[np.lexsort((q, seg))]
+        pos = (counts - 1) * (percentile / 100.0)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, counts - 1)
+        frac = pos - lo
+        return q[starts + lo] * (1 - frac) + q[starts + hi] * frac
+    raise ValueError("Unsupported reduction: %s" % method)
+
+
+def make_grid(xy, q, ncols, nrows, georef, nd_val=-9999, method=np.mean, dtype=np.float32, percentile=50.0):  # gdal-style georef
     """
     Apply a function on scattered data (xy) to produce a regular grid. Will apply the supplied method on the points that fall within each output cell.
+    The reductions in GRID_REDUCTIONS (given by name or by the equivalent numpy function, e.g. np.mean) are vectorised over all cells,
+    any other callable is applied to the values of each cell in a (slow) python loop.
     Args:
         xy: numpy array of shape (n,2).
         q: 1d numpy array. The value to 'grid'.
@@ -179,23 +227,36 @@ def make_grid(xy, q, ncols, nrows, georef, nd_val=-9999, method=np.mean, dtype=n
         nrows: Number of rows in output.
         georef: GDAL style georeference (list / tuple containing 6 floats).
         nd_val: Output no data value.
-        method: The method to apply to the points that are contained in each cell.
+        method: The method to apply to the points that are contained in each cell - a name from GRID_REDUCTIONS or a callable.
         dtype: Output numpy data type.
+        percentile: The percentile (0-100) to calculate, if method is 'percentile'.
     Returns:
-        2d numpy array of shape (nrows,ncols).
+        A grid.Grid object with a 2d numpy array of shape (nrows,ncols).
+    Raises:
+        ValueError: If method is neither a supported reduction nor callable.
     """
+    if not callable(method) and method not in GRID_REDUCTIONS:
+        raise ValueError("Unsupported method: %s" % method)
     out = np.ones((nrows, ncols), dtype=dtype) * nd_val
     arr_coords = ((xy - (georef[0], georef[3])) / (georef[1], georef[5])).astype(np.int32)
     M = np.logical_and(arr_coords[:, 0] >= 0, arr_coords[:, 0] < ncols)
     M &= np.logical_and(arr_coords[:, 1] >= 0, arr_coords[:, 1] < nrows)
     arr_coords = arr_coords[M]
     q = q[M]
+    if q.shape[0] == 0:
+        return Grid(out, georef, nd_val)
     # create flattened index
     B = arr_coords[:, 1] * ncols + arr_coords[:, 0]
     # now sort array
     I = np.argsort(B)
     arr_coords = arr_coords[I]
     q = q[I]
+    reduction = method if not callable(method) else GRID_REDUCTION_FUNCTIONS.get(method)
+    if reduction is not None:
+        B = B[I]
+        starts = np.flatnonzero(np.append(True, B[1:] != B[:-1]))
+        out.flat[B[starts]] = reduce_segments(q, starts, reduction, percentile)
+        return Grid(out, georef, nd_val)
     # and finally loop through pts just one more time...
     box_index = arr_coords[0, 1] * ncols + arr_coords[0, 0]
     i0 = 0
@@ -246,6 +307,36 @@ def grid_most_frequent_value(xy, q, ncols, nrows, georef, v1=None, v2=None, nd_v
     return Grid(out, georef, nd_val)
 
 
+def count_points(xy, ncols, nrows, georef, include_edges=False):
+    """
+    Count the points (xy) within each cell of a grid, binning all points in one pass by a flattened cell index.
+    Grid extent specified via ncols, nrows and GDAL style georeference.
+
+    Args:
+        xy: numpy array of shape (n, 2).
+        ncols, nrows: shape of the grid.
+        georef: GDAL style georeference of the grid.
+        include_edges: by default cells include their upper and left edges, and points on the right and lower edge
+                       of the grid are not counted. If True cells include their lower and left edges (as the tiles
+                       do), and points on the right and upper edge of the grid are counted in the last column and
+                       first row.
+    Returns:
+        numpy int64 array of shape (nrows, ncols)
+    """
+    cols = np.floor((xy[:, 0] - georef[0]) / georef[1])
+    if include_edges:
+        rows = np.ceil((xy[:, 1] - georef[3]) / georef[5]) - 1
+        cols[xy[:, 0] == georef[0] + ncols * georef[1]] = ncols - 1
+        rows[xy[:, 1] == georef[3]] = 0
+    else:
+        rows = np.floor((xy[:, 1] - georef[3]) / georef[5])
+    M = np.logical_and(cols >= 0, cols < ncols)
+    M &= np.logical_and(rows >= 0, rows < nrows)
+    # create flattened index
+    B = (rows[M] * ncols + cols[M]).astype(np.int64)
+    return np.bincount(B, minlength=ncols * nrows).reshape((nrows, ncols))
+
+
 def user2array(georef, xy):
     # Return array coordinates (as int32 here) for input points in 'real'
     # coordinates. georef is a GDAL style georeference.
@@ -22,6 +22,12 @@ from builtins import range
 from builtins import object
 import sys
 import os
+import json
+import struct
+import zlib
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
 from osgeo import gdal
@@ -34,25 +40,59 @@ from . import array_geometry
 from . import vector_io
 # Should perhaps be moved to method in order to speed up import...
 from . import grid
-from math import ceil
+from ..utils import profiling
+from math import ceil, sqrt
 
 gdal.UseExceptions()
 
+# Pointclouds which are already loaded into memory, keyed by real path. Can be set pr. process
+# by a wrapper which runs several checks on the same tile, so that the file is only read once.
+PRELOADED = {}
+
+
+def set_preloaded(path, pc):
+    """
+    Register an in-memory pointcloud for a path. Subsequent calls to fromAny with that path
+    will be served from memory. The arrays of pc are shared (not copied) with the returned
+    pointclouds, so they should not be modified in place.
+    Args:
+        path: path to the file pc was loaded from.
+        pc: A pointcloud.Pointcloud object.
+    """
+    PRELOADED[os.path.realpath(path)] = pc
+
+
+def clear_preloaded():
+    """Forget all preloaded pointclouds."""
+    PRELOADED.clear()
+
+
+@profiling.profiled("read", points=lambda pc: pc.size)
 def fromAny(path, **kwargs):
     """
     Load a pointcloud from a range of 'formats'. The specific 'driver' to use is decided from the filename extension.
+    If a pointcloud for path has been registered with set_preloaded, that will be used instead of reading the file.
     Args:
         path: a 'connection string'
         additional keyword arguments will be passed on to the specific format handler.
     Returns:
         A pointcloud.Pointcloud object
     """
+    pc = None
+    if PRELOADED:
+        pc = PRELOADED.get(os.path.realpath(path))
+        if pc is not None:
+            pc = fromPreloaded(pc, **kwargs)
     # TODO - handle keywords properly - all methods, except fromLAS, will only
     # return xyz for now. Fix this...
     b, ext = os.path.splitext(path)
     # we could use /vsi<whatever> like GDAL to signal special handling - however keep it simple for now.
-    if ext == ".las" or ext == ".laz":
+    if pc is not None:
+        pass
+    elif ext == ".las" or ext == ".laz":
         pc = fromLAS(path, **kwargs)
+    elif ext == PCC_EXT:
+        pc = fromCache(path, **kwargs)
     elif ext == ".npy":
         pc = fromNpy(path, **kwargs)
     elif ext == ".txt":
@@ -65,30 +105,106 @@ def fromAny(path, **kwargs):
         pc = fromPatch(path, **kwargs)  # so we can look at patch-files...
     else:
         pc = fromOGR(path, **kwargs)
+    if ext in (".las", ".laz", PCC_EXT):
+        # These formats apply the filters in load time - remember how the points were selected.
+        pc.source = get_source(path, kwargs.get("cls"), kwargs.get("xy_box"), kwargs.get("z_box"))
+    return pc
 
 
-    return pc
+def get_source(path, cls=None, xy_box=None, z_box=None):
+    """
+    Describe how a pointcloud was loaded from a file, i.e. which points, in which order, it contains.
+    Used to key spatial index sidecar files (see Pointcloud.sort_spatially).
+    Args:
+        path: path to the file.
+        cls: list of classes filtered by in load time.
+        xy_box: (x1,y2,x2,y2) filtered by in load time.
+        z_box: (z1,z2) filtered by in load time.
+    Returns:
+        A dict with keys path, mtime, cls, xy_box and z_box.
+    """
+    return {"path": os.path.realpath(path),
+            "mtime": os.path.getmtime(path),
+            "cls": None if cls is None else sorted(set(int(c) for c in cls)),
+            "xy_box": None if xy_box is None else [float(v) for v in xy_box],
+            "z_box": None if z_box is None else [float(v) for v in z_box]}
+
+
+# Number of points read (and decompressed) at a time by fromLAS.
+LAS_CHUNK_SIZE = 2**20
 
 
 # read a las file and return a pointcloud - spatial selection by xy_box
 # (x1,y1,x2,y2) and / or z_box (z1,z2) and/or list of classes...
-def fromLAS(path, include_return_number=False, xy_box=None, z_box=None, cls=None, **kwargs):
+def fromLAS(path, include_return_number=False, xy_box=None, z_box=None, cls=None, chunk_size=LAS_CHUNK_SIZE, **kwargs):
     """
     Load a pointcloud from las / laz format via laspy.
 
-    Laz reading currently requires that laszip-cli is findable.
+    The file is read in chunks and the filters are applied to each chunk, so that only the
+    points which pass the filters are kept in memory. Only the dimensions needed for the
+    pointcloud (and for the filters) are decoded.
     Args:
         path: path to las / laz file.
         include_return_number: bool, indicates whether return number should be included.
-        xy_box: (x1,y2,x2,y2), filter by extent in load time. Will NOT work for laz files.
-        z_box: (z1,z2), filter by z-extent in load time. Will NOT work for laz files.
-        cls: list of classes to filter by in load time. Will NOT work for laz files.
+        xy_box: (x1,y2,x2,y2), filter by extent in load time.
+        z_box: (z1,z2), filter by z-extent in load time.
+        cls: list of classes to filter by in load time.
+        chunk_size: number of points to read at a time.
     Returns:
         A pointcloud.Pointcloud object.
     """
-    las = laspy.read(path)
-    pc = fromLaspy(las, include_return_number, xy_box, z_box, cls, close=False)
-    return pc
+    selection = (laspy.DecompressionSelection.XY_RETURNS_CHANNEL | laspy.DecompressionSelection.Z |
+                 laspy.DecompressionSelection.CLASSIFICATION | laspy.DecompressionSelection.POINT_SOURCE_ID)
+    names = ["xy", "z", "c", "pid"]
+    if include_return_number:
+        names.append("rn")
+    chunks = dict((name, []) for name in names)
+    with laspy.open(path, decompression_selection=selection) as reader:
+        header = reader.header
+        (sx, sy, sz), (ox, oy, oz) = header.scales, header.offsets
+        skip = False
+        if xy_box is not None:
+            (xmin, ymin) = header.mins[:2]
+            (xmax, ymax) = header.maxs[:2]
+            skip = xmin > xy_box[2] or xmax < xy_box[0] or ymin > xy_box[3] or ymax < xy_box[1]
+        if z_box is not None:
+            skip = skip or header.mins[2] >= z_box[1] or header.maxs[2] <= z_box[0]
+        if not skip and header.point_count > 0:
+            for points in reader.chunk_iterator(chunk_size):
+                # Reduce an index array one filter at a time - and only scale what is left.
+                c = points.classification
+                I = None
+                if cls is not None:
+                    I = np.flatnonzero(np.isin(c, cls))
+                x = points.X if I is None else points.X[I]
+                y = points.Y if I is None else points.Y[I]
+                x = x * sx + ox
+                y = y * sy + oy
+                if xy_box is not None:
+                    M = np.flatnonzero((x >= xy_box[0]) & (x <= xy_box[2]) & (y >= xy_box[1]) & (y <= xy_box[3]))
+                    x, y = x[M], y[M]
+                    I = M if I is None else I[M]
+                z = (points.Z if I is None else points.Z[I]) * sz + oz
+                if z_box is not None:
+                    M = np.flatnonzero((z > z_box[0]) & (z < z_box[1]))
+                    x, y, z = x[M], y[M], z[M]
+                    I = M if I is None else I[M]
+                chunks["xy"].append(np.column_stack((x, y)))
+                chunks["z"].append(z)
+                chunks["c"].append((c if I is None else c[I]).astype(np.int32))
+                pid = points.point_source_id
+                chunks["pid"].append((pid if I is None else pid[I]).astype(np.int32))
+                if include_return_number:
+                    rn = np.asarray(points.return_number)
+                    chunks["rn"].append((rn if I is None else rn[I]).astype(np.int32))
+    if len(chunks["z"]) == 0:
+        attrs = {"xy": np.empty((0, 2), dtype=np.float64), "z": np.empty((0,), dtype=np.float64)}
+        attrs.update((name, np.empty((0,), dtype=np.int32)) for name in names[2:])
+    elif len(chunks["z"]) == 1:
+        attrs = dict((name, chunks[name][0]) for name in names)
+    else:
+        attrs = dict((name, np.concatenate(chunks[name])) for name in names)
+    return Pointcloud(**attrs)
 
 def fromLaspy(las, include_return_number=False, xy_box=None, z_box=None, cls=None, **kwargs):
     '''
@@ -139,6 +255,338 @@ def fromLaspy(las, include_return_number=False, xy_box=None, z_box=None, cls=Non
     return Pointcloud(xy, z, cls, pid, r)
 
 
+def fromPreloaded(pc, include_return_number=False, xy_box=None, z_box=None, cls=None, **kwargs):
+    """
+    Create a Pointcloud object from a preloaded pointcloud, applying the same load time filters as fromLAS.
+    Args:
+        pc: A pointcloud.Pointcloud object.
+        include_return_number: bool, indicates whether return number should be included.
+        xy_box: (x1,y2,x2,y2), filter by extent.
+        z_box: (z1,z2), filter by z-extent.
+        cls: list of classes to filter by.
+    Returns:
+        A pointcloud.Pointcloud object or None if the preloaded pointcloud lacks requested attributes.
+    """
+    if include_return_number and pc.rn is None:
+        return None
+    if cls is not None and pc.c is None:
+        return None
+    I = None
+    if cls is not None:
+        I = np.isin(pc.c, cls)
+    if xy_box is not None:
+        (xmin, ymin, xmax, ymax) = xy_box
+        M = np.logical_and(pc.xy >= (xmin, ymin), pc.xy <= (xmax, ymax)).all(axis=1)
+        I = M if I is None else (I & M)
+    if z_box is not None:
+        (zmin, zmax) = z_box
+        M = np.logical_and(pc.z > zmin, pc.z < zmax)
+        I = M if I is None else (I & M)
+    if I is None:
+        # no filtering - share the arrays
+        out = Pointcloud(pc.xy, pc.z, pc.c, pc.pid, pc.rn)
+    else:
+        out = pc.cut(I)
+    if not include_return_number:
+        out.rn = None
+    return out
+
+
+# A simple columnar cache format for pointclouds: magic, header length (uint32), a json header and then
+# the attribute arrays, each aligned to PCC_ALIGN bytes and stored in the dtypes used by Pointcloud.
+# The arrays can thus be memory mapped and used directly, without any decoding or conversion.
+PCC_EXT = ".pcc"
+PCC_MAGIC = b"DHMQCPCC"
+PCC_ALIGN = 64
+PCC_ATTRS = (("xy", np.float64), ("z", np.float64), ("c", np.int32), ("pid", np.int32), ("rn", np.int32))
+
+# Spatial index sidecar files. These store the permutation and spatial index computed by Pointcloud.sort_spatially
+# for a given source (file, load time filters) and grid. Not used unless a directory is set.
+SPATIAL_INDEX_DIR = None
+SIDX_EXT = ".sidx"
+SIDX_MAGIC = b"DHMQCIDX"
+
+
+def set_spatial_index_dir(path):
+    """
+    Set the directory used for spatial index sidecar files, which will then be used by
+    Pointcloud.sort_spatially for pointclouds loaded (and cut to classes) from las/laz/pcc files.
+    Args:
+        path: directory (will be created if it does not exist) or None to disable sidecar files.
+    """
+    global SPATIAL_INDEX_DIR
+    if path is not None and not os.path.isdir(path):
+        os.makedirs(path)
+    SPATIAL_INDEX_DIR = path
+
+
+def _source_key(source):
+    # The parts of a source which determine the points. Splits (see Pointcloud.split_by) are only
+    # included when present, so that keys (and thus existing sidecar files) of whole files do not change.
+    key = [source["path"], source["cls"], source["xy_box"], source["z_box"]]
+    if source.get("split"):
+        key.append(source["split"])
+    return key
+
+
+def get_spatial_index_path(source, index_header):
+    """
+    Get the path of the spatial index sidecar file for a source (see get_source) and index header.
+    """
+    key = json.dumps(_source_key(source) + [[float(v) for v in index_header]])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    bname = os.path.splitext(os.path.basename(source["path"]))[0]
+    return os.path.join(SPATIAL_INDEX_DIR, "%s_%s%s" % (bname, digest, SIDX_EXT))
+
+
+def load_spatial_index(path, source, B):
+    """
+    Load a permutation and spatial index from a sidecar file if it is valid for the source and the flat cell indices B.
+    The file must be at least as new as the source and the permutation must actually sort B, with each point inside
+    the slice of its cell. These checks are O(n) and guard against in place modifications of the pointcloud.
+    Args:
+        path: path to sidecar file.
+        source: dict as returned by get_source.
+        B: flat cell index of each point (before sorting).
+    Returns:
+        permutation, spatial index - or None, None if there is no valid sidecar.
+    """
+    try:
+        header = _read_array_file_header(path, SIDX_MAGIC)
+    except (IOError, OSError, ValueError):
+        return None, None
+    n = B.shape[0]
+    if header["mtime"] != source["mtime"] or header["count"] != n:
+        return None, None
+    I = _map_array(path, header, "permutation")
+    spatial_index = _map_array(path, header, "spatial_index")
+    if np.bincount(I, minlength=n).max() != 1:
+        return None, None
+    B = B[I]
+    if n > 1 and (B[1:] < B[:-1]).any():
+        return None, None
+    pos = np.arange(n)
+    if not ((spatial_index[2 * B] <= pos) & (pos < spatial_index[2 * B + 1])).all():
+        return None, None
+    return I, spatial_index
+
+
+def dump_spatial_index(path, source, I, spatial_index):
+    """
+    Write a permutation and spatial index to a sidecar file.
+    Args:
+        path: path to sidecar file.
+        source: dict as returned by get_source.
+        I: the permutation which sorts the pointcloud.
+        spatial_index: the spatial index of the sorted pointcloud.
+    """
+    header = {"count": int(I.shape[0]), "mtime": source["mtime"]}
+    _write_array_file(path, SIDX_MAGIC, header, [("permutation", I), ("spatial_index", spatial_index)])
+
+
+# Triangulation cache files. These store the triangles, the (flattened) index and the triangle geometry
+# (see Pointcloud.get_triangle_geometry) calculated by Pointcloud.triangulate for a given source, e.g. a strip
+# of a tile cut to some classes. Checks run one after another on the same points will then only triangulate once.
+# Not used unless a directory is set.
+TIN_CACHE_DIR = None
+TIN_EXT = ".tin"
+TIN_MAGIC = b"DHMQCTIN"
+
+
+def set_tin_cache_dir(path):
+    """
+    Set the directory used for triangulation cache files, which will then be used by
+    Pointcloud.triangulate for pointclouds loaded from las/laz/pcc files (and cut to classes or split into strips).
+    Args:
+        path: directory (will be created if it does not exist) or None to disable the cache.
+    """
+    global TIN_CACHE_DIR
+    if path is not None and not os.path.isdir(path):
+        os.makedirs(path)
+    TIN_CACHE_DIR = path
+
+
+def get_tin_cache_path(source):
+    """
+    Get the path of the triangulation cache file for a source (see get_source).
+    """
+    key = json.dumps(_source_key(source))
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    bname = os.path.splitext(os.path.basename(source["path"]))[0]
+    return os.path.join(TIN_CACHE_DIR, "%s_%s%s" % (bname, digest, TIN_EXT))
+
+
+def _checksum(arr):
+    # cheap (adler32) checksum of the data of an array - used to detect in place modifications of points.
+    return zlib.adler32(np.ascontiguousarray(arr).view(np.uint8)) & 0xffffffff
+
+
+def load_tin(path, source, xy, z):
+    """
+    Load triangles, index and triangle geometry from a cache file if it is valid for the source and the points.
+    The points (xy) must be unchanged since the file was written, as checked by a checksum. The triangle geometry
+    depends on z, and is only returned if z is unchanged as well.
+    Args:
+        path: path to cache file.
+        source: dict as returned by get_source.
+        xy: the points.
+        z: the z values of the points.
+    Returns:
+        triangles, index (see triangle.TriangulationBase.dump_index), triangle geometry
+        - or None, None, None if there is no valid cache file. The triangle geometry is None if z has changed.
+    """
+    try:
+        header = _read_array_file_header(path, TIN_MAGIC)
+    except (IOError, OSError, ValueError):
+        return None, None, None
+    n = xy.shape[0]
+    if header["mtime"] != source["mtime"] or header["count"] != n or header["xy_checksum"] != _checksum(xy):
+        return None, None, None
+    triangles = _map_array(path, header, "triangles")
+    if triangles.min() < 0 or triangles.max() >= n:
+        return None, None, None
+    index = tuple(_map_array(path, header, name) for name in ("index_header", "index_offsets", "index_data"))
+    geometry = None
+    if header["z_checksum"] == _checksum(z):
+        geometry = _map_array(path, header, "geometry")
+    return triangles, index, geometry
+
+
+def dump_tin(path, source, xy, z, triangulation, geometry):
+    """
+    Write triangles, index and triangle geometry to a cache file.
+    Args:
+        path: path to cache file.
+        source: dict as returned by get_source.
+        xy: the points.
+        z: the z values of the points (used for the geometry).
+        triangulation: triangle.Triangulation of the points.
+        geometry: numpy (m,3) float32 array of triangle geometry.
+    """
+    header = {"count": int(z.shape[0]), "mtime": source["mtime"], "xy_checksum": _checksum(xy),
+              "z_checksum": _checksum(z)}
+    index_header, index_offsets, index_data = triangulation.dump_index()
+    _write_array_file(path, TIN_MAGIC, header, [("triangles", triangulation.triangles), ("index_header", index_header),
+                                                ("index_offsets", index_offsets), ("index_data", index_data),
+                                                ("geometry", geometry)])
+
+
+def _write_array_file(path, magic, header, arrays):
+    # The array offsets depend on the header size, which depends on the offsets...
+    # Iterate until the header size is stable. Write to a temporary file first, so that
+    # concurrent readers never see a partially written file.
+    header["arrays"] = {}
+    offsets = [0] * len(arrays)
+    while True:
+        for (name, arr), offset in zip(arrays, offsets):
+            header["arrays"][name] = {"offset": offset, "dtype": arr.dtype.str, "shape": list(arr.shape)}
+        raw = json.dumps(header).encode("utf-8")
+        pos = len(magic) + 4 + len(raw)
+        new_offsets = []
+        for name, arr in arrays:
+            pos = -(-pos // PCC_ALIGN) * PCC_ALIGN
+            new_offsets.append(pos)
+            pos += arr.nbytes
+        if new_offsets == offsets:
+            break
+        offsets = new_offsets
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(magic)
+        f.write(struct.pack("<I", len(raw)))
+        f.write(raw)
+        for (name, arr), offset in zip(arrays, offsets):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(arr.tobytes())
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def _read_array_file_header(path, magic):
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("%s is not a %s file." % (path, magic.decode("ascii")))
+        n = struct.unpack("<I", f.read(4))[0]
+        return json.loads(f.read(n).decode("utf-8"))
+
+
+def _map_array(path, header, name):
+    # copy-on-write, so that the c functions (which want writeable arrays) can use it directly.
+    spec = header["arrays"][name]
+    return np.memmap(path, dtype=np.dtype(spec["dtype"]), mode="c", offset=spec["offset"], shape=tuple(spec["shape"]))
+
+
+def read_cache_header(path):
+    """
+    Read the json header of a pointcloud cache file.
+    Args:
+        path: path to .pcc file.
+    Returns:
+        dict with keys count, bounds, z_bounds, class_histogram and arrays.
+    Raises:
+        ValueError: If the file is not a pointcloud cache file.
+    """
+    return _read_array_file_header(path, PCC_MAGIC)
+
+
+def fromCache(path, include_return_number=False, xy_box=None, z_box=None, cls=None, **kwargs):
+    """
+    Load a pointcloud from a .pcc cache file (see Pointcloud.dump_cache). The arrays are memory mapped
+    copy-on-write, so nothing is read from disk before it is used, and modifying the pointcloud in place will not change the file.
+    Filters are applied as in fromLAS. Filters which cannot remove any points (judged from the header) are skipped.
+    Args:
+        path: path to .pcc file.
+        include_return_number: bool, indicates whether return number should be included.
+        xy_box: (x1,y2,x2,y2), filter by extent in load time.
+        z_box: (z1,z2), filter by z-extent in load time.
+        cls: list of classes to filter by in load time.
+    Returns:
+        A pointcloud.Pointcloud object.
+    Raises:
+        ValueError: If return numbers or classes are requested but not stored in the file.
+    """
+    header = read_cache_header(path)
+    arrays = header["arrays"]
+    if include_return_number and "rn" not in arrays:
+        raise ValueError("No return numbers stored in %s" % path)
+    if cls is not None and "c" not in arrays:
+        raise ValueError("No classes stored in %s" % path)
+    n = header["count"]
+    present = [int(c) for c, count in header["class_histogram"].items() if count > 0]
+    empty = n == 0
+    if cls is not None and "c" in arrays:
+        if not set(present).intersection(cls):
+            empty = True
+        elif set(present).issubset(cls):
+            cls = None
+    if xy_box is not None and not empty:
+        (x1, y1, x2, y2) = header["bounds"]
+        if x1 > xy_box[2] or x2 < xy_box[0] or y1 > xy_box[3] or y2 < xy_box[1]:
+            empty = True
+        elif x1 >= xy_box[0] and y1 >= xy_box[1] and x2 <= xy_box[2] and y2 <= xy_box[3]:
+            xy_box = None
+    if z_box is not None and not empty:
+        (z1, z2) = header["z_bounds"]
+        if z1 >= z_box[1] or z2 <= z_box[0]:
+            empty = True
+        elif z1 > z_box[0] and z2 < z_box[1]:
+            z_box = None
+    attrs = {}
+    for name, dtype in PCC_ATTRS:
+        if name not in arrays or (name == "rn" and not include_return_number):
+            continue
+        if empty:
+            shape = (0,) + tuple(arrays[name]["shape"][1:])
+            attrs[name] = np.empty(shape, dtype=dtype)
+        else:
+            attrs[name] = _map_array(path, header, name)
+    pc = Pointcloud(**attrs)
+    if empty:
+        return pc
+    return fromPreloaded(pc, include_return_number, xy_box, z_box, cls)
+
+
 def fromNpy(path, **kwargs):
     """
     Load a pointcloud from a platform independent numpy .npy file. Will only keep xyz.
@@ -283,6 +731,46 @@ def fromOGR(path, layername=None, layersql=None, extent=None):
     return Pointcloud(points[:, :2], points[:, 2])
 
 
+def circumcircles_within(xy, triangles, area, bounds):
+    """
+    Check whether the parts of the circumcircles of triangles which are within bounds
+    (where there are points), are (strictly) within an area. Checked using the bounding
+    box of that part of each circle, so a few circles within the area might be missed.
+    Args:
+        xy: numpy array of vertices, shape (n,2).
+        triangles: numpy int array of vertex indices, shape (m,3).
+        area: (x1,y1,x2,y2) - may contain infinite values.
+        bounds: (x1,y1,x2,y2).
+    Returns:
+        Numpy 1d boolean array.
+    """
+    # relative to the first vertex to avoid loss of precision for large coordinates
+    a = xy[triangles[:, 0]]
+    b = xy[triangles[:, 1]] - a
+    c = xy[triangles[:, 2]] - a
+    d = 2 * (b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0])
+    b2 = (b ** 2).sum(axis=1)
+    c2 = (c ** 2).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ux = (c[:, 1] * b2 - b[:, 1] * c2) / d
+        uy = (b[:, 0] * c2 - c[:, 0] * b2) / d
+    r = np.sqrt(ux ** 2 + uy ** 2)
+    ux += a[:, 0]
+    uy += a[:, 1]
+    # half width of the circle within the y-range of bounds, and half height within the x-range.
+    dy = np.maximum(np.maximum(bounds[1] - uy, uy - bounds[3]), 0)
+    dx = np.maximum(np.maximum(bounds[0] - ux, ux - bounds[2]), 0)
+    with np.errstate(invalid="ignore"):
+        hw = np.sqrt(r ** 2 - dy ** 2)
+        hh = np.sqrt(r ** 2 - dx ** 2)
+    # circles not reaching into bounds (nan) are fine
+    hw[np.isnan(hw)] = -np.inf
+    hh[np.isnan(hh)] = -np.inf
+    ok = ((np.maximum(ux - hw, bounds[0]) > area[0]) & (np.maximum(uy - hh, bounds[1]) > area[1]) &
+          (np.minimum(ux + hw, bounds[2]) < area[2]) & (np.minimum(uy + hh, bounds[3]) < area[3]))
+    return ok & np.isfinite(r)
+
+
 def empty_like(pc):
     """
     Contruct and empty Pointcloud object with same attributes as input pointcloud.
@@ -298,6 +786,68 @@ def empty_like(pc):
     return out
 
 
+class PointcloudCache(object):
+    """
+    A least recently used cache of Pointcloud objects bounded by the total size (in bytes) of the cached arrays.
+    Meant to be kept pr. process, e.g. to avoid reading the same tiles again and again.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Return the cached pointcloud for key (and mark it as recently used) or None."""
+        pc = self.entries.get(key)
+        if pc is not None:
+            self.entries.move_to_end(key)
+        return pc
+
+    def put(self, key, pc):
+        """
+        Cache a pointcloud, evicting the least recently used entries until it fits.
+        Pointclouds larger than max_bytes will not be cached.
+        """
+        self.discard(key)
+        nbytes = pc.get_nbytes()
+        if nbytes > self.max_bytes:
+            return
+        while self.nbytes + nbytes > self.max_bytes:
+            _, old = self.entries.popitem(last=False)
+            self.nbytes -= old.get_nbytes()
+        self.entries[key] = pc
+        self.nbytes += nbytes
+
+    def discard(self, key):
+        """Remove an entry if present."""
+        pc = self.entries.pop(key, None)
+        if pc is not None:
+            self.nbytes -= pc.get_nbytes()
+
+    def set_max_bytes(self, max_bytes):
+        """Change the size limit, evicting entries if needed."""
+        self.max_bytes = max_bytes
+        while self.nbytes > self.max_bytes:
+            _, old = self.entries.popitem(last=False)
+            self.nbytes -= old.get_nbytes()
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+# Statistics calculated by Pointcloud.multi_filter - in the order the library writes them.
+MULTI_FILTER_DTYPE = np.dtype([("min", np.float64), ("max", np.float64), ("mean", np.float64),
+                               ("var", np.float64), ("count", np.float64), ("distance", np.float64)])
+
+
 class Pointcloud(object):
     """
     Pointcloud class constructed from a xy and a z array. Optionally also classification,point source id and return number integer arrays
@@ -313,9 +863,13 @@ class Pointcloud(object):
         self.pid = int_array_factory(pid)
         self.triangulation = None
         self.triangle_validity_mask = None
+        # (checksum of z, triangle geometry) from a triangulation cache file - only valid while z is unchanged.
+        self.cached_geometry = None
         self.bbox = None  # [x1,y1,x2,y2]
         self.index_header = None
         self.spatial_index = None
+        # how the points were loaded (see get_source) - None if unknown or modified since.
+        self.source = None
         # TODO: implement attribute handling nicer....
         self.pc_attrs = ["xy", "z", "c", "pid", "rn"]
 
@@ -408,6 +962,10 @@ class Pointcloud(object):
         """Return point count."""
         return self.xy.shape[0]
 
+    def get_nbytes(self):
+        """Return the number of bytes used by the point attribute arrays."""
+        return sum(self.__dict__[a].nbytes for a in self.pc_attrs if self.__dict__[a] is not None)
+
     def get_classes(self):
         """Return the list of unique classes."""
         if self.c is not None:
@@ -415,6 +973,20 @@ class Pointcloud(object):
         else:
             return []
 
+    def class_histogram(self, minlength=0):
+        """
+        Count the points of each class in a single pass.
+        Args:
+            minlength: minimal length of the output (e.g. the largest class of interest + 1).
+        Returns:
+            Integer array with the number of points of class i at index i.
+        Raises:
+            ValueError: if class attribute is not set.
+        """
+        if self.c is None:
+            raise ValueError("Class attribute not set.")
+        return np.bincount(self.c, minlength=minlength)
+
     def get_strips(self):
         # just an alias
         return self.get_pids()
@@ -534,9 +1106,9 @@ class Pointcloud(object):
         if self.c is None:
             raise ValueError("Class attribute not set.")
         try:
-            cs = iter(c)
+            cs = list(c)
         except:
-            cs = (c,)
+            cs = [c]
         if exclude:
             I = np.ones((self.c.shape[0],), dtype=np.bool_)
         else:
@@ -547,7 +1119,14 @@ class Pointcloud(object):
                 I &= (self.c != this_c)
             else:
                 I |= (self.c == this_c)
-        return self.cut(I)
+        pc = self.cut(I)
+        if self.source is not None and not exclude:
+            # Same points as loading with this class filter.
+            cls = set(int(this_c) for this_c in cs)
+            if self.source["cls"] is not None:
+                cls &= set(self.source["cls"])
+            pc.source = dict(self.source, cls=sorted(cls))
+        return pc
 
     def cut_to_return_number(self, rn):
         """
@@ -591,15 +1170,94 @@ class Pointcloud(object):
         I = (self.pid == id)
         return self.cut(I)
 
+    def split_by(self, attr="pid"):
+        """
+        Split the pointcloud into groups of points with the same value of an attribute, e.g. into strips.
+        The points are reordered (stably) by the attribute once, and each group is a slice of the reordered
+        arrays - much cheaper than a cut_to_strip (a full scan and copy) for each strip.
+        Note that the groups share memory, so modifying points of one group in place is fine,
+        but the groups should not be extended or the like.
+        If the pointcloud was loaded from a file, the groups remember it (see get_source), so that
+        their spatial indices and triangulations can be cached.
+        Args:
+            attr: The attribute to split by, one of "pid" (strips), "c" (classes) or "rn" (return numbers).
+        Returns:
+            OrderedDict of attribute value -> Pointcloud object, sorted by value.
+        Raises:
+            ValueError: If the attribute is not set.
+        """
+        if attr not in ("c", "pid", "rn"):
+            raise ValueError("Can only split by c, pid or rn.")
+        values = self.__dict__[attr]
+        if values is None:
+            raise ValueError("Attribute %s not set." % attr)
+        groups = OrderedDict()
+        if values.size == 0:
+            return groups
+        if values.min() >= 0 and values.max() < max(values.size, 2**16):
+            counts = np.bincount(values)
+            group_values = np.flatnonzero(counts)
+            counts = counts[group_values]
+            # number the groups 0,1,... in a small integer type - numpy uses a (fast) radix sort for those.
+            if len(group_values) <= 2**8:
+                dtype = np.uint8
+            elif len(group_values) <= 2**16:
+                dtype = np.uint16
+            else:
+                dtype = np.int64
+            lut = np.zeros(values.max() + 1, dtype=dtype)
+            lut[group_values] = np.arange(len(group_values))
+            group_numbers = lut[values]
+        else:
+            # negative or sparse values - number the groups by sorting.
+            group_values, group_numbers, counts = np.unique(values, return_inverse=True, return_counts=True)
+        ends = np.cumsum(counts)
+        I = np.argsort(group_numbers, kind="stable")
+        attrs = dict((a, np.take(self.__dict__[a], I, axis=0))
+                     for a in ("xy", "z", "c", "pid", "rn") if self.__dict__[a] is not None)
+        for value, i2, n in zip(group_values, ends, counts):
+            pc = Pointcloud(attrs["xy"][i2 - n:i2], attrs["z"][i2 - n:i2])
+            for a in ("c", "pid", "rn"):
+                if a in attrs:
+                    pc.__dict__[a] = attrs[a][i2 - n:i2]
+            if self.source is not None:
+                pc.source = dict(self.source, split=self.source.get("split", []) + [[attr, int(value)]])
+            groups[int(value)] = pc
+        return groups
+
     def triangulate(self):
         """
         Triangulate the pointcloud. Will do nothing if triangulation is already calculated.
+        If a triangulation cache directory is set (see set_tin_cache_dir) and the pointcloud is loaded from a las/laz/pcc file,
+        the triangles and triangle geometry are stored in a cache file and reused the next time the same points are triangulated.
         Raises:
             ValueError: If not at least 3 points in pointcloud
         """
         if self.triangulation is None:
             if self.xy.shape[0] > 2:
-                self.triangulation = triangle.Triangulation(self.xy)
+                cache_path = None
+                if TIN_CACHE_DIR is not None and self.source is not None:
+                    cache_path = get_tin_cache_path(self.source)
+                    with profiling.stage("load_tin", self.xy.shape[0]):
+                        triangles, index, geometry = load_tin(cache_path, self.source, self.xy, self.z)
+                        if triangles is not None:
+                            try:
+                                self.triangulation = triangle.Triangulation(self.xy, triangles=triangles, index=index)
+                            except ValueError:  # index does not match
+                                self.triangulation = None
+                    if self.triangulation is not None:
+                        if geometry is not None:
+                            self.cached_geometry = (_checksum(self.z), geometry)
+                        return
+                with profiling.stage("triangulate", self.xy.shape[0]):
+                    self.triangulation = triangle.Triangulation(self.xy)
+                if cache_path is not None:
+                    geometry = self.get_triangle_geometry()
+                    try:
+                        dump_tin(cache_path, self.source, self.xy, self.z, self.triangulation, geometry)
+                    except (IOError, OSError) as e:
+                        print("Could not write triangulation cache file: %s" % str(e))
+                    self.cached_geometry = (_checksum(self.z), geometry)
             else:
                 raise ValueError("Less than 3 points - unable to triangulate.")
 
@@ -638,7 +1296,8 @@ class Pointcloud(object):
         return self.triangle_validity_mask
 
     def get_grid(self, ncols=None, nrows=None, x1=None, x2=None, y1=None, y2=None,
-                 cx=None, cy=None, nd_val=-999, crop=0, method="triangulation"):
+                 cx=None, cy=None, nd_val=-999, crop=0, method="triangulation",
+                 n_threads=None, block_size=None, halo=None):
         """
         Grid (an attribute of) the pointcloud.
         Will calculate grid size and georeference from supplied input (or pointcloud extent).
@@ -654,6 +1313,10 @@ class Pointcloud(object):
             nd_val: grid no data value.
             crop: if calculating grid extent from pointcloud extent, crop the extent by this amount (should not be needed).
             method: One of the supported method/attribute names - triangulation,return_triangles,density,class,pid.
+            n_threads: For triangulation and return_triangles: if the pointcloud is not triangulated yet,
+                       triangulate and grid blocks of the grid in this many threads (see grid_in_blocks).
+            block_size: Size of blocks in cells, if n_threads is given.
+            halo: Width of the halo of points around each block, if n_threads is given.
         Returns:
             A grid.Grid object and a grid.Grid object with triangle sizes if 'return_triangles' is specified.
         Raises:
@@ -691,6 +1354,11 @@ class Pointcloud(object):
             cy = (y2 - y1) / float(nrows)
         # geo ref gdal style...
         geo_ref = [x1, cx, 0, y2, 0, -cy]
+        if method in ("triangulation", "return_triangles") and self.triangulation is None and n_threads:
+            g, t = self.grid_in_blocks(ncols, nrows, x1, cx, y2, cy, nd_val, n_threads, block_size, halo)
+            if method == "triangulation":
+                return grid.Grid(g, geo_ref, nd_val)
+            return grid.Grid(g, geo_ref, nd_val), grid.Grid(t, geo_ref, nd_val)
         if method == "triangulation":  # should be special method not to mess up earlier code...
             if self.triangulation is None:
                 raise ValueError("Create a triangulation first...")
@@ -704,17 +1372,7 @@ class Pointcloud(object):
                 self.z, ncols, nrows, x1, cx, y2, cy, nd_val, return_triangles=True)
             return grid.Grid(g, geo_ref, nd_val), grid.Grid(t, geo_ref, nd_val)
         elif method == "density":  # density grid
-            arr_coords = ((self.xy - (geo_ref[0], geo_ref[3])) /
-                          (geo_ref[1], geo_ref[5])).astype(np.int32)
-            M = np.logical_and(arr_coords[:, 0] >= 0, arr_coords[:, 0] < ncols)
-            M &= np.logical_and(arr_coords[:, 1] >= 0, arr_coords[:, 1] < nrows)
-            arr_coords = arr_coords[M]
-            # Wow - this gridding is sooo simple! and fast!
-            # create flattened index
-            B = arr_coords[:, 1] * ncols + arr_coords[:, 0]
-            bins = np.arange(0, ncols * nrows + 1)
-            h, b = np.histogram(B, bins)
-            h = h.reshape((nrows, ncols))
+            h = grid.count_points(self.xy, ncols, nrows, geo_ref)
             return grid.Grid(h, geo_ref, nd_val)  # zero always nodata value here...
         elif method == "class":
             # define method which takes the most frequent value in a cell... could be only mean...
@@ -727,6 +1385,114 @@ class Pointcloud(object):
         else:
             raise ValueError("Unsupported method.")
 
+    @profiling.profiled("grid_in_blocks", points=lambda gt: 0)
+    def grid_in_blocks(self, ncols, nrows, x1, cx, y2, cy, nd_val=-999, n_threads=4, block_size=None, halo=None):
+        """
+        Triangulate and grid the pointcloud block by block in a pool of threads. Gives the same result as
+        gridding from the triangulation of the whole pointcloud (see get_grid).
+        Each block is triangulated with the points within the block and a halo around it. A cell is taken
+        from the triangulation of the block if the triangle containing the cell center is also a triangle of
+        the triangulation of the whole pointcloud - which is the case if its circumcircle is within the area
+        the points were taken from. Blocks with remaining cells are done again with a larger halo, and
+        cells still remaining (e.g. in large areas without points) are gridded from the triangulation of
+        the whole pointcloud, which is then calculated.
+        Args:
+            ncols: number of columns.
+            nrows: number of rows.
+            x1: left edge of grid.
+            cx: horisontal cell size.
+            y2: upper edge of grid.
+            cy: vertical cell size (positive).
+            nd_val: grid no data value.
+            n_threads: number of threads.
+            block_size: size of blocks in cells. Defaults to a size giving about two blocks pr. thread.
+            halo: width of the halo in map units. Defaults to 10 times the mean point distance.
+        Returns:
+            Numpy 2d float32 arrays with interpolated values and with triangle sizes (see triangle.make_grid).
+        """
+        bbox = self.get_bounds()
+        if halo is None:
+            area = max((bbox[2] - bbox[0]) * (bbox[3] - bbox[1]), 1e-6)
+            halo = max(10 * sqrt(area / max(self.size, 1)), 2 * max(cx, cy))
+        if block_size is None:
+            n_split = int(ceil(sqrt(2 * n_threads)))
+            block_size = int(ceil(max(ncols, nrows) / float(n_split)))
+        block_size = max(int(block_size), 1)
+        g = np.full((nrows, ncols), nd_val, dtype=np.float32)
+        t = np.full((nrows, ncols), nd_val, dtype=np.float32)
+        # cells not done yet
+        todo = np.ones((nrows, ncols), dtype=np.bool_)
+        # cells outside the triangulation of a block - but perhaps not of the whole pointcloud
+        outside_block = np.zeros((nrows, ncols), dtype=np.bool_)
+
+        def do_block(block, halo):
+            r1, r2, c1, c2 = block
+            bx1 = x1 + c1 * cx
+            by2 = y2 - r1 * cy
+            todo_block = todo[r1:r2, c1:c2]
+            # the area points are taken from. Sides beyond the pointcloud are unbounded.
+            area = [bx1 - halo, y2 - r2 * cy - halo, x1 + c2 * cx + halo, by2 + halo]
+            M = ((self.xy[:, 0] >= area[0]) & (self.xy[:, 0] <= area[2]) &
+                 (self.xy[:, 1] >= area[1]) & (self.xy[:, 1] <= area[3]))
+            area = [-np.inf if area[0] < bbox[0] else area[0], -np.inf if area[1] < bbox[1] else area[1],
+                    np.inf if area[2] > bbox[2] else area[2], np.inf if area[3] > bbox[3] else area[3]]
+            yc, xc = np.mgrid[r1:r2, c1:c2]
+            centers = np.column_stack(((x1 + (xc.ravel() + 0.5) * cx), (y2 - (yc.ravel() + 0.5) * cy)))
+            # cells outside the bounds of the pointcloud are outside any triangulation
+            outside = ((centers[:, 0] < bbox[0]) | (centers[:, 0] > bbox[2]) |
+                       (centers[:, 1] < bbox[1]) | (centers[:, 1] > bbox[3])).reshape(xc.shape)
+            if M.sum() < 3:
+                todo_block &= ~outside
+                return
+            xy = np.ascontiguousarray(self.xy[M])
+            z = np.ascontiguousarray(self.z[M])
+            tri = triangle.Triangulation(xy)
+            g_block, t_block = tri.make_grid(z, c2 - c1, r2 - r1, bx1, cx, by2, cy, nd_val, return_triangles=True)
+            valid = circumcircles_within(xy, tri.get_triangles(), area, bbox)
+            # the triangles make_grid used for the cell centers
+            found = tri.find_triangles(centers, valid).reshape(g_block.shape)
+            ok = found >= 0
+            # outside of the triangulation of the block - and of the whole pointcloud if the area is unbounded.
+            if np.isinf(area).all():
+                ok |= found == -2
+            ok |= (found == -2) & outside
+            ok &= todo_block
+            g[r1:r2, c1:c2][ok] = g_block[ok]
+            t[r1:r2, c1:c2][ok] = t_block[ok]
+            todo_block &= ~ok
+            outside_block[r1:r2, c1:c2] = todo_block & (found == -2)
+
+        blocks = [(r, min(r + block_size, nrows), c, min(c + block_size, ncols))
+                  for r in range(0, nrows, block_size) for c in range(0, ncols, block_size)]
+        hull = None
+        for attempt in range(3):
+            blocks = [b for b in blocks if todo[b[0]:b[1], b[2]:b[3]].any()]
+            if not blocks:
+                break
+            halo_here = halo * 4 ** attempt
+            with ThreadPoolExecutor(max_workers=max(min(n_threads, len(blocks)), 1)) as executor:
+                # list() to raise exceptions from the threads
+                list(executor.map(lambda block: do_block(block, halo_here), blocks))
+            if outside_block.any():
+                # outside the convex hull of the pointcloud means outside of its triangulation
+                if hull is None:
+                    hull = array_geometry.convex_hull(self.xy)
+                rows, cols = np.nonzero(outside_block)
+                centers = np.column_stack((x1 + (cols + 0.5) * cx, y2 - (rows + 0.5) * cy))
+                inside = array_geometry.points_in_polygon(centers, [hull])
+                todo[rows[~inside], cols[~inside]] = False
+                outside_block[:] = False
+        if todo.any():
+            self.triangulate()
+            rows, cols = np.nonzero(todo)
+            r1, r2, c1, c2 = rows.min(), rows.max() + 1, cols.min(), cols.max() + 1
+            g_win, t_win = self.triangulation.make_grid(
+                self.z, c2 - c1, r2 - r1, x1 + c1 * cx, cx, y2 - r1 * cy, cy, nd_val, return_triangles=True)
+            win = todo[r1:r2, c1:c2]
+            g[r1:r2, c1:c2][win] = g_win[win]
+            t[r1:r2, c1:c2][win] = t_win[win]
+        return g, t
+
     def find_triangles(self, xy_in, mask=None):
         """
         Find the (valid) containing triangles for an array of points.
@@ -824,6 +1590,8 @@ class Pointcloud(object):
         """
         if self.triangulation is None:
             raise ValueError("Create a triangulation first...")
+        if self.cached_geometry is not None and self.cached_geometry[0] == _checksum(self.z):
+            return self.cached_geometry[1]
         return array_geometry.get_triangle_geometry(
             self.xy, self.z, self.triangulation.vertices, self.triangulation.ntrig)
 
@@ -858,7 +1626,7 @@ class Pointcloud(object):
         if R is not None:
             self.xy = (np.dot(R, self.xy.T).T).copy()
         if T is not None:
-            self.xy += T
+            self.xy = self.xy + T
 
     def toE(self, geoid):
         """
@@ -869,7 +1637,8 @@ class Pointcloud(object):
         # warp to ellipsoidal heights
         toE = geoid.interpolate(self.xy)
         assert((toE != geoid.nd_val).all())
-        self.z += toE
+        # not in place on the array, which might be shared with a preloaded pointcloud
+        self.z = self.z + toE
 
     def toH(self, geoid):
         """
@@ -880,11 +1649,12 @@ class Pointcloud(object):
         # warp to orthometric heights. z bounds not stored, so no need to recalculate.
         toE = geoid.interpolate(self.xy)
         assert((toE != geoid.nd_val).all())
-        self.z -= toE
+        self.z = self.z - toE
 
     def set_class(self, c):
         """Explicitely set the class attribute to be c for all points."""
         self.c = np.ones(self.z.shape, dtype=np.int32) * c
+        self.source = None
     # dump methods
 
     def dump_csv(self, f, callback=None):
@@ -925,6 +1695,23 @@ class Pointcloud(object):
         xyz = np.column_stack((self.xy, self.z))
         np.save(path, xyz)
 
+    def dump_cache(self, path):
+        """
+        Dump the pointcloud as a .pcc cache file which can be memory mapped by fromCache.
+        Args:
+            path: Filename to dump to.
+        """
+        header = {"count": int(self.get_size()), "bounds": None, "z_bounds": None, "class_histogram": {}}
+        if self.get_size() > 0:
+            header["bounds"] = [float(v) for v in self.get_bounds()]
+            header["z_bounds"] = [float(v) for v in self.get_z_bounds()]
+        if self.c is not None:
+            classes, counts = np.unique(self.c, return_counts=True)
+            header["class_histogram"] = {str(c): int(n) for c, n in zip(classes, counts)}
+        arrays = [(name, np.require(self.__dict__[name], dtype=dtype, requirements=['A', 'C']))
+                  for name, dtype in PCC_ATTRS if self.__dict__[name] is not None]
+        _write_array_file(path, PCC_MAGIC, header, arrays)
+
     def dump_bin(self, path):
         """
         Dump the pointcloud as a (platform dependent) binary file. Each entry will consists of x,y,z,class,pid as doubles.
@@ -941,11 +1728,14 @@ class Pointcloud(object):
             np.float64)
         xyzcp.tofile(path)
 
+    @profiling.profiled("sort_spatially", points=lambda pc: pc.size)
     def sort_spatially(self, cs, shape=None, xy_ul=None):
         """
         Primitive spatial sorting by creating a 'virtual' 2D grid covering the pointcloud and thus a 1D index by consecutive c style numbering of cells.
         Keep track of 'slices' of the pointcloud within each 'virtual' cell.
         As the pointcloud is reordered all derived attributes will be cleared.
+        If a spatial index directory is set (see set_spatial_index_dir) and the pointcloud is loaded from a las/laz/pcc file,
+        the sorting is stored in a sidecar file and reused the next time the same points are sorted on the same grid.
         Returns:
             A reference to self.
         """
@@ -954,6 +1744,7 @@ class Pointcloud(object):
             raise Exception("No way to sort an empty pointcloud.")
         if (bool(shape) != bool(xy_ul)):  # either both None or both given
             raise ValueError("Neither or both of shape and xy_ul should be specified.")
+        source = self.source
         self.clear_derived_attrs()
         if shape is None:
             x1, y1, x2, y2 = self.get_bounds()
@@ -968,17 +1759,30 @@ class Pointcloud(object):
         Mx, My = arr_coords.max(axis=0)
         assert(min(mx, my) >= 0 and Mx < ncols and My < nrows)
         B = arr_coords[:, 1] * ncols + arr_coords[:, 0]
-        I = np.argsort(B)
-        B = B[I]
-        self.spatial_index = np.ones((ncols * nrows * 2,), dtype=np.int32) * -1
-        res = array_geometry.lib.fill_spatial_index(B, self.spatial_index, B.shape[0], ncols * nrows)
-        if res != 0:
-            raise Exception("Size of spatial index array too small! Programming error!")
+        index_header = np.asarray((ncols, nrows, x1, y2, cs), dtype=np.float64)
+        index_path = None
+        I = None
+        if SPATIAL_INDEX_DIR is not None and source is not None:
+            index_path = get_spatial_index_path(source, index_header)
+            I, spatial_index = load_spatial_index(index_path, source, B)
+        if I is None:
+            I = np.argsort(B)
+            B = B[I]
+            spatial_index = np.ones((ncols * nrows * 2,), dtype=np.int32) * -1
+            res = array_geometry.lib.fill_spatial_index(B, spatial_index, B.shape[0], ncols * nrows)
+            if res != 0:
+                raise Exception("Size of spatial index array too small! Programming error!")
+            if index_path is not None:
+                try:
+                    dump_spatial_index(index_path, source, I, spatial_index)
+                except (IOError, OSError) as e:
+                    print("Could not write spatial index file: %s" % str(e))
         for a in self.pc_attrs:
             attr = self.__dict__[a]
             if attr is not None:
                 self.__dict__[a] = attr[I]
-        self.index_header = np.asarray((ncols, nrows, x1, y2, cs), dtype=np.float64)
+        self.spatial_index = spatial_index
+        self.index_header = index_header
         return self
 
     def clear_derived_attrs(self):
@@ -991,20 +1795,26 @@ class Pointcloud(object):
         self.spatial_index = None
         self.bbox = None
         self.triangle_validity_mask = None
+        self.cached_geometry = None
+        # the points are no longer as loaded
+        self.source = None
     # Filterering methods below...
 
     def validate_filter_args(self, rad):
         # internal utility - just validate a filter radius against the internal spatial index.
+        # The filters scan ceil(rad / cell size) rings of cells around each point, so any radius is fine,
+        # but a cell size much smaller than the radius means scanning many (empty) cells.
         if self.spatial_index is None:
             raise Exception("Build a spatial index first!")
-        if rad > self.index_header[4]:
-            raise Warning("Filter radius larger than cell size of spatial index will not catch all points!")
+        if rad < 0:
+            raise ValueError("Filter radius must be positive!")
 
+    @profiling.profiled("min_filter")
     def min_filter(self, filter_rad, xy=None, nd_val=-9999):
         """
         Calculate minumum filter of z along self.xy or a supplied set of input points. Useful for gridding.
         Args:
-            filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
+            filter_rad: The radius of the filter. Any radius can be used with the spatial index.
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
         Returns:
             1D array of filtered values.
@@ -1013,23 +1823,18 @@ class Pointcloud(object):
         if xy is None:
             xy = self.xy
         z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_min_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
+        array_geometry.run_filter(
+            array_geometry.lib.pc_min_filter,
+            [xy, self.xy, self.z, z_out, filter_rad, nd_val, self.spatial_index, self.index_header],
+            (0, 3), xy.shape[0])
         return z_out
 
+    @profiling.profiled("mean_filter")
     def mean_filter(self, filter_rad, xy=None, nd_val=-9999):
         """
         Calculate mean filter of z along self.xy or a supplied set of input points. Useful for gridding.
         Args:
-            filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
+            filter_rad: The radius of the filter. Any radius can be used with the spatial index.
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
         Returns:
             1D array of filtered values.
@@ -1038,23 +1843,18 @@ class Pointcloud(object):
         if xy is None:
             xy = self.xy
         z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_mean_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
+        array_geometry.run_filter(
+            array_geometry.lib.pc_mean_filter,
+            [xy, self.xy, self.z, z_out, filter_rad, nd_val, self.spatial_index, self.index_header],
+            (0, 3), xy.shape[0])
         return z_out
 
+    @profiling.profiled("max_filter")
     def max_filter(self, filter_rad, xy=None, nd_val=-9999):
         """
         Calculate maximum filter of z along self.xy or a supplied set of input points. Useful for gridding.
         Args:
-            filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
+            filter_rad: The radius of the filter. Any radius can be used with the spatial index.
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
         Returns:
             1D array of filtered values.
@@ -1063,15 +1863,18 @@ class Pointcloud(object):
         if xy is None:
             xy = self.xy
         z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_min_filter(
-            xy, self.xy, -self.z, z_out, filter_rad, nd_val, self.spatial_index, self.index_header, xy.shape[0])
+        array_geometry.run_filter(
+            array_geometry.lib.pc_min_filter,
+            [xy, self.xy, -self.z, z_out, filter_rad, nd_val, self.spatial_index, self.index_header],
+            (0, 3), xy.shape[0])
         return -z_out
 
+    @profiling.profiled("median_filter")
     def median_filter(self, filter_rad, xy=None, nd_val=-9999):
         """
         Calculate median filter of z along self.xy or a supplied set of input points. Useful for gridding.
         Args:
-            filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
+            filter_rad: The radius of the filter. Any radius can be used with the spatial index.
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
         Returns:
             1D array of filtered values.
@@ -1080,23 +1883,42 @@ class Pointcloud(object):
         if xy is None:
             xy = self.xy
         z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_median_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
+        array_geometry.run_filter(
+            array_geometry.lib.pc_median_filter,
+            [xy, self.xy, self.z, z_out, filter_rad, nd_val, self.spatial_index, self.index_header],
+            (0, 3), xy.shape[0])
         return z_out
 
+    @profiling.profiled("percentile_filter")
+    def percentile_filter(self, filter_rad, q, xy=None, nd_val=-9999):
+        """
+        Calculate percentile filter of z along self.xy or a supplied set of input points, interpolating
+        linearly between the closest values like numpy.percentile. Useful for gridding.
+        Args:
+            filter_rad: The radius of the filter. Any radius can be used with the spatial index.
+            q: Percentile between 0 and 100 (50 is the median).
+            xy: Optional list of input points to filter along. Will use self.xy if not supplied.
+        Returns:
+            1D array of filtered values.
+        """
+        self.validate_filter_args(filter_rad)
+        if not 0 <= q <= 100:
+            raise ValueError("Percentile must be between 0 and 100!")
+        if xy is None:
+            xy = self.xy
+        z_out = np.zeros((xy.shape[0],), dtype=np.float64)
+        array_geometry.run_filter(
+            array_geometry.lib.pc_percentile_filter,
+            [xy, self.xy, self.z, z_out, filter_rad, q, nd_val, self.spatial_index, self.index_header],
+            (0, 3), xy.shape[0])
+        return z_out
+
+    @profiling.profiled("var_filter")
     def var_filter(self, filter_rad, xy=None, nd_val=-9999):
         """
         Calculate variance filter of z along self.xy or a supplied set of input points. Useful for gridding.
         Args:
-            filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
+            filter_rad: The radius of the filter. Any radius can be used with the spatial index.
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
         Returns:
             1D array of filtered values.
@@ -1105,23 +1927,18 @@ class Pointcloud(object):
         if xy is None:
             xy = self.xy
         z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_var_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
+        array_geometry.run_filter(
+            array_geometry.lib.pc_var_filter,
+            [xy, self.xy, self.z, z_out, filter_rad, nd_val, self.spatial_index, self.index_header],
+            (0, 3), xy.shape[0])
         return z_out
 
+    @profiling.profiled("distance_filter")
     def distance_filter(self, filter_rad, xy=None, nd_val=9999):
         """
         Calculate point distance filter along self.xy or a supplied set of input points (which should really be supplied for this to make sense). Useful for gridding.
         Args:
-            filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
+            filter_rad: The radius of the filter. Any radius can be used with the spatial index.
             xy: Optional list of input points to filter along. Supply this or get a lot of zeros!
         Returns:
             1D array of filtered values.
@@ -1130,23 +1947,18 @@ class Pointcloud(object):
         if xy is None:
             xy = self.xy
         z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_distance_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
+        array_geometry.run_filter(
+            array_geometry.lib.pc_distance_filter,
+            [xy, self.xy, self.z, z_out, filter_rad, nd_val, self.spatial_index, self.index_header],
+            (0, 3), xy.shape[0])
         return z_out
 
+    @profiling.profiled("density_filter")
     def density_filter(self, filter_rad, xy=None):
         """
         Calculate point density filter along self.xy or a supplied set of input points. Useful for gridding.
         Args:
-            filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
+            filter_rad: The radius of the filter. Any radius can be used with the spatial index.
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
         Returns:
             1D array of filtered values.
@@ -1155,22 +1967,18 @@ class Pointcloud(object):
         if xy is None:
             xy = self.xy
         z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_density_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
+        array_geometry.run_filter(
+            array_geometry.lib.pc_density_filter,
+            [xy, self.xy, self.z, z_out, filter_rad, self.spatial_index, self.index_header],
+            (0, 3), xy.shape[0])
         return z_out
 
+    @profiling.profiled("idw_filter")
     def idw_filter(self, filter_rad, xy=None, nd_val=-9999):
         """
         Calculate inverse distance weighted z values along self.xy or a supplied set of input points. Useful for gridding.
         Args:
-            filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
+            filter_rad: The radius of the filter. Any radius can be used with the spatial index.
             xy: Optional list of input points to filter along. Will use self.xy if not supplied.
         Returns:
             1D array of filtered values.
@@ -1179,25 +1987,113 @@ class Pointcloud(object):
         if xy is None:
             xy = self.xy
         z_out = np.zeros((xy.shape[0],), dtype=np.float64)
-        array_geometry.lib.pc_idw_filter(
-            xy,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            nd_val,
-            self.spatial_index,
-            self.index_header,
-            xy.shape[0])
+        array_geometry.run_filter(
+            array_geometry.lib.pc_idw_filter,
+            [xy, self.xy, self.z, z_out, filter_rad, nd_val, self.spatial_index, self.index_header],
+            (0, 3), xy.shape[0])
+        return z_out
+
+    @profiling.profiled("multi_filter")
+    def multi_filter(self, filter_rad, xy=None, stats=None, nd_val=-9999, nd_dist=9999):
+        """
+        Calculate several statistics of the points around self.xy or a supplied set of input points
+        in a single scan of the neighbourhood of each point - cheaper than calling the single filters.
+        Values are the same as from min_filter, max_filter, mean_filter, var_filter,
+        density_filter (times the area of the filter) and distance_filter.
+        Args:
+            filter_rad: The radius of the filter. Any radius can be used with the spatial index.
+            xy: Optional list of input points to filter along. Will use self.xy if not supplied.
+            stats: Optional list of the statistics to calculate and return - names in MULTI_FILTER_DTYPE
+                   (min, max, mean, var, count, distance). Defaults to all.
+            nd_val: No data value for min, max, mean and var.
+            nd_dist: No data value for distance.
+        Returns:
+            Numpy structured array with a field for each statistic.
+        """
+        self.validate_filter_args(filter_rad)
+        if xy is None:
+            xy = self.xy
+        names = MULTI_FILTER_DTYPE.names
+        if stats is None:
+            stats = names
+        for name in stats:
+            if name not in names:
+                raise ValueError("Unknown statistic: %s" % name)
+        # bitmask of statistics for the library
+        flags = sum(1 << names.index(name) for name in set(stats))
+        out = np.empty((xy.shape[0],), dtype=MULTI_FILTER_DTYPE)
+        # view as a 2d array with a row pr. point
+        out_2d = out.view(np.float64).reshape((xy.shape[0], len(MULTI_FILTER_DTYPE)))
+        array_geometry.run_filter(
+            array_geometry.lib.pc_multi_filter,
+            [xy, self.xy, self.z, out_2d, filter_rad, nd_val, nd_dist, flags, self.spatial_index, self.index_header],
+            (0, 3), xy.shape[0])
+        if tuple(stats) != names:
+            out = out[list(stats)]
+        return out
+
+    @profiling.profiled("knn")
+    def knn(self, xy, k):
+        """
+        Find the k nearest points of self for each of a set of input points. Uses the spatial index,
+        scanning rings of cells around each input point until the k nearest are found - so it is fastest
+        when the cell size of the index is not much smaller than the typical distance to the k'th point.
+        Args:
+            xy: Input points (numpy array of shape (n, 2)).
+            k: Number of neighbours.
+        Returns:
+            Numpy int32 array of shape (n, k) with indices of the nearest points sorted by distance
+            (-1 if there are fewer than k points in the pointcloud), and numpy float64 array of shape (n, k)
+            with the distances (inf for missing points).
+        """
+        if self.spatial_index is None:
+            raise Exception("Build a spatial index first!")
+        if k < 1:
+            raise ValueError("k must be positive!")
+        xy = np.ascontiguousarray(xy, dtype=np.float64)
+        idx = np.empty((xy.shape[0], k), dtype=np.int32)
+        dist = np.empty((xy.shape[0], k), dtype=np.float64)
+        array_geometry.run_filter(
+            array_geometry.lib.pc_knn,
+            [xy, self.xy, k, idx, dist, self.spatial_index, self.index_header],
+            (0, 3, 4), xy.shape[0])
+        return idx, dist
+
+    @profiling.profiled("knn_idw_filter")
+    def knn_idw_filter(self, k, xy=None, nd_val=-9999, max_dist=None):
+        """
+        Calculate inverse distance weighted z values from the k nearest points along self.xy or a
+        supplied set of input points. Unlike idw_filter, this does not give no data in areas with a low
+        point density.
+        Args:
+            k: Number of nearest points to use.
+            xy: Optional list of input points to filter along. Will use self.xy if not supplied.
+            nd_val: No data value for input points with no points within max_dist.
+            max_dist: Optionally only use points within this distance.
+        Returns:
+            1D array of filtered values.
+        """
+        if xy is None:
+            xy = self.xy
+        idx, dist = self.knn(xy, k)
+        w = 1.0 / np.maximum(dist ** 2, 1e-8)
+        if max_dist is not None:
+            w[dist > max_dist] = 0
+        w[idx < 0] = 0
+        sw = w.sum(axis=1)
+        z_out = np.full((idx.shape[0],), nd_val, dtype=np.float64)
+        M = sw > 0
+        z_out[M] = (w[M] * self.z[idx[M]]).sum(axis=1) / sw[M]
         return z_out
 
+    @profiling.profiled("spike_filter")
     def spike_filter(self, filter_rad, tanv2, zlim=0.2):
         """
         Calculate spike indicators (0 or 1) for each point . In order to be a spike there must be at least one other point within filter rad in each quadrant which satisfies:
         -- slope_angle large and dz large.
         See c implementation in array_geometry.c.
         Args:
-            filter_rad: The radius of the filter. Should not be larger than cell size in spatial index (for now).
+            filter_rad: The radius of the filter. Any radius can be used with the spatial index.
             tanv2: Tangent squared of slope angle (dy/dx)**2 parameter for spike check (lower limit).
             zlim: dz paramter for spike check (lower limit)
         Returns:
@@ -1207,18 +2103,10 @@ class Pointcloud(object):
         if (tanv2 < 0 or zlim < 0):
             raise ValueError("Spike parameters must be positive!")
         z_out = np.empty_like(self.z)
-        array_geometry.lib.pc_spike_filter(
-            self.xy,
-            self.z,
-            self.xy,
-            self.z,
-            z_out,
-            filter_rad,
-            tanv2,
-            zlim,
-            self.spatial_index,
-            self.index_header,
-            self.xy.shape[0])
+        array_geometry.run_filter(
+            array_geometry.lib.pc_spike_filter,
+            [self.xy, self.z, self.xy, self.z, z_out, filter_rad, tanv2, zlim, self.spatial_index, self.index_header],
+            (0, 1, 4), self.xy.shape[0])
         return z_out
 
 
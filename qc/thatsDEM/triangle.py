@@ -103,6 +103,14 @@ lib.make_grid_low.argtypes = [LP_CDOUBLE,
 lib.make_grid_low.restype = None
 lib.optimize_index.argtypes = [ctypes.c_void_p]
 lib.optimize_index.restype = None
+# int dump_index(spatial_index *ind, double *header, int *offsets, int *data)
+lib.dump_index.argtypes = [ctypes.c_void_p, LP_CDOUBLE, LP_CINT, LP_CINT]
+lib.dump_index.restype = ctypes.c_int
+# spatial_index *load_index(double *header, int *offsets, int *data)
+lib.load_index.argtypes = [LP_CDOUBLE, LP_CINT, LP_CINT]
+lib.load_index.restype = ctypes.c_void_p
+# Length of the header of a flattened index: ncols, npoints, ntri, ncells, extent (4), cs.
+INDEX_HEADER_SIZE = 9
 
 delaunator_lib.triangulate.argtypes = [ctypes.c_int, LP_CDOUBLE, LP_CINT, ctypes.POINTER(LP_CINT)]
 delaunator_lib.triangulate.restype = None
@@ -113,6 +121,8 @@ delaunator_lib.free_face_data.restype = None
 class TriangulationBase(object):
     """Triangulation class inspired by scipy.spatial.Delaunay
     Uses Triangle to do the hard work. Automatically builds an index.
+    The triangles are held in a numpy array, and the index can be flattened to numpy arrays (see dump_index),
+    so triangulations can be pickled, e.g. to send them to other processes.
     """
     vertices = None
     index = None
@@ -120,24 +130,89 @@ class TriangulationBase(object):
     segments = None
     holes = None
     ntrig = None
+    triangles = None  # numpy (n,3) int32 array of triangles - vertices points into it.
+    index_cs = -1  # cell size the index was built with (negative: guessed from point density)
     transform = None  # can be used to speed up things even more....
 
     def __del__(self):
         """Destructor"""
-        if self.vertices is not None:
-            delaunator_lib.free_face_data(ctypes.byref(self.ptr_faces))
         if self.index is not None:
             lib.free_index(self.index)
 
+    def __getstate__(self):
+        # The ctypes pointers can not be pickled - store the triangles and the flattened index instead.
+        state = dict(self.__dict__)
+        for name in ("ptr_faces", "vertices", "index"):
+            state.pop(name, None)
+        state["index"] = self.dump_index()
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        index = state.pop("index")
+        self.__dict__.update(state)
+        self.set_triangles(self.triangles)
+        self.load_index(*index)
+
+    def set_triangles(self, triangles):
+        # internal utility - point the c functions to a numpy array of triangles (kept alive here).
+        self.triangles = triangles
+        self.ntrig = triangles.shape[0]
+        self.ptr_faces = triangles.ctypes.data_as(LP_CINT)
+        self.vertices = self.ptr_faces.contents
+
+    def dump_index(self):
+        """
+        Flatten the index of triangles to numpy arrays, e.g. for storing it. See load_index.
+        Returns:
+            header: numpy float64 array: ncols, npoints, ntriangles, ncells, extent (4) and cell size of the index.
+            offsets: numpy int32 array of size ncells+1: start of the triangles of each cell in data.
+            data: numpy int32 array: the triangles of each cell.
+        """
+        header = np.empty((INDEX_HEADER_SIZE,), dtype=np.float64)
+        n = lib.dump_index(self.index, header.ctypes.data_as(LP_CDOUBLE), None, None)
+        offsets = np.empty((int(header[3]) + 1,), dtype=np.int32)
+        data = np.empty((n,), dtype=np.int32)
+        lib.dump_index(self.index, header.ctypes.data_as(LP_CDOUBLE),
+                       offsets.ctypes.data_as(LP_CINT), data.ctypes.data_as(LP_CINT))
+        return header, offsets, data
+
+    def load_index(self, header, offsets, data):
+        """
+        Replace the index of triangles by one flattened by dump_index.
+        Args:
+            header, offsets, data: as returned by dump_index.
+        Raises:
+            ValueError: If the index does not match the triangulation or is inconsistent.
+        """
+        header = np.require(header, dtype=np.float64, requirements=["C", "A"])
+        offsets = np.require(offsets, dtype=np.int32, requirements=["C", "A"])
+        data = np.require(data, dtype=np.int32, requirements=["C", "A"])
+        if header.shape != (INDEX_HEADER_SIZE,) or header[1] != self.points.shape[0] or header[2] != self.ntrig:
+            raise ValueError("Index does not match the triangulation.")
+        if offsets.shape[0] != int(header[3]) + 1 or offsets[0] != 0 or offsets[-1] != data.shape[0] or \
+                (np.diff(offsets) < 0).any():
+            raise ValueError("Inconsistent index offsets.")
+        if data.size > 0 and (data.min() < 0 or data.max() >= self.ntrig):
+            raise ValueError("Invalid triangle indices in index.")
+        index = lib.load_index(header.ctypes.data_as(LP_CDOUBLE),
+                               offsets.ctypes.data_as(LP_CINT), data.ctypes.data_as(LP_CINT))
+        if index is None:
+            raise Exception("Failed to load index...")
+        if self.index is not None:
+            lib.free_index(self.index)
+        self.index = index
+        self.index_cs = float(header[8])
+
     def validate_points(self, points, ndim=2, dtype=np.float64):
         # ALL this stuff is not needed if we use numpys ctypeslib interface - TODO.
         if not isinstance(points, np.ndarray):
             raise ValueError("Input points must be a Numpy ndarray")
         ok = points.flags["ALIGNED"] and points.flags[
-            "C_CONTIGUOUS"] and points.flags["OWNDATA"] and points.dtype == dtype
+            "C_CONTIGUOUS"] and points.dtype == dtype
         if (not ok):
             raise ValueError(
-                "Input points must have flags 'ALIGNED','C_CONTIGUOUS','OWNDATA' and data type %s" %
+                "Input points must have flags 'ALIGNED','C_CONTIGUOUS' and data type %s" %
                 dtype)
         # TODO: figure out something useful here....
         if points.ndim != ndim or (ndim == 2 and points.shape[1] != 2):
@@ -240,11 +315,9 @@ class TriangulationBase(object):
         Invalid indices used to give (-1,-1,-1) rows, will now cause an
         exception."""
         if indices is None:
-            indices = np.arange(0, self.ntrig).astype(np.int32)
+            return self.triangles.copy()
         self.validate_points(indices, 1, np.int32)
-        vertex_indices_array = np.ctypeslib.as_array(self.ptr_faces, (self.ntrig, 3))
-        out = vertex_indices_array[indices, :].astype(np.int32)
-        return out
+        return self.triangles[indices, :]
 
     def get_triangle_centers(self):
         """
@@ -252,7 +325,7 @@ class TriangulationBase(object):
         Returns:
             Numpy 2d array of shape (ntriangles,2)
         """
-        indices_array = np.ctypeslib.as_array(self.ptr_faces, (self.ntrig, 3))
+        indices_array = self.triangles
         triangles_x = self.points[indices_array.ravel(), 0].reshape(-1, 3)
         triangles_y = self.points[indices_array.ravel(), 1].reshape(-1, 3)
         out = np.column_stack([np.sum(triangles_x, axis=1) / 3.0, np.sum(triangles_y, axis=1) / 3.0]).astype(np.float64)
@@ -261,6 +334,7 @@ class TriangulationBase(object):
     def rebuild_index(self, cs):
         """Rebuild index with another cell size"""
         lib.free_index(self.index)
+        self.index_cs = cs
         self.index = lib.build_index(
             self.points.ctypes.data_as(LP_CDOUBLE),
             self.vertices,
@@ -309,19 +383,38 @@ class TriangulationBase(object):
 
 
 class Triangulation(TriangulationBase):
-    """TriangulationBase implementation. Will construct a triangulation and an index of triangles."""
+    """
+    TriangulationBase implementation. Will construct a triangulation and an index of triangles.
+    Previously calculated triangles (e.g. from get_triangles) can be given to skip the triangulation,
+    and a previously calculated index (from dump_index) to skip building the index.
+    """
 
-    def __init__(self, points, cs=-1):
+    def __init__(self, points, cs=-1, triangles=None, index=None):
         self.validate_points(points)
         self.points = points
-        num_faces = ctypes.c_int(0)
-        self.ptr_faces = ctypes.POINTER(ctypes.c_int)()
-        delaunator_lib.triangulate(points.shape[0],
-                                   points.ctypes.data_as(LP_CDOUBLE),
-                                   ctypes.byref(num_faces),
-                                   ctypes.byref(self.ptr_faces))
-        self.ntrig = num_faces.value
-        self.vertices = self.ptr_faces.contents
+        if triangles is None:
+            num_faces = ctypes.c_int(0)
+            ptr_faces = ctypes.POINTER(ctypes.c_int)()
+            delaunator_lib.triangulate(points.shape[0],
+                                       points.ctypes.data_as(LP_CDOUBLE),
+                                       ctypes.byref(num_faces),
+                                       ctypes.byref(ptr_faces))
+            # copy to numpy, so that the triangles can be pickled (and freed with the triangulation).
+            if num_faces.value > 0:
+                triangles = np.ctypeslib.as_array(ptr_faces, (num_faces.value, 3)).copy()
+            else:
+                triangles = np.empty((0, 3), dtype=np.int32)
+            delaunator_lib.free_face_data(ctypes.byref(ptr_faces))
+        else:
+            if triangles.ndim != 2 or triangles.shape[1] != 3 or triangles.shape[0] == 0:
+                raise ValueError("Bad shape of input - triangles: (n,3)")
+            if not (triangles.flags["C_CONTIGUOUS"] and triangles.dtype == np.int32):
+                raise ValueError("Input triangles must be C_CONTIGUOUS and of data type int32")
+        self.set_triangles(triangles)
+        if index is not None:
+            self.load_index(*index)
+            return
+        self.index_cs = cs
         #print("Triangles: %d" %self.ntrig)
         t1 = time.process_time()
         self.index = lib.build_index(
@@ -22,6 +22,7 @@ from builtins import range
 from osgeo import ogr, gdal
 import numpy as np
 import time
+from ..utils import profiling
 
 # placeholder for tile-wkt - thos token will be replaced by actual wkt in run time.
 EXTENT_WKT = "WKT_EXT"
@@ -76,6 +77,7 @@ def nptype2gdal(dtype):
     return gdal.GDT_Float64
 
 
+@profiling.profiled("burn_vector_layer", points=lambda mask: 0)
 def burn_vector_layer(cstr, georef, shape, layername=None, layersql=None,
                       attr=None, nd_val=0, dtype=np.bool_, all_touched=True):
     """
@@ -172,6 +174,7 @@ def just_burn_layer(layer, georef, shape, attr=None, nd_val=0,
     return A
 
 
+@profiling.profiled("get_geometries")
 def get_geometries(cstr, layername=None, layersql=None, extent=None, explode=True):
     """
     Use vector_io.open to fetch a layer, read geometries and explode multi-geometries if explode=True
@@ -0,0 +1,200 @@
+# Copyright (c) 2016, Danish Agency for Data Supply and Efficiency <sdfe@sdfe.dk>
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+'''
+Lightweight recording of time, memory and number of points spent in processing stages
+(reading, triangulation, filtering, reporting, ...).
+
+Totals are collected pr. process in a module global and can be fetched with get_totals,
+e.g. by qc_wrap after each tile. Stages can be nested (e.g. a filter which sorts the
+pointcloud), so times of different stages do not add up.
+'''
+from __future__ import print_function
+
+import os
+import sys
+import time
+import functools
+import threading
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+# perf_counter is not available in python 2
+_timer = getattr(time, "perf_counter", time.time)
+
+# stage name -> [calls, seconds, points, peak rss in bytes]
+TOTALS = {}
+# Stages open in the main thread, innermost last (see stage).
+_OPEN_STAGES = []
+
+
+def get_rss(pid=None):
+    '''
+    Return resident memory in bytes of process pid (default this process).
+    Uses psutil if available, otherwise only supported on linux.
+    Returns None if not available.
+    '''
+    if pid is None:
+        pid = os.getpid()
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open("/proc/{0:d}/statm".format(pid)) as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def get_peak_rss():
+    '''
+    Return peak resident memory in bytes of this process since it started or since
+    the last reset_peak_rss. Returns None if not available.
+    '''
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on linux, bytes on mac
+        return peak if sys.platform == "darwin" else peak * 1024
+    if psutil is not None:
+        return getattr(psutil.Process().memory_info(), "peak_wset", None)
+    return None
+
+
+def reset_peak_rss():
+    '''
+    Reset the peak resident memory of this process to the current usage.
+    Only supported on linux - returns False if the peak could not be reset.
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _max(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+def reset():
+    '''Clear totals, e.g. before processing a new tile.'''
+    TOTALS.clear()
+
+
+def get_totals():
+    '''
+    Return a dict of stage name -> (calls, seconds, points, peak_rss) recorded since last reset.
+    peak_rss is the largest peak resident memory during a call of the stage in bytes
+    (None if not measured). Where the peak cannot be reset (other platforms than linux),
+    it is the peak of the process up to the end of the stage.
+    '''
+    return dict((name, tuple(total)) for name, total in TOTALS.items())
+
+
+def record(name, seconds, points=0, rss=None):
+    '''Add a call of a stage to the totals.'''
+    total = TOTALS.get(name)
+    if total is None:
+        total = TOTALS[name] = [0, 0.0, 0, None]
+    total[0] += 1
+    total[1] += seconds
+    total[2] += int(points)
+    total[3] = _max(total[3], rss)
+
+
+class stage(object):
+    '''
+    Context manager timing a stage and measuring the peak memory usage during the stage.
+    Set the points attribute (or give points) to record the number of points handled.
+
+    The peak of the process is reset when a stage is entered in the main thread, and the
+    peak seen by a stage is passed on to the stage around it. Stages in other threads
+    record the peak since the last reset.
+
+    Example:
+        with profiling.stage("read") as st:
+            pc = ...
+            st.points = pc.size
+    '''
+
+    def __init__(self, name, points=0):
+        self.name = name
+        self.points = points
+        self.t_start = None
+        self.peak_rss = None
+        self.main_thread = False
+
+    def __enter__(self):
+        self.main_thread = threading.current_thread().name == "MainThread"
+        if self.main_thread:
+            if _OPEN_STAGES:
+                _OPEN_STAGES[-1].peak_rss = _max(_OPEN_STAGES[-1].peak_rss, get_peak_rss())
+            reset_peak_rss()
+            _OPEN_STAGES.append(self)
+        self.t_start = _timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = _timer() - self.t_start
+        self.peak_rss = _max(self.peak_rss, get_peak_rss())
+        if self.main_thread:
+            _OPEN_STAGES.pop()
+            if _OPEN_STAGES:
+                _OPEN_STAGES[-1].peak_rss = _max(_OPEN_STAGES[-1].peak_rss, self.peak_rss)
+        record(self.name, seconds, self.points, self.peak_rss)
+        return False
+
+
+def profiled(name, points=None):
+    '''
+    Decorator recording calls of a function as a stage.
+
+    Args:
+        name: name of the stage.
+        points: function returning the number of points from the returned value.
+                Defaults to the length of the returned value, if it has one.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name) as st:
+                result = func(*args, **kwargs)
+                if points is not None:
+                    st.points = points(result)
+                elif hasattr(result, "__len__"):
+                    st.points = len(result)
+            return result
+        return wrapper
+    return decorator
@@ -255,10 +255,9 @@ def main(args):
 	fn=0
 	sl="-"*65
 	pcs=dict()
-	for id in pc.get_pids():
+	for id,pc_ in pc.split_by("pid").items():
 		print("%s\n" %("+"*70))
 		print("Strip id: %d" %id)
-		pc_=pc.cut_to_strip(id)
 		if pc_.get_size()>500:
 			pcs[id]=pc_
 		else:
@@ -93,10 +93,9 @@ def do_it(xy,z,km_name="",ftype="NA",ds_report=None):
 	print("Center of mass: %.2f %.2f %.2f" %(cm_x,cm_y,cm_z))
 	cm_geom=ogr.Geometry(ogr.wkbPoint25D)
 	cm_geom.SetPoint(0,cm_x,cm_y,cm_z)
-	for id in pc.get_pids():
+	for id,pc_ in pc.split_by("pid").items():
 		print("%s\n" %("+"*70))
 		print("Strip id: %d" %id)
-		pc_=pc.cut_to_strip(id)
 		if pc_.get_size()<50:
 			print("Not enough points...")
 			continue
@@ -179,10 +178,9 @@ def main(args):
 	print("Checking %d point sets" %len(not_empty))
 	#Loop over strips#
 
-	for id in pc.get_pids():
+	for id,pc_c in pc.split_by("pid").items():
 		print("%s\n" %("+"*70))
 		print("Strip id: %d" %id)
-		pc_c=pc.cut_to_strip(id)
 		if pc_c.get_size()<50:
 			print("Not enough points...")
 			continue
@@ -47,6 +47,7 @@ parser.add_argument("-class",dest="cut_to",type=int,default=CUT_CLASS,help="Spec
 parser.add_argument("-toE",action="store_true",help="Warp the points from dvr90 to ellipsoidal heights.")
 parser.add_argument("-z",help="z attribute of reference point layer (defaults to 'Z')",default="Z")
 parser.add_argument("-debug",action="store_true",help="Turn on extra verbosity...")
+parser.add_argument("-per_point",action="store_true",help="Triangulate the neighbourhood of each GCP separately, rather than all neighbourhoods at once (slow).")
 group = parser.add_mutually_exclusive_group()
 group.add_argument("-layername",help="Specify layername (e.g. for reference data in a database)")
 group.add_argument("-layersql",help="Specify sql-statement for layer selection (e.g. for reference data in a database)",type=str)
@@ -56,6 +57,75 @@ parser.add_argument("ref_data",help="Reference data (path, connection string etc
 def usage():
 	parser.print_help()
 
+def cut_to_neighbourhoods(pc,xy_ref,buf=BUF):
+	"""
+	Cut the pointcloud to the points near the GCPs - a superset of the points within the box of size 2*buf around each GCP,
+	found by marking the cells (of size buf) touched by the boxes.
+	"""
+	x1,y1,x2,y2=pc.get_bounds()
+	georef=(x1,buf,0,y2,0,-buf)
+	ncols=int((x2-x1)/buf)+1
+	nrows=int((y2-y1)/buf)+1
+	M=np.zeros((nrows,ncols),dtype=np.bool_)
+	c1=np.clip(np.floor((xy_ref[:,0]-buf-x1)/buf),0,ncols-1).astype(np.int32)
+	c2=np.clip(np.floor((xy_ref[:,0]+buf-x1)/buf),0,ncols-1).astype(np.int32)
+	r1=np.clip(np.floor((y2-xy_ref[:,1]-buf)/buf),0,nrows-1).astype(np.int32)
+	r2=np.clip(np.floor((y2-xy_ref[:,1]+buf)/buf),0,nrows-1).astype(np.int32)
+	for i in range(xy_ref.shape[0]):
+		M[r1[i]:r2[i]+1,c1[i]:c2[i]+1]=True
+	return pc.cut_to_grid_mask(M,georef)
+
+def batch_interpolation(pc,xy_ref,buf=BUF):
+	"""
+	Interpolate in all GCPs from one triangulation of the points near the GCPs.
+	A GCP only gets a result if its containing triangle is also a triangle of the triangulation of the points
+	within buf of the GCP alone (its circumcircle lies within that box), so that the result is the same as when
+	triangulating the neighbourhood of each GCP separately. Others should be checked that way.
+	Args:
+		pc: Pointcloud.
+		xy_ref: numpy (n,2) array of GCPs.
+		buf: half size of the box around each GCP.
+	Returns:
+		numpy boolean mask of GCPs with a result, interpolated z and triangle geometry (see Pointcloud.get_triangle_geometry) for those GCPs.
+	"""
+	ok=np.zeros((xy_ref.shape[0],),dtype=np.bool_)
+	pc_=cut_to_neighbourhoods(pc,xy_ref,buf)
+	if pc_.get_size()<3:
+		return ok,None,None
+	pc_.triangulate()
+	I=pc_.find_triangles(xy_ref)
+	ok=(I>=0)
+	xy=xy_ref[ok]
+	area=(xy[:,0]-buf,xy[:,1]-buf,xy[:,0]+buf,xy[:,1]+buf)
+	ok[ok]=pointcloud.circumcircles_within(pc_.xy,pc_.triangulation.get_triangles(I[ok]),area,pc_.get_bounds())
+	z_interp=pc_.interpolate(xy_ref[ok],nd_val=-9999)
+	trig_geom=pc_.get_triangle_geometry()[I[ok]]
+	return ok,z_interp,trig_geom
+
+def local_interpolation(pc,xy,wkt,buf=BUF,debug=False):
+	"""
+	Interpolate in a single GCP (numpy (1,2) array) from a triangulation of the points within buf of it.
+	Returns:
+		interpolated z and triangle geometry - or None,None if not possible.
+	"""
+	xy1=xy-(buf,buf)
+	xy2=xy+(buf,buf)
+	pc_=pc.cut_to_box(xy1[0,0],xy1[0,1],xy2[0,0],xy2[0,1])
+	if debug:
+		print(xy, xy.shape)
+		print("Points in buffer: %d" %pc_.get_size())
+	if pc_.get_size()<3:
+		print("Too few points in pointcloud around GCP: "+wkt)
+		return None,None
+	pc_.triangulate()
+	trig_geom=pc_.get_triangle_geometry()
+	I=pc_.find_triangles(xy)
+	j=I[0]
+	if j<0:
+		print("Point "+wkt+" falls outside (local) triangulation...")
+		return None,None
+	z_interp=pc_.interpolate(xy,nd_val=-9999)
+	return z_interp[0],trig_geom[j]
 
 
 
@@ -106,40 +176,24 @@ def main(args):
 		toE=geoid.interpolate(xy_ref)
 		assert((toE!=geoid.nd_val).all())
 		z_ref+=toE
-	#pc.triangulate()
-	#trig_geom=pc.get_triangle_geometry()
-	#I=pc.find_triangles(xy_ref)
-	#M=(I>=0)
-	#if not M.all():
-	#	print("Warning, %d points fall outside triangulation." %(np.logical_not(M).sum()))
-	#	xy_ref=xy_ref[M]
-	#	z_ref=z_ref[M]
-	#	I=I[M]
-	#trig_geom=trig_geom[I]
-	#z_interp=pc.interpolate(xy_ref,nd_val=-9999)
-	#dz=z_interp-z_ref
+	#Triangulate the neighbourhoods of all GCPs at once. GCPs for which that might give another
+	#result than triangulating the neighbourhood alone (e.g. near holes in the data) are done one by one.
+	if pargs.per_point:
+		ok=np.zeros((xy_ref.shape[0],),dtype=np.bool_)
+	else:
+		ok,z_batch,geom_batch=batch_interpolation(pc,xy_ref)
+		print("%d of %d GCPs interpolated from one triangulation." %(ok.sum(),ok.size))
+	pos=np.cumsum(ok)-1 #position of each GCP in the batch results
 	for i in range(xy_ref.shape[0]):
 		xy=xy_ref[i].reshape(1,2).copy()
-		xy1=xy-(BUF,BUF)
-		xy2=xy+(BUF,BUF)
-		pc_=pc.cut_to_box(xy1[0,0],xy1[0,1],xy2[0,0],xy2[0,1])
-		if pargs.debug:
-			print(xy, xy.shape)
-			print("Points in buffer: %d" %pc_.get_size())
 		wkt="POINT({0} {1} {2})".format(str(xy[0,0]),str(xy[0,1]),str(z_ref[i]))
-
-		if pc_.get_size()<3:
-			print("Too few points in pointcloud around GCP: "+wkt)
-			continue
-		pc_.triangulate()
-		trig_geom=pc_.get_triangle_geometry()
-		I=pc_.find_triangles(xy)
-		j=I[0]
-		if j<0:
-			print("Point "+wkt+" falls outside (local) triangulation...")
-			continue
-		trig_geom=trig_geom[j]
-		z_interp=pc_.interpolate(xy,nd_val=-9999)
+		if ok[i]:
+			z_interp=z_batch[pos[i]]
+			trig_geom=geom_batch[pos[i]]
+		else:
+			z_interp,trig_geom=local_interpolation(pc,xy,wkt,debug=pargs.debug)
+			if z_interp is None:
+				continue
 		dz=z_interp-z_ref[i]
 		angle=math.degrees(math.atan(math.sqrt(trig_geom[0])))
 		xy_box=trig_geom[1]
@@ -26,6 +26,8 @@ from qc.db import report
 from . import dhmqc_constants as constants
 from qc.utils.stats import get_dz_stats
 DEBUG="-debug" in sys.argv
+#cell size of the grids used for strip footprints
+FOOTPRINT_CS=10.0
 
 def check_feature(pc1,pc2_in_poly,a_geom,DEBUG=False):
 	z_out=pc1.controlled_interpolation(pc2_in_poly.xy,nd_val=-999)
@@ -36,10 +38,70 @@ def check_feature(pc1,pc2_in_poly,a_geom,DEBUG=False):
 	dz=z_out[M]-z_good
 	m,sd,l1,rms,n=get_dz_stats(dz)
 	return m,sd,rms,n #consider using also l1....
+
+def strip_footprints(pcs,cs=FOOTPRINT_CS):
+	"""
+	Coarse footprints of strips: boolean grids (on a common grid) of the cells with points - expanded by one cell,
+	so that features near the edge of a strip are not missed.
+	Args:
+		pcs: dict of strip id -> Pointcloud.
+		cs: cell size.
+	Returns:
+		georef of the grid (GDAL style) and dict of strip id -> boolean grid.
+	"""
+	bounds=np.array([pc_.get_bounds() for pc_ in pcs.values()])
+	x1=np.floor(bounds[:,0].min()/cs)*cs-cs
+	y2=np.ceil(bounds[:,3].max()/cs)*cs+cs
+	ncols=int((bounds[:,2].max()-x1)/cs)+2
+	nrows=int((y2-bounds[:,1].min())/cs)+2
+	georef=(x1,cs,0,y2,0,-cs)
+	footprints=dict()
+	for id,pc_ in pcs.items():
+		ac=((pc_.xy-(x1,y2))/(cs,-cs)).astype(np.int32)
+		M=np.zeros((nrows,ncols),dtype=np.bool_)
+		M[ac[:,1],ac[:,0]]=True
+		D=M.copy()
+		D[1:,:]|=M[:-1,:]
+		D[:-1,:]|=M[1:,:]
+		M=D.copy()
+		M[:,1:]|=D[:,:-1]
+		M[:,:-1]|=D[:,1:]
+		footprints[id]=M
+	return georef,footprints
+
+def overlapping_pairs(ids,footprints):
+	"""Return list of (id1,id2,overlap) for the pairs of strips (in the order of ids) with overlapping footprints."""
+	pairs=[]
+	for i,id1 in enumerate(ids):
+		for id2 in ids[i+1:]:
+			overlap=footprints[id1]&footprints[id2]
+			if overlap.any():
+				pairs.append((id1,id2,overlap))
+	return pairs
+
+def box_hits_grid(bbox,M,georef):
+	"""Check if any of the cells of a boolean grid within a box is True."""
+	c1=max(int((bbox[0]-georef[0])/georef[1]),0)
+	c2=min(int((bbox[2]-georef[0])/georef[1])+1,M.shape[1])
+	r1=max(int((bbox[3]-georef[3])/georef[5]),0)
+	r2=min(int((bbox[1]-georef[3])/georef[5])+1,M.shape[0])
+	return c1<c2 and r1<r2 and M[r1:r2,c1:c2].any()
+
+def grid_bounds(M,georef):
+	"""Bounding box of the True cells of a boolean grid."""
+	rows=np.flatnonzero(M.any(axis=1))
+	cols=np.flatnonzero(M.any(axis=0))
+	return (georef[0]+cols[0]*georef[1],georef[3]+(rows[-1]+1)*georef[5],georef[0]+(cols[-1]+1)*georef[1],georef[3]+rows[0]*georef[5])
 	
 
 #buffer_dist not None signals that we are using line strings, so use cut_to_line_buffer
 def zcheck_base(lasname,vectorname,angle_tolerance,xy_tolerance,z_tolerance,cut_class,reporter,buffer_dist=None,layername=None,layersql=None):
+	"""
+	Check features in the overlap of each pair of strips in a tile, by interpolating the points of one strip
+	in the triangulation of the other, and report the differences.
+	Returns:
+		The number of pairs of strips with overlapping footprints, i.e. the pairs which were checked.
+	"""
 	is_roads=buffer_dist is not None #'hacky' signal that its roads we're checking
 	print("Starting zcheck_base run at %s" %time.asctime())
 	tstart=time.process_time()
@@ -55,10 +117,9 @@ def zcheck_base(lasname,vectorname,angle_tolerance,xy_tolerance,z_tolerance,cut_
 		extent=None
 	geometries=vector_io.get_geometries(vectorname,layername,layersql,extent)
 	pcs=dict()
-	for id in pc.get_pids():
+	for id,pc_ in pc.cut_to_class(cut_class).split_by("pid").items():
 		print("%s\n" %("+"*70))
 		print("Strip id: %d" %id)
-		pc_=pc.cut_to_strip(id).cut_to_class(cut_class)
 		if pc_.get_size()>50:
 			pcs[id]=pc_
 			pcs[id].triangulate()
@@ -67,102 +128,107 @@ def zcheck_base(lasname,vectorname,angle_tolerance,xy_tolerance,z_tolerance,cut_
 			print("Not enough points....")
 		
 	del pc
-	done=[]
-	for id1 in pcs:
+	#Plan the work: find the pairs of strips which overlap (by footprints rather than bounding boxes),
+	#and index the features, so only features within each overlap are looked at.
+	pairs=[]
+	if len(pcs)>1:
+		georef,footprints=strip_footprints(pcs)
+		pairs=overlapping_pairs(list(pcs.keys()),footprints)
+		del footprints
+	print("%d pairs of overlapping strips." %len(pairs))
+	features=[] #(feature number, ogr geometry, bbox)
+	for fn,ogr_geom in enumerate(geometries,1):
+		try:
+			bbox=array_geometry.get_bounds(array_geometry.ogrgeom2array(ogr_geom))
+		except Exception as e:
+			print(str(e))
+			continue
+		if buffer_dist is not None:
+			bbox=bbox+(-buffer_dist,-buffer_dist,buffer_dist,buffer_dist)
+		features.append((fn,ogr_geom,bbox))
+	feature_tree=array_geometry.BBoxTree([f[2] for f in features])
+	for id1,id2,overlap in pairs:
 		pc1=pcs[id1]
-		for id2 in pcs:
-			if id1==id2 or (id1,id2) in done or (id2,id1) in done:
-				continue
-			done.append((id1,id2))
-			ml="-"*70
-			print("%s\nChecking strip %d against strip %d\n%s" %(ml,id1,id2,ml))
-			pc2=pcs[id2]
-			if not pc1.might_overlap(pc2):
+		pc2=pcs[id2]
+		ml="-"*70
+		print("%s\nChecking strip %d against strip %d\n%s" %(ml,id1,id2,ml))
+		overlap_box=array_geometry.bbox_intersection(pc1.get_bounds(),pc2.get_bounds())
+		if overlap_box is None: #footprints are expanded, so they can touch
+			continue
+		candidates=feature_tree.query(grid_bounds(overlap,georef))
+		if DEBUG:
+			print("DEBUG: %d of %d features near overlap" %(len(candidates),len(features)))
+		for i in candidates:
+			fn,ogr_geom,bbox=features[i]
+			if DEBUG:
+				print("----- feature: %d ------" %fn)
+			if not box_hits_grid(bbox,overlap,georef):
 				if DEBUG:
-					print("Strip %d and strip %d does not seem to overlap. Continuing..." %(id1,id2))
-					print("DEBUG: Strip1 bounds:\n%s\nStrip2 bounds:\n%s" %(pc1.get_bounds(),pc2.get_bounds())) 
+					print("Feature not in strip overlap. Continuing...")
 				continue
-			overlap_box=array_geometry.bbox_intersection(pc1.get_bounds(),pc2.get_bounds()) #shouldn't be None
-			fn=0
-			for ogr_geom in geometries:
-				fn+=1
-				try:
-					a_geom=array_geometry.ogrgeom2array(ogr_geom)
-				except Exception as e:
-					print(str(e))
-					continue
-				if DEBUG:
-					print("----- feature: %d ------" %fn)
-				bbox=array_geometry.get_bounds(a_geom)
+			#possibly cut the geometry into pieces contained in 'overlap' bbox
+			pieces=[ogr_geom]
+			dim=ogr_geom.GetDimension()
+			assert(dim==1 or dim==2)  #only line or polygons
+			if dim==1:
+				cut_geom=array_geometry.cut_geom_to_bbox(ogr_geom,overlap_box)
+				n_geoms=cut_geom.GetGeometryCount()
+				if n_geoms>0:
+					pieces=[cut_geom.GetGeometryRef(ng).Clone() for ng in range(n_geoms)]
+					print("Cut line into %d pieces..." %n_geoms)
+			
+			for geom_piece in pieces:
+				a_geom=array_geometry.ogrgeom2array(geom_piece) 
+				if buffer_dist is not None:
+					pc2_in_poly=pc2.cut_to_line_buffer(a_geom,buffer_dist)
+				else:
+					pc2_in_poly=pc2.cut_to_polygon(a_geom)
+				print("(%d,%d,%d):" %(id1,id2,fn))
+				if pc2_in_poly.get_size()>5:
+					stats12=check_feature(pc1,pc2_in_poly,DEBUG)
+				else:
+					stats12=None
+					print("Not enough points ( %d ) from strip %d in 'feature' (polygon / buffer)." %(pc2_in_poly.get_size(),id2))
 				
-				if  not (pc1.might_intersect_box(bbox) and pc2.might_intersect_box(bbox)):
-					if DEBUG:
-						print("Feature not in strip overlap. Continuing...")
-						print("DEBUG: Strip1 bounds:\n%s\nStrip2 bounds:\n%s\nPolygon bounds:\n%s" %(pc1.get_bounds(),pc2.get_bounds(),bbox)) 
-					continue
-				#possibly cut the geometry into pieces contained in 'overlap' bbox
-				pieces=[ogr_geom]
-				dim=ogr_geom.GetDimension()
-				assert(dim==1 or dim==2)  #only line or polygons
 				if dim==1:
-					cut_geom=array_geometry.cut_geom_to_bbox(ogr_geom,overlap_box)
-					n_geoms=cut_geom.GetGeometryCount()
-					if n_geoms>0:
-						pieces=[cut_geom.GetGeometryRef(ng).Clone() for ng in range(n_geoms)]
-						print("Cut line into %d pieces..." %n_geoms)
+					pc1_in_poly=pc1.cut_to_line_buffer(a_geom,buffer_dist)
+				else:
+					pc1_in_poly=pc1.cut_to_polygon(a_geom)
 				
-				for geom_piece in pieces:
-					a_geom=array_geometry.ogrgeom2array(geom_piece) 
-					if buffer_dist is not None:
-						pc2_in_poly=pc2.cut_to_line_buffer(a_geom,buffer_dist)
-					else:
-						pc2_in_poly=pc2.cut_to_polygon(a_geom)
-					print("(%d,%d,%d):" %(id1,id2,fn))
-					if pc2_in_poly.get_size()>5:
-						stats12=check_feature(pc1,pc2_in_poly,DEBUG)
-					else:
-						stats12=None
-						print("Not enough points ( %d ) from strip %d in 'feature' (polygon / buffer)." %(pc2_in_poly.get_size(),id2))
-					
-					if dim==1:
-						pc1_in_poly=pc1.cut_to_line_buffer(a_geom,buffer_dist)
-					else:
-						pc1_in_poly=pc1.cut_to_polygon(a_geom)
-					
-					print("(%d,%d,%d):" %(id2,id1,fn))
-					if pc1_in_poly.get_size()>5:
-						stats21=check_feature(pc2,pc1_in_poly,DEBUG)
-					else:
-						stats21=None
-						print("Not enough points ( %d ) from strip %d in 'feature' (polygon / buffer)." %(pc1_in_poly.get_size(),id1))
-					if (stats12 is not None or stats21 is not None):
-						c_prec=0
-						n_points=0
-						args12=[None]*4
-						args21=[None]*4
-						if stats12 is not None:
-							n_points+=stats12[3]
-							args12=stats12
-						if stats21 is not None:
-							n_points+=stats21[3]
-							args21=stats21
-						if stats12 is not None:
-							c_prec+=(stats12[2])*(stats12[3]/float(n_points))
-						if stats21 is not None:
-							c_prec+=(stats21[2])*(stats21[3]/float(n_points))
-						#Combined prec. now uses RMS-value.... Its simply a weightning of the two RMS'es...
-						#TODO: consider setting a min bound for the combined number of points.... or a 'confidence' weight...
-						args=[kmname,id1,id2]
-						for i in range(4):
-							args.extend([args12[i],args21[i]])
-						args.append(c_prec)
-						t1=time.process_time()
-						reporter.report(*args,ogr_geom=geom_piece)
-						t2=time.process_time()
-						print("Reporting took %.4s ms - concurrency?" %((t2-t1)*1e3))
+				print("(%d,%d,%d):" %(id2,id1,fn))
+				if pc1_in_poly.get_size()>5:
+					stats21=check_feature(pc2,pc1_in_poly,DEBUG)
+				else:
+					stats21=None
+					print("Not enough points ( %d ) from strip %d in 'feature' (polygon / buffer)." %(pc1_in_poly.get_size(),id1))
+				if (stats12 is not None or stats21 is not None):
+					c_prec=0
+					n_points=0
+					args12=[None]*4
+					args21=[None]*4
+					if stats12 is not None:
+						n_points+=stats12[3]
+						args12=stats12
+					if stats21 is not None:
+						n_points+=stats21[3]
+						args21=stats21
+					if stats12 is not None:
+						c_prec+=(stats12[2])*(stats12[3]/float(n_points))
+					if stats21 is not None:
+						c_prec+=(stats21[2])*(stats21[3]/float(n_points))
+					#Combined prec. now uses RMS-value.... Its simply a weightning of the two RMS'es...
+					#TODO: consider setting a min bound for the combined number of points.... or a 'confidence' weight...
+					args=[kmname,id1,id2]
+					for i in range(4):
+						args.extend([args12[i],args21[i]])
+					args.append(c_prec)
+					t1=time.process_time()
+					reporter.report(*args,ogr_geom=geom_piece)
+					t2=time.process_time()
+					print("Reporting took %.4s ms - concurrency?" %((t2-t1)*1e3))
 	tend=time.process_time()
 	tall=tend-tstart
 	frac_read=tread/tall
 	print("Finished checking tile, time spent: %.3f s, fraction spent on reading las data: %.3f" %(tall,frac_read))
-	return len(done)
+	return len(pairs)
 	
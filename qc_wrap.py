@@ -28,6 +28,8 @@ import os
 import time
 import traceback
 import multiprocessing
+import multiprocessing.connection
+import bisect
 import sqlite3 as sqlite
 import argparse
 from datetime import timedelta
@@ -39,25 +41,87 @@ from proc_setup import setup_job
 from proc_setup import show_tests
 from proc_setup import QC_WRAP_NAMES
 from proc_setup import QC_WRAP_DEFAULTS
+from proc_setup import get_tests
 import qc
 from qc.db import report
+from qc.thatsDEM import pointcloud
+from qc.thatsDEM import array_geometry
 from qc import dhmqc_constants as constants
 from qc.utils import osutils
+from qc.utils import profiling
+from qc.utils.profiling import get_rss
 
 LOGDIR = os.path.join(os.path.dirname(__file__), "logs")
 STATUS_PROCESSING = 1
 STATUS_OK = 2
 STATUS_ERROR = 3
+# The process db is only written by the parent process. Updates are written in batches.
+DB_BATCH_SIZE = 200
+DB_BATCH_TIME = 5.0  # seconds
+# Number of tiles queued pr. worker, so that a worker does not wait for the parent between tiles.
+TILES_PR_WORKER = 2
 
 ogr.UseExceptions()
 
-def run_check(p_number, testname, db_name, add_args, runid, use_local, schema, use_ref_data, lock):
+def run_tests(tests, lasname, vname, stderr):
+    '''
+    Run a list of (testname, targs, use_ref_data) tests on a single tile.
+    When more than one test is run, the pointcloud is read once and shared
+    between the tests.
+    Returns status, return code and message for the process db.
+    '''
+    multi = len(tests) > 1
+    return_code = 0
+    errors = []
+    try:
+        if multi and os.path.splitext(lasname)[1].lower() in (".las", ".laz"):
+            print("[qc_wrap]: Reading {0:s} once for {1:d} tests...".format(lasname, len(tests)))
+            pc = pointcloud.fromAny(lasname, include_return_number=True)
+            pointcloud.set_preloaded(lasname, pc)
+        for testname, targs, use_ref_data in tests:
+            send_args = [testname, lasname]
+            if use_ref_data:
+                send_args.append(vname)
+            send_args += targs
+            try:
+                rc = qc.get_test(testname)(send_args)
+                # reporting is buffered - make sure it's written before the tile is marked as done.
+                report.flush_all()
+            except Exception as err_msg:
+                # the tile will be marked as failed, so don't write partial results.
+                report.discard_all()
+                errors.append(testname + ": " + str(err_msg) if multi else str(err_msg))
+                stderr.write("[qc_wrap]: Exception caught in {0:s}:\n".format(testname) + str(err_msg) + "\n")
+                stderr.write("[qc_wrap]: Traceback:\n" + traceback.format_exc() + "\n")
+                continue
+            try:
+                return_code += int(rc)
+            except (NameError, ValueError, TypeError):
+                pass
+    except Exception as err_msg:
+        # unable to read the tile
+        errors.append(str(err_msg))
+        stderr.write("[qc_wrap]: Exception caught:\n" + str(err_msg) + "\n")
+        stderr.write("[qc_wrap]: Traceback:\n" + traceback.format_exc() + "\n")
+    finally:
+        pointcloud.clear_preloaded()
+    if errors:
+        return STATUS_ERROR, -1, "; ".join(errors)
+    return STATUS_OK, return_code, "ok"
+
+
+def run_check(p_number, testname, tests, runid, use_local, schema, conn, index_dir=None, filter_threads=None,
+              tin_cache_dir=None):
     '''
     Main checker rutine which should be defined for all processes.
+    Tiles (id, las_path, ref_path) are received on the connection conn until a None is received.
+    A ("start", ...) message is sent back when a tile is started and a ("done", ...) message
+    when it is finished, including the time spent in stages (see qc.utils.profiling) -
+    the process db is updated by the parent.
+    Sending on a pipe is synchronous, so the parent knows which tile a process was doing,
+    even if it dies abruptly.
     '''
 
-    logger = multiprocessing.log_to_stderr()
-    test_func = qc.get_test(testname)
     #Set up some globals in various modules... per process.
     if runid is not None:
         report.set_run_id(runid)
@@ -68,13 +132,13 @@ def run_check(p_number, testname, db_name, add_args, runid, use_local, schema, u
         report.set_use_local(True)
     elif schema is not None:
         report.set_schema(schema)
-    #LOAD THE DATABASE
-    con = sqlite.connect(db_name)
-    if con is None:
-        logger.error("[qc_wrap]: Process: {0:d}, unable to fetch process db".format(p_number))
-        return
+    if index_dir is not None:
+        pointcloud.set_spatial_index_dir(index_dir)
+    if tin_cache_dir is not None:
+        pointcloud.set_tin_cache_dir(tin_cache_dir)
+    if filter_threads is not None:
+        array_geometry.set_filter_threads(filter_threads)
 
-    cur = con.cursor()
     timestamp = (time.asctime().split()[-2]).replace(':', '_')
     logname = testname + '_' + timestamp + '_' + str(p_number) + '.log'
     logname = os.path.join(LOGDIR, logname)
@@ -84,84 +148,39 @@ def run_check(p_number, testname, db_name, add_args, runid, use_local, schema, u
     filler = '*-*' * 23
     print(filler)
     print('[qc_wrap]: Running {test} routine at {time}, process: {proc}, run id: {rid}'.format(
-        test=testname,
+        test=", ".join(test[0] for test in tests),
         time=time.asctime(),
         proc=p_number,
         rid=runid))
 
     print(filler)
     done = 0
-    cur.execute('select count() from ' + testname + ' where status=0')
-    n_left = cur.fetchone()[0]
-    while n_left > 0:
-        print(filler)
-        print("[qc_wrap]: Number of tiles left: {0:d}".format(n_left))
-        print(filler)
-        #Critical section#
-        lock.acquire()
-        cur.execute("select id,las_path,ref_path from " + testname + " where status=0")
-        data = cur.fetchone()
-        if data is None:
-            print("[qc_wrap]: odd - seems to be no more tiles left...")
-            lock.release()
+    while True:
+        task = conn.recv()
+        if task is None:
             break
-        fid, lasname, vname = data
-        cur.execute("update " + testname + " set status=?,prc_id=?,exe_start=? where id=?",
-                    (STATUS_PROCESSING, p_number, time.asctime(), fid))
-        try:
-            con.commit()
-        except Exception as err_msg:
-            stderr.write("[qc_wrap]: Unable to update tile to finish status...\n" + err_msg + "\n")
-            break
-        finally:
-            lock.release()
-
-        #end critical section#
+        fid, lasname, vname = task
+        conn.send(("start", fid, time.asctime()))
+        print(filler)
         print("[qc_wrap]: Doing lasfile {0:s}...".format(lasname))
-        send_args = [testname, lasname]
-        if use_ref_data:
-            send_args.append(vname)
-        send_args += add_args
-        try:
-            return_code = test_func(send_args)
-        except Exception as err_msg:
-            return_code = -1
-            msg = str(err_msg)
-            status = STATUS_ERROR
-            stderr.write("[qc_wrap]: Exception caught:\n" + msg + "\n")
-            stderr.write("[qc_wrap]: Traceback:\n" + traceback.format_exc() + "\n")
-        else:
-            #set new status
-            msg = "ok"
-            status = STATUS_OK
-            try:
-                return_code = int(return_code)
-            except (NameError, ValueError, TypeError):
-                return_code = 0
-        cur.execute("update " + testname + " set status=?,exe_end=?,rcode=?,msg=? where id=?",
-                    (status, time.asctime(), return_code, msg, fid))
+        profiling.reset()
+        with profiling.stage("tile"):
+            status, return_code, msg = run_tests(tests, lasname, vname, stderr)
+        conn.send(("done", fid, (status, return_code, msg, time.asctime(), profiling.get_totals())))
         done += 1
-        try:
-            con.commit()
-        except Exception as err_msg:
-            stderr.write("[qc_wrap]: Unable to update tile to finish status...\n" + err_msg + "\n")
-        #go on to next one...
-        cur.execute("select count() from " + testname + " where status=0")
-        n_left = cur.fetchone()[0]
 
     print("[qc_wrap]: Checked %d tiles, finished at %s" %(done, time.asctime()))
-    cur.close()
-    con.close()
     #avoid writing to a closed fp...
     stdout.close()
     stderr.close()
     logfile.close()
+    conn.close()
 
 
 #argument handling - set destination name to correpsond to one of the names in NAMES
 parser = argparse.ArgumentParser(
-    description='''Wrapper rutine for qc modules. Will use a sqlite database to manage
-                   multi-processing.''')
+    description='''Wrapper rutine for qc modules. Tiles are handed out to worker processes
+                   and their status is recorded in a sqlite database.''')
 parser.add_argument(
     "param_file",
     help="Input python parameter file.",
@@ -170,6 +189,13 @@ parser.add_argument(
     "-testname",
     dest="TESTNAME",
     help="Specify testname, will override a definition in parameter file.")
+parser.add_argument(
+    "-tests",
+    dest="TESTS",
+    nargs="+",
+    help='''Specify several tests to run on each tile, which is then only read once.
+            Give each test as testname or "testname:targs".
+            Will override TESTNAME and TESTS in parameter file.''')
 parser.add_argument(
     "-testhelp",
     help="Just print help for selected test.")
@@ -208,6 +234,41 @@ parser.add_argument(
     dest="MP",
     type=int,
     help="Specify maximal number of processes to spawn (defaults to number of kernels).")
+parser.add_argument(
+    "-index_dir",
+    dest="INDEX_DIR",
+    help="Store spatial indices of pointclouds in this directory and reuse them in later runs.")
+parser.add_argument(
+    "-tin_cache_dir",
+    dest="TIN_CACHE_DIR",
+    help="Store triangulations of pointclouds (e.g. strips) in this directory and reuse them in later runs.")
+parser.add_argument(
+    "-max_tiles",
+    dest="MAX_TILES",
+    type=int,
+    help="Replace each process by a new one after this many tiles (to release leaked memory).")
+parser.add_argument(
+    "-tile_timeout",
+    dest="TILE_TIMEOUT",
+    type=float,
+    help="Stop a tile (and mark it as failed) if it takes more than this many seconds.")
+parser.add_argument(
+    "-max_rss",
+    dest="MAX_RSS",
+    type=float,
+    help='''Stop a tile (and mark it as failed) if the process uses more than this many MB of memory.
+            Requires psutil on other platforms than linux.''')
+parser.add_argument(
+    "-resume",
+    dest="RESUME",
+    help='''Continue an interrupted run using its process db (e.g. z_precision_roads_1458214567.sqlite).
+            The tiles are taken from the process db, and tiles already done are skipped.''')
+parser.add_argument(
+    "-retries",
+    dest="RETRIES",
+    type=int,
+    help='''Used with -resume: Retry tiles which failed, unless they have already been retried
+            this many times (default 0).''')
 parser.add_argument(
     "-statusinterval",
     dest="STATUS_INTERVAL",
@@ -234,7 +295,17 @@ CREATE_SQLITE_DB = """CREATE TABLE __tablename__(
                         exe_end TEXT,
                         status INTEGER,
                         rcode INTEGER,
-                        msg TEXT)"""
+                        msg TEXT,
+                        retries INTEGER)"""
+
+# Time spent pr. tile in processing stages, see qc.utils.profiling
+CREATE_STAGES_TABLE = """CREATE TABLE IF NOT EXISTS __tablename__(
+                           tile_id INTEGER,
+                           stage TEXT,
+                           calls INTEGER,
+                           seconds REAL,
+                           points INTEGER,
+                           peak_rss_mb REAL)"""
 
 INIT_DB = """SELECT InitSpatialMetadata(1)"""
 
@@ -245,9 +316,25 @@ ADD_GEOMETRY = """SELECT AddGeometryColumn('{tablename}',
                                            'XY')"""
 
 
+def sort_tiles(matched_files):
+    '''
+    Sort (las_path, ref_path) pairs row by row (north to south, then west to east)
+    according to the tile names, so that tiles processed one after another are neighbours.
+    Tiles with names not following the tiling scheme are put last.
+    '''
+    def tile_position(item):
+        try:
+            x1, y1, x2, y2 = constants.tilename_to_extent(constants.get_tilename(item[0]))
+        except (ValueError, IndexError):
+            return (1, 0, 0)
+        return (0, -y1, x1)
+    return sorted(matched_files, key=tile_position)
+
+
 def create_process_db_sqlite(testname, matched_files):
     '''
     Setup process db for organizing parallel processing.
+    Tiles are inserted row by row, see sort_tiles.
     '''
 
 
@@ -269,9 +356,10 @@ def create_process_db_sqlite(testname, matched_files):
     layer.CreateField(ogr.FieldDefn('status', ogr.OFTInteger))
     layer.CreateField(ogr.FieldDefn('rcode', ogr.OFTInteger))
     layer.CreateField(ogr.FieldDefn('msg', ogr.OFTString))
+    layer.CreateField(ogr.FieldDefn('retries', ogr.OFTInteger))
 
     pid = 0
-    for lasname, vname in matched_files:
+    for lasname, vname in sort_tiles(matched_files):
         tile = constants.get_tilename(lasname)
         wkt = constants.tilename_to_extent(tile, return_wkt=True)
 
@@ -281,6 +369,7 @@ def create_process_db_sqlite(testname, matched_files):
         feature.SetField('las_path', lasname)
         feature.SetField('ref_path', vname)
         feature.SetField('status', 0)
+        feature.SetField('retries', 0)
 
         feature.SetGeometry(ogr.CreateGeometryFromWkt(wkt))
         layer.CreateFeature(feature)
@@ -291,6 +380,315 @@ def create_process_db_sqlite(testname, matched_files):
     return db_name
 
 
+def resume_process_db(db_name, testname, max_retries=0):
+    '''
+    Reopen the process db of an interrupted run, so that tiles not done can be processed.
+    Tiles left in STATUS_PROCESSING (by a run which was killed) are reset. Tiles with
+    STATUS_ERROR are reset, if they have been retried less than max_retries times.
+    Returns db_name or None if the db cannot be used.
+    '''
+    if not os.path.isfile(db_name):
+        print("Process db {0} does not exist.".format(db_name))
+        return None
+    con = sqlite.connect(db_name)
+    try:
+        cur = con.execute("select count() from sqlite_master where type='table' and name=?",
+                          (testname,))
+        if cur.fetchone()[0] == 0:
+            print("Process db {0} does not contain a table for {1}.".format(db_name, testname))
+            return None
+        columns = [row[1] for row in con.execute("pragma table_info(" + testname + ")")]
+        with con:
+            if "retries" not in columns:
+                # process db created before retries were counted
+                con.execute("alter table " + testname + " add column retries INTEGER")
+            cur = con.execute("update " + testname + " set status=0,prc_id=NULL,exe_start=NULL "
+                              "where status=?", (STATUS_PROCESSING,))
+            n_orphans = cur.rowcount
+            cur = con.execute("update " + testname + " set status=0,prc_id=NULL,exe_start=NULL,"
+                              "exe_end=NULL,rcode=NULL,msg=NULL,retries=ifnull(retries,0)+1 "
+                              "where status=? and ifnull(retries,0)<?", (STATUS_ERROR, max_retries))
+            n_retries = cur.rowcount
+        counts = dict(con.execute("select status,count() from " + testname + " group by status"))
+    finally:
+        con.close()
+    print("Resuming {0}: {1:d} tile(s) done, {2:d} tile(s) failed.".format(
+        db_name, counts.get(STATUS_OK, 0), counts.get(STATUS_ERROR, 0)))
+    print("Tiles to process: {0:d} ({1:d} interrupted, {2:d} retried).".format(
+        counts.get(0, 0), n_orphans, n_retries))
+    return db_name
+
+
+class ProcessDb(object):
+    '''
+    Reading tiles from and writing status of tiles to the process db.
+    Status updates are collected and written in batches, each in a single transaction.
+    '''
+
+    def __init__(self, db_name, testname):
+        self.con = sqlite.connect(db_name)
+        self.testname = testname
+        self.stages_table = testname + "_stages"
+        self.started = []
+        self.finished = []
+        self.stages = []
+        self.t_flush = time.time()
+        with self.con:
+            self.con.execute(CREATE_STAGES_TABLE.replace("__tablename__", self.stages_table))
+
+    def get_tiles(self):
+        '''Return (id, las_path, ref_path) of tiles not processed yet, in id order.'''
+        cur = self.con.execute("select id,las_path,ref_path from " + self.testname +
+                               " where status=0 order by id")
+        return cur.fetchall()
+
+    def count(self, status, op="="):
+        '''Count tiles by status.'''
+        cur = self.con.execute("select count() from " + self.testname + " where status" + op + "?",
+                               (status,))
+        return cur.fetchone()[0]
+
+    def set_started(self, fid, p_number, exe_start):
+        self.started.append((STATUS_PROCESSING, p_number, exe_start, fid))
+        self.maybe_flush()
+
+    def set_finished(self, fid, status, return_code, msg, exe_end, stages=None):
+        '''Set status of a tile. stages is a dict as returned by profiling.get_totals.'''
+        self.finished.append((status, exe_end, return_code, msg, fid))
+        if stages:
+            for name, (calls, seconds, points, peak_rss) in stages.items():
+                if peak_rss is not None:
+                    peak_rss /= 1024.0 ** 2
+                self.stages.append((fid, name, calls, seconds, points, peak_rss))
+        self.maybe_flush()
+
+    def stage_totals(self):
+        '''Return (stage, calls, seconds, points) summed over all tiles, slowest stage first.'''
+        cur = self.con.execute("select stage,sum(calls),sum(seconds),sum(points) from " +
+                               self.stages_table + " group by stage order by sum(seconds) desc")
+        return cur.fetchall()
+
+    def maybe_flush(self):
+        if (len(self.started) + len(self.finished) >= DB_BATCH_SIZE or
+                time.time() - self.t_flush > DB_BATCH_TIME):
+            self.flush()
+
+    def flush(self):
+        '''Write collected updates. Will be retried on the next flush if the db is busy.'''
+        try:
+            with self.con:
+                self.con.executemany("update " + self.testname +
+                                     " set status=?,prc_id=?,exe_start=? where id=?", self.started)
+                self.con.executemany("update " + self.testname +
+                                     " set status=?,exe_end=?,rcode=?,msg=? where id=?", self.finished)
+                # stages of a tile which is done again (see -resume) are replaced
+                self.con.executemany("delete from " + self.stages_table + " where tile_id=?",
+                                     set((row[0],) for row in self.stages))
+                self.con.executemany("insert into " + self.stages_table + " values(?,?,?,?,?,?)",
+                                     self.stages)
+        except sqlite.OperationalError as err_msg:
+            print("[qc_wrap]: Unable to update process db: {0}. Trying again later.".format(err_msg))
+            return
+        self.started = []
+        self.finished = []
+        self.stages = []
+        self.t_flush = time.time()
+
+    def close(self):
+        self.flush()
+        self.con.close()
+
+
+class Worker(object):
+    '''
+    A worker process running run_check, and the tiles handed to it.
+    '''
+
+    def __init__(self, p_number, next_id, worker_args):
+        self.p_number = p_number
+        self.next_id = next_id  # the worker continues from here, see TileScheduler.assign
+        self.assigned = []  # ids of tiles sent to the worker, in order
+        self.started = False  # whether the first assigned tile has been started
+        self.stopping = False  # whether the worker has been told to stop
+        self.n_given = 0  # number of tiles sent to the worker
+        self.t_tile = None  # start time of current tile
+        self.kill_reason = None  # set when the worker is stopped by the scheduler
+        self.conn, child_conn = multiprocessing.Pipe()
+        kwargs = dict(worker_args, p_number=p_number, conn=child_conn)
+        self.process = multiprocessing.Process(target=run_check, kwargs=kwargs)
+        self.process.start()
+        child_conn.close()
+
+    def receive(self):
+        '''Return messages sent by the worker process so far.'''
+        msgs = []
+        try:
+            while self.conn.poll():
+                msgs.append(self.conn.recv())
+        except (EOFError, OSError):
+            # process has exited
+            pass
+        return msgs
+
+
+class TileScheduler(object):
+    '''
+    Hand out tiles to worker processes and collect the results, which are written to the process db.
+    Each worker starts on its own stretch of the (spatially ordered) tiles and is given the next tile
+    in id order after its last one, if not taken by others, so that workers mostly handle neighbouring
+    tiles one after another. A worker which dies is replaced, and the tile it was doing is marked as failed.
+    Optionally workers are replaced after max_tiles tiles, and killed if a tile takes longer than
+    tile_timeout seconds or the process uses more than max_rss bytes of memory.
+    '''
+
+    def __init__(self, process_db, worker_args, n_workers, max_tiles=None, tile_timeout=None,
+                 max_rss=None):
+        self.process_db = process_db
+        self.worker_args = worker_args
+        self.max_tiles = max_tiles
+        self.tile_timeout = tile_timeout
+        self.max_rss = max_rss
+        tiles = process_db.get_tiles()
+        self.paths = dict((fid, (lasname, vname)) for fid, lasname, vname in tiles)
+        self.pending = [tile[0] for tile in tiles]
+        self.n_todo = len(self.pending)
+        self.n_done = 0
+        self.n_err = 0
+        self.n_crashes = 0
+        self.workers = {}
+        self.n_started = 0
+        n_workers = min(n_workers, self.n_todo)
+        for i in range(n_workers):
+            self.start_worker(self.pending[(i * self.n_todo) // n_workers])
+
+    def start_worker(self, next_id):
+        worker = Worker(self.n_started, next_id, self.worker_args)
+        self.workers[worker.p_number] = worker
+        self.n_started += 1
+        self.assign(worker)
+
+    def assign(self, worker):
+        '''Keep TILES_PR_WORKER tiles queued for the worker - or tell it to stop when no tiles are left.'''
+        while (len(worker.assigned) < TILES_PR_WORKER and self.pending and
+               not self.is_used_up(worker)):
+            i = bisect.bisect_left(self.pending, worker.next_id)
+            if i == len(self.pending):
+                # we have caught up with the tiles done by others - take the first one left
+                i = 0
+            fid = self.pending.pop(i)
+            worker.next_id = fid + 1
+            worker.assigned.append(fid)
+            worker.n_given += 1
+            self.send(worker, (fid,) + self.paths[fid])
+        if (not self.pending or self.is_used_up(worker)) and not worker.stopping:
+            self.send(worker, None)
+            worker.stopping = True
+
+    def is_used_up(self, worker):
+        '''Whether the worker should be replaced by a fresh process.'''
+        return self.max_tiles is not None and worker.n_given >= self.max_tiles
+
+    def send(self, worker, task):
+        try:
+            worker.conn.send(task)
+        except (EOFError, OSError):
+            # the process has died - will be handled when reaped.
+            pass
+
+    def handle(self, worker, msg):
+        kind, fid, data = msg
+        if kind == "start":
+            worker.started = True
+            worker.t_tile = time.time()
+            self.process_db.set_started(fid, worker.p_number, data)
+        elif kind == "done":
+            status, return_code, text, exe_end, stages = data
+            worker.assigned.remove(fid)
+            worker.started = False
+            self.finish(fid, status, return_code, text, exe_end, stages)
+            self.assign(worker)
+
+    def finish(self, fid, status, return_code, text, exe_end, stages=None):
+        self.process_db.set_finished(fid, status, return_code, text, exe_end, stages)
+        self.n_done += 1
+        if status == STATUS_ERROR:
+            self.n_err += 1
+
+    def poll(self, timeout=1.0):
+        '''Wait up to timeout seconds for messages from workers or workers exiting, and handle those.'''
+        workers = list(self.workers.values())
+        conns = dict((worker.conn, worker) for worker in workers)
+        sentinels = dict((worker.process.sentinel, worker) for worker in workers)
+        ready = multiprocessing.connection.wait(list(conns) + list(sentinels), timeout)
+        for obj in ready:
+            if obj in conns:
+                worker = conns[obj]
+                for msg in worker.receive():
+                    self.handle(worker, msg)
+        for obj in ready:
+            if obj in sentinels:
+                self.reap(sentinels[obj])
+        self.check_limits()
+
+    def check_limits(self):
+        '''Kill workers where the current tile takes too long or uses too much memory.'''
+        if self.tile_timeout is None and self.max_rss is None:
+            return
+        for worker in list(self.workers.values()):
+            for msg in worker.receive():
+                self.handle(worker, msg)
+            if not worker.started or worker.kill_reason is not None:
+                continue
+            reason = None
+            if self.tile_timeout is not None and time.time() - worker.t_tile > self.tile_timeout:
+                reason = "Tile timed out after {0:.0f} s.".format(self.tile_timeout)
+            elif self.max_rss is not None:
+                rss = get_rss(worker.process.pid)
+                if rss is not None and rss > self.max_rss:
+                    reason = "Process used {0:.0f} MB of memory, limit is {1:.0f} MB.".format(
+                        rss / 1024.0 ** 2, self.max_rss / 1024.0 ** 2)
+            if reason is not None:
+                print("[qc_wrap]: Stopping process {0:d}: {1:s}".format(worker.p_number, reason))
+                worker.kill_reason = reason
+                worker.process.terminate()
+
+    def reap(self, worker):
+        '''Clean up after a worker which has exited.'''
+        # messages sent just before exiting might not have been handled yet
+        for msg in worker.receive():
+            self.handle(worker, msg)
+        worker.process.join()
+        worker.conn.close()
+        del self.workers[worker.p_number]
+        if (worker.kill_reason is None and worker.stopping and not worker.assigned and
+                worker.process.exitcode == 0):
+            # stopped as told - start a new process if the worker was replaced (see max_tiles)
+            if self.pending:
+                self.start_worker(worker.next_id)
+            return
+        if worker.kill_reason is None:
+            self.n_crashes += 1
+            print("[qc_wrap]: Process {0:d} stopped unexpectedly (exit code {1}).".format(
+                worker.p_number, worker.process.exitcode))
+            reason = "Process stopped unexpectedly."
+        else:
+            reason = worker.kill_reason
+        crashed_on_tile = worker.started and len(worker.assigned) > 0
+        if crashed_on_tile:
+            fid = worker.assigned.pop(0)
+            self.finish(fid, STATUS_ERROR, -1, reason, time.asctime())
+        # tiles queued, but not started, go back to the pool
+        self.pending = sorted(self.pending + worker.assigned)
+        # only replace workers which got to do something - otherwise we could keep spawning processes
+        # which die right away.
+        if crashed_on_tile and self.pending:
+            self.start_worker(worker.next_id)
+
+    @property
+    def n_alive(self):
+        return len(self.workers)
+
+
 def main(args):
     '''
     Main processing loop.
@@ -327,67 +725,68 @@ def main(args):
     ############################
 
     testname = args["TESTNAME"]
-    use_ref_data = qc.tests[args["TESTNAME"]][0]
-    if len(matched_files) > 0:
+    tests = [(name, targs, qc.tests[name][0]) for name, targs in get_tests(args)]
+    n_done, n_err, n_crashes, n_alive = 0, 0, 0, 0
+    if args["RESUME"] is not None:
+        db_name = resume_process_db(args["RESUME"], testname, args["RETRIES"])
+        if db_name is None:
+            return 1
+    elif len(matched_files) > 0:
         #Create db for process control...
-        lock = multiprocessing.Lock()
         db_name = create_process_db_sqlite(testname, matched_files)
         if db_name is None:
             print("Something wrong - process control db not created.")
             return 1
+    else:
+        db_name = None
+    if db_name is not None:
         if args["MP"]:
             n_workers = args["MP"]
         else:
             n_workers = multiprocessing.cpu_count()
         assert n_workers > 0
 
-        n_tasks = min(n_workers, len(matched_files))
-        print("Starting %d process(es)." % n_tasks)
         if args["RUN_ID"] is not None:
             print("Run-id is set to: %d" % args["RUN_ID"])
         print("Using process db: " + db_name)
+        if args["INDEX_DIR"] is not None:
+            # create it here, rather than racing in the workers
+            pointcloud.set_spatial_index_dir(args["INDEX_DIR"])
+            print("Using spatial index dir: " + args["INDEX_DIR"])
+        if args["TIN_CACHE_DIR"] is not None:
+            pointcloud.set_tin_cache_dir(args["TIN_CACHE_DIR"])
+            print("Using triangulation cache dir: " + args["TIN_CACHE_DIR"])
+        if args["MAX_RSS"] and get_rss(os.getpid()) is None:
+            print("Unable to measure memory usage of processes on this platform - install psutil.")
+            return 1
 
-        tasks = []
-        for i in range(n_tasks):
-            test_args = (i, testname, db_name, args["TARGS"], args["RUN_ID"],
-                         args["USE_LOCAL"], args["SCHEMA"], use_ref_data, lock)
-            worker = multiprocessing.Process(
-                target=run_check,
-                args=test_args)
-            tasks.append(worker)
-            worker.start()
-
-        #Now watch the processing#
-        con = sqlite.connect(db_name)
-        cur = con.cursor()
-        n_todo = len(matched_files)
-        n_crashes = 0
-        n_done = 0
-        n_err = 0
-        n_left = n_todo
-        n_alive = n_tasks
+        worker_args = {"testname": testname,
+                       "tests": tests,
+                       "runid": args["RUN_ID"],
+                       "use_local": args["USE_LOCAL"],
+                       "schema": args["SCHEMA"],
+                       "index_dir": args["INDEX_DIR"],
+                       "tin_cache_dir": args["TIN_CACHE_DIR"],
+                       # share the cores between the processes when filtering
+                       "filter_threads": max(multiprocessing.cpu_count() // n_workers, 1)}
+        process_db = ProcessDb(db_name, testname)
         #start clock#
         time1 = time.time()  #we don't wanne measure cpu-time here...
-        t_last_report = 0
+        max_rss = args["MAX_RSS"] * 1024 ** 2 if args["MAX_RSS"] else None
+        scheduler = TileScheduler(process_db, worker_args, n_workers, args["MAX_TILES"] or None,
+                                  args["TILE_TIMEOUT"] or None, max_rss)
+        n_todo = scheduler.n_todo
+        print("Started %d process(es)." % scheduler.n_alive)
+        t_last_report = time1
         t_last_status = time1
 
-        while n_alive > 0 and n_left > 0:
-            time.sleep(5)
-
-            try:
-                cur.execute("""SELECT COUNT()
-                               FROM {test}
-                               WHERE status>?""".format(test=testname), (STATUS_PROCESSING,))
-            except sqlite.OperationalError as err_msg:
-                print('Database Error: {msg}. Trying again.'.format(msg=err_msg))
-                continue
-
-            n_done = cur.fetchone()[0]
-            n_alive = 0
-            for task in tasks:
-                n_alive += task.is_alive()
-
-            #n_left: those tiles which have status 0 or STATUS_PROCESSING
+        #Now watch the processing#
+        while scheduler.n_alive > 0:
+            scheduler.poll()
+            n_done = scheduler.n_done
+            n_err = scheduler.n_err
+            n_alive = scheduler.n_alive
+            #n_left: those tiles which are not done yet
             n_left = n_todo - n_done
             f_done = (float(n_done) / n_todo) * 100
             now = time.time()
@@ -405,33 +804,30 @@ def main(args):
                              "estimated time left: {3:s}, active: {4:d}"
                 print(status_msg.format(testname, f_done, n_left, t_left, n_alive))
 
-                cur.execute("""SELECT COUNT()
-                               FROM {test}
-                               WHERE status=?""".format(test=testname), (STATUS_ERROR,))
-
-                n_err = cur.fetchone()[0]
                 if n_err > 0:
                     print("[qc_wrap]: {0:d} exceptions caught. Check sqlite-db.".format(n_err))
                 t_last_report = now
                 if args["status_update"] and dt_last_status > args["STATUS_INTERVAL"]:
                     args["status_update"].update(args["TESTNAME"], n_done, n_err, n_alive)
                     t_last_status = now
-            #Try to keep n_tasks alive... If n_left>n_alive,
-            # which means that there could be some with status 0 still left...
-            if n_alive < n_tasks and n_left > n_alive:
-                print("[qc_wrap]: A process seems to have stopped...")
-                n_crashes += 1
+        n_crashes = scheduler.n_crashes
+        n_alive = scheduler.n_alive
+        process_db.flush()
         time2 = time.time()
         print("Running time %s" % (timedelta(seconds=time2 - time1)))
-        cur.execute("SELECT COUNT() FROM " + testname + " WHERE status>?", (STATUS_PROCESSING,))
-        n_done = cur.fetchone()[0]
-        cur.execute("SELECT COUNT() FROM " + testname + " WHERE status=?", (STATUS_ERROR,))
-        n_err = cur.fetchone()[0]
+        n_done = process_db.count(STATUS_PROCESSING, ">")
+        n_err = process_db.count(STATUS_ERROR)
         print("[qc_wrap]: Did {0:d} tile(s).".format(n_done))
         if n_err > 0:
             print("[qc_wrap]: {0:d} exceptions caught - check logfile(s)!".format(n_err))
-        cur.close()
-        con.close()
+        n_left = process_db.count(0)
+        if n_left > 0:
+            print("[qc_wrap]: {0:d} tile(s) were not processed.".format(n_left))
+        print("[qc_wrap]: Time spent in stages (see table {0:s}):".format(process_db.stages_table))
+        for name, calls, seconds, points in process_db.stage_totals():
+            print("    {0:<20s} {1:>12.1f} s {2:>10d} call(s) {3:>14d} point(s)".format(
+                name, seconds, calls, points))
+        process_db.close()
 
     print("qc_wrap finished at %s" % (time.asctime()))
     if args["post_execute"] is not None:
@@ -37,13 +37,12 @@ static double d_p_line(double *p1,double *p2, double *p3);
 static double d_p_line_string(double *p, double *verts, unsigned long nv);
 static int do_lines_intersect(double *p1,double *p2, double *p3, double *p4);
 static void apply_filter(double *xy, double *z, double *pc_xy, double *pc_z, double *vals_out, int *spatial_index, double *header,  int npoints, FILTER_FUNC filter_func,  double filter_rad, double nd_val, void *opt_params);
-static double min_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
-static double spike_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
-static double mean_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
-static double var_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
-static double density_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
-static double distance_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
-static int compar (const void* a, const void* b);
+static double min_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
+static double spike_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
+static double mean_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
+static double var_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
+static double density_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
+static double distance_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params);
 
 
 /*almost copy from trig_index.c*/
@@ -299,8 +298,10 @@ int fill_spatial_index(int *sorted_flat_indices, int *index, int npoints, int ma
 
 
 /* this will simply give us slices to boxes around the box of each pt. - the finer details are left to the filter func-*/
+/* the box is ceil(filter_rad/cs) cells (at least one) on each side of the cell of the pt, so any filter radius can be used with the same index. */
+/* one slice pr. row of the box */
 static void apply_filter(double *xy, double *z, double *pc_xy, double *pc_z, double *vals_out, int *spatial_index, double *header,  int npoints, FILTER_FUNC filter_func,  double filter_rad, double nd_val, void *opt_params){
-	int i,j, ind1,ind2, nfound, slices[6],r,c,r1,c1,c2,ncols,nrows;
+	int i,j, ind1,ind2, nfound, *slices,r,c,r1,c1,c2,ncols,nrows,k,nslices;
 	double x1,y2,cs,zz, frad2;
 	ncols=(int) header[0];
 	nrows=(int) header[1];
@@ -308,38 +309,40 @@ static void apply_filter(double *xy, double *z, double *pc_xy, double *pc_z, dou
 	y2=header[3];
 	cs=header[4];
 	frad2=SQUARE(filter_rad);
+	k=MAX((int) ceil(filter_rad/cs),1);
+	nslices=2*k+1;
+	slices=malloc(sizeof(int)*2*nslices);
 	/*unsigned long mf=0;*/
 	for(i=0; i<npoints; i++){
 		vals_out[i]=nd_val;
-		c=(int) ((xy[2*i]-x1)/cs);
-		r=(int) ((y2-xy[2*i+1])/cs);
-		/*should ensure that c-1 can never be larger than ncols-1, etc*/
-		if (c<-1 || c>ncols || r<-1 || r>nrows)
+		c=(int) floor((xy[2*i]-x1)/cs);
+		r=(int) floor((y2-xy[2*i+1])/cs);
+		/*should ensure that c-k can never be larger than ncols-1, etc*/
+		if (c<-k || c>=ncols+k || r<-k || r>=nrows+k)
 			continue;
 		/*perhaps do something if we fall suficciently outside region*/
 		nfound=0;
-		for(j=-1;j<2;j++){
-			r1=r+j;
-			if (r1<0 || r1>=nrows){ /*empty slice*/
-				slices[2*j+2]=0;
-				slices[2*j+3]=0;
+		c1=MAX((c-k),0);
+		c2=MIN((c+k),(ncols-1));
+		for(j=0;j<nslices;j++){
+			r1=r-k+j;
+			if (r1<0 || r1>=nrows || c1>c2){ /*empty slice*/
+				slices[2*j]=0;
+				slices[2*j+1]=0;
 				continue;
 			}
-			
-			c1=MAX((c-1),0);
-			c2=MIN((c+1),(ncols-1));
 			ind1=r1*ncols+c1;
 			ind2=r1*ncols+c2;
-			slices[2*j+2]=spatial_index[2*ind1]; /*start of left cell*/
-			slices[2*j+3]=spatial_index[2*ind2+1]; /*end of right included cell*/
-			nfound+=slices[2*j+3]-slices[2*j+2];
+			slices[2*j]=spatial_index[2*ind1]; /*start of left cell*/
+			slices[2*j+1]=spatial_index[2*ind2+1]; /*end of right included cell*/
+			nfound+=slices[2*j+1]-slices[2*j];
 		}
 		if (nfound>0){
 			if (z)
 				zz=z[i];
 			else 
 				zz=-1;
-			vals_out[i]=filter_func(xy+2*i,zz,slices,pc_xy,pc_z,frad2,nd_val,opt_params); /*the filter func should know how many params there are - or we can terminate list by something...*/
+			vals_out[i]=filter_func(xy+2*i,zz,slices,nslices,pc_xy,pc_z,frad2,nd_val,opt_params); /*the filter func should know how many params there are - or we can terminate list by something...*/
 		}
 		/*DEBUG*/
 		/*if (nfound==0 || vals_out[i]==nd_val){
@@ -350,12 +353,13 @@ static void apply_filter(double *xy, double *z, double *pc_xy, double *pc_z, dou
 		
 		
 	} /*end rows*/
+	free(slices);
 }
 
-static double min_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
+static double min_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
 	int i,i1,i2,j, n=0;
 	double m=HUGE_VAL,d;
-	for(i=0; i<3; i++){
+	for(i=0; i<nslices; i++){
 		i1=indices[2*i];
 		i2=indices[2*i+1];
 		for(j=i1; j<i2; j++){ /*possibly empty slice*/
@@ -380,7 +384,7 @@ static double min_filter(double *xy, double z, int *indices, double *pc_xy, doub
 /* A spike is a point, which is a local extrama, and where there are steep edges in all four quadrants. An edge is steep if its slope is above a certain limit and its delta z likewise*/
 /* all edges must be steep unless it is smaller than filter_radius*0.2 - so filter_radius is significant here!*/
 /* paarams are: tanv2 and  delta-z*/
-static double spike_filter(double *xy, double z,  int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *params){
+static double spike_filter(double *xy, double z,  int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *params){
 	int i,i1,i2,j,n_steep=0, n_q1=0, n_q2=0, n_q3=0, n_q4=0, n_all_plus=0, n_all_minus=0, n_used=0, could_be_spike=1;
 	double d,dz,dx,dy,mean_dz=0, abs_dz,x=xy[0],y=xy[1],d_lim,slope,tanv2,zlim,*dparams;
 	dparams=(double*) params;
@@ -388,7 +392,7 @@ static double spike_filter(double *xy, double z,  int *indices, double *pc_xy, d
 	tanv2=dparams[1];
 	zlim=dparams[2];
 	/*we must ensure that there are points further away than the limit - and that they spread out nicely*/
-	for(i=0; i<3 && could_be_spike; i++){
+	for(i=0; i<nslices && could_be_spike; i++){
 		i1=indices[2*i];
 		i2=indices[2*i+1];
 		for(j=i1; j<i2; j++){
@@ -432,10 +436,10 @@ static double spike_filter(double *xy, double z,  int *indices, double *pc_xy, d
 }
 
 
-static double mean_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
+static double mean_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
 	int i,i1,i2,j,n=0;
 	double m=0,d;
-	for(i=0; i<3; i++){
+	for(i=0; i<nslices; i++){
 		i1=indices[2*i];
 		i2=indices[2*i+1];
 		for(j=i1;j<i2;j++){
@@ -454,10 +458,10 @@ static double mean_filter(double *xy, double z, int *indices, double *pc_xy, dou
 	return nd_val;
 }
 
-static double var_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
+static double var_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
 	int i,i1,i2,j,n=0;
 	double m=0,m2=0,d;
-	for(i=0; i<3; i++){
+	for(i=0; i<nslices; i++){
 		i1=indices[2*i];
 		i2=indices[2*i+1];
 		for(j=i1;j<i2;j++){
@@ -476,10 +480,10 @@ static double var_filter(double *xy, double z, int *indices, double *pc_xy, doub
 	return nd_val;
 }
 
-static double density_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
+static double density_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
 	int i,i1,i2,j,n=0;
 	double d;
-	for(i=0; i<3; i++){
+	for(i=0; i<nslices; i++){
 		i1=indices[2*i];
 		i2=indices[2*i+1];
 		for(j=i1;j<i2;j++){
@@ -494,10 +498,10 @@ static double density_filter(double *xy, double z, int *indices, double *pc_xy,
 	return ((double) n)/(M_PI*frad2);
 }
 
-static double idw_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
+static double idw_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
 	int i,i1,i2,j,n=0;
 	double m=0,d,w=0,ww;
-	for(i=0; i<3; i++){
+	for(i=0; i<nslices; i++){
 		i1=indices[2*i];
 		i2=indices[2*i+1];
 		for(j=i1;j<i2;j++){
@@ -517,10 +521,10 @@ static double idw_filter(double *xy, double z, int *indices, double *pc_xy, doub
 	return nd_val;
 }
 
-static double distance_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
+static double distance_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
 	int i,i1,i2,j,n=0;
 	double dmin=HUGE_VAL,d;
-	for(i=0; i<3; i++){
+	for(i=0; i<nslices; i++){
 		i1=indices[2*i];
 		i2=indices[2*i+1];
 		for(j=i1;j<i2;j++){
@@ -533,23 +537,53 @@ static double distance_filter(double *xy, double z, int *indices, double *pc_xy,
 	return (dmin<HUGE_VAL)?sqrt(dmin):nd_val;
 }
 
-static int compar (const void* a, const void* b){
-	if ( *(double*)a <  *(double*)b ) return -1;
-	if ( *(double*)a == *(double*)b ) return 0;
-	if ( *(double*)a >  *(double*)b ) return 1;
-};
-
-
-
-/*todo - to fractile_filter and implement faster sorting...*/
-static double median_filter(double *xy, double z, int *indices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *nothing){
-	int i,i1,i2,j,n=0,n_all=0;
-	double *zs, m=nd_val,d;
-	for(i=0; i<3; i++)
+/* Wirth's selection algorithm - partially reorders a so that a[k] is the k'th smallest value, a[0..k-1]<=a[k]<=a[k+1..n-1]. */
+static double select_kth(double *a, int n, int k){
+	int i,j,l=0,r=n-1;
+	double pivot,tmp;
+	while (l<r){
+		pivot=a[k];
+		i=l;
+		j=r;
+		do{
+			while (a[i]<pivot) i++;
+			while (pivot<a[j]) j--;
+			if (i<=j){
+				tmp=a[i];
+				a[i]=a[j];
+				a[j]=tmp;
+				i++;
+				j--;
+			}
+		} while (i<=j);
+		if (j<k) l=i;
+		if (k<i) r=j;
+	}
+	return a[k];
+}
+
+/* params for percentile_filter - a buffer for the z values is kept here and reused for all points */
+typedef struct{
+	double q;
+	double *buf;
+	int size;
+} PERCENTILE_PARAMS;
+
+/* q'th percentile (0-100) of z values within the filter radius with linear interpolation between closest values (like numpy). Median is q=50. */
+static double percentile_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
+	int i,i1,i2,j,n=0,n_all=0,lo;
+	double *zs, m=nd_val,d,pos,frac,hi;
+	PERCENTILE_PARAMS *params=(PERCENTILE_PARAMS*) opt_params;
+	for(i=0; i<nslices; i++)
 		n_all+=indices[2*i+1]-indices[2*i];
-	zs=malloc(sizeof(double)*n_all);
+	if (n_all>params->size){
+		free(params->buf);
+		params->size=MAX(n_all,2*params->size);
+		params->buf=malloc(sizeof(double)*params->size);
+	}
+	zs=params->buf;
 	/*rather core dump than return nd_val?*/
-	for(i=0; i<3; i++){
+	for(i=0; i<nslices; i++){
 		i1=indices[2*i];
 		i2=indices[2*i+1];
 		for(j=i1;j<i2;j++){
@@ -562,16 +596,18 @@ static double median_filter(double *xy, double z, int *indices, double *pc_xy, d
 		}
 	}
 	if (n>0){
-		if (n>1)
-			qsort(zs,n,sizeof(double),compar);
-		i=n/2;
-		if (n%2==0)
-			m=(zs[i-1]+zs[i])*0.5;
-		else
-			m=zs[i];
-		
+		pos=params->q*0.01*(n-1);
+		lo=(int) floor(pos);
+		frac=pos-lo;
+		m=select_kth(zs,n,lo);
+		if (frac>0 && lo+1<n){
+			/*the next value is the smallest of the values above*/
+			hi=zs[lo+1];
+			for(j=lo+2; j<n; j++)
+				hi=MIN(hi,zs[j]);
+			m=m*(1-frac)+hi*frac;
+		}
 	}
-	free(zs);
 	return m;
 }
 	
@@ -604,8 +640,87 @@ void pc_spike_filter(double *xy, double *z, double *pc_xy, double *pc_z, double
 	apply_filter(xy,z,pc_xy,pc_z, z_out, spatial_index, header, npoints, spike_filter, filter_rad, 0, params);
 	
 }
+/* params for multi_filter - the filter writes a row of MULTI_NSTATS values pr. point to out (the row is found from the position of the point in xy) */
+/* stats is a bitmask of the statistics needed - (1<<index of statistic in a row), only the count is always calculated */
+#define MULTI_NSTATS 6
+#define MULTI_Z_STATS 15
+#define MULTI_DISTANCE 32
+typedef struct{
+	double *xy;
+	double *out;
+	double nd_dist;
+	int stats;
+} MULTI_PARAMS;
+
+/* min, max, mean, var and count of z values within the filter radius and distance to the nearest point, like the single filters, in one scan */
+static double multi_filter(double *xy, double z, int *indices, int nslices, double *pc_xy, double *pc_z, double frad2, double nd_val, void *opt_params){
+	int i,i1,i2,j,n=0,z_stats,distance;
+	double zmin=HUGE_VAL,zmax=-HUGE_VAL,m=0,m2=0,d,dmin=HUGE_VAL,*out;
+	MULTI_PARAMS *params=(MULTI_PARAMS*) opt_params;
+	out=params->out+MULTI_NSTATS*((xy-params->xy)/2);
+	z_stats=params->stats & MULTI_Z_STATS;
+	distance=params->stats & MULTI_DISTANCE;
+	for(i=0; i<nslices; i++){
+		i1=indices[2*i];
+		i2=indices[2*i+1];
+		for(j=i1;j<i2;j++){
+			d=SQUARE((pc_xy[2*j]-xy[0]))+SQUARE((pc_xy[2*j+1]-xy[1]));
+			if (distance && d<dmin)
+				dmin=d;
+			if (d<=frad2){
+				n+=1;
+				if (z_stats){
+					zmin=MIN(zmin,pc_z[j]);
+					zmax=MAX(zmax,pc_z[j]);
+					m+=pc_z[j];
+					m2+=SQUARE(pc_z[j]);
+				}
+			}
+		}
+	}
+	out[0]=(n>0)? zmin : nd_val;
+	out[1]=(n>0)? zmax : nd_val;
+	out[2]=(n>0)? m/n : nd_val;
+	out[3]=(n>1)? (m2/n-SQUARE((m/n))) : nd_val;
+	out[4]=n;
+	out[5]=(dmin<HUGE_VAL)? sqrt(dmin) : params->nd_dist;
+	return n;
+}
+
+/* out must have room for MULTI_NSTATS values pr. point: min, max, mean, var, count and distance to nearest point. Statistics not in stats are not calculated. */
+void pc_multi_filter(double *xy, double *pc_xy, double *pc_z, double *out, double filter_rad, double nd_val, double nd_dist, int stats, int *spatial_index, double *header, int npoints){
+	int i;
+	double *counts;
+	MULTI_PARAMS params;
+	params.xy=xy;
+	params.out=out;
+	params.nd_dist=nd_dist;
+	params.stats=stats;
+	/*rows of points with no points around are not touched by the filter*/
+	for(i=0; i<npoints; i++){
+		out[MULTI_NSTATS*i]=nd_val;
+		out[MULTI_NSTATS*i+1]=nd_val;
+		out[MULTI_NSTATS*i+2]=nd_val;
+		out[MULTI_NSTATS*i+3]=nd_val;
+		out[MULTI_NSTATS*i+4]=0;
+		out[MULTI_NSTATS*i+5]=nd_dist;
+	}
+	counts=malloc(sizeof(double)*npoints);
+	apply_filter(xy,NULL,pc_xy,pc_z, counts, spatial_index, header, npoints, multi_filter, filter_rad, nd_val, &params);
+	free(counts);
+}
+
 void pc_median_filter(double *xy,double *pc_xy, double *pc_z, double *z_out, double filter_rad, double nd_val, int *spatial_index, double *header, int npoints){
-	apply_filter(xy,NULL,pc_xy,pc_z, z_out, spatial_index, header, npoints, median_filter, filter_rad, nd_val, NULL); /*nd val meaningless - should always be at least one point in sr*/
+	pc_percentile_filter(xy, pc_xy, pc_z, z_out, filter_rad, 50, nd_val, spatial_index, header, npoints);
+}
+
+void pc_percentile_filter(double *xy,double *pc_xy, double *pc_z, double *z_out, double filter_rad, double q, double nd_val, int *spatial_index, double *header, int npoints){
+	PERCENTILE_PARAMS params;
+	params.q=q;
+	params.buf=NULL;
+	params.size=0;
+	apply_filter(xy,NULL,pc_xy,pc_z, z_out, spatial_index, header, npoints, percentile_filter, filter_rad, nd_val, &params);
+	free(params.buf);
 }
 
 void pc_idw_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, double filter_rad, double nd_val, int *spatial_index, double *header, int npoints){
@@ -616,6 +731,87 @@ void pc_distance_filter(double *xy, double *pc_xy, double *pc_z, double *z_out,
 	apply_filter(xy,NULL,pc_xy,pc_z, z_out, spatial_index, header, npoints, distance_filter, filter_rad, nd_val , NULL); /*nd val meaningless - should always be at least one point in sr*/
 }
 
+/* insert point j at squared distance d in the sorted lists of the k nearest points found so far (n of them) */
+static int knn_insert(int *knn_idx, double *knn_d, int n, int k, int j, double d){
+	int m;
+	if (n==k && d>=knn_d[k-1])
+		return n;
+	m=(n<k)? n : k-1;
+	for(; m>0 && knn_d[m-1]>d; m--){
+		knn_d[m]=knn_d[m-1];
+		knn_idx[m]=knn_idx[m-1];
+	}
+	knn_d[m]=d;
+	knn_idx[m]=j;
+	return (n<k)? n+1 : n;
+}
+
+/* k nearest neighbours of each point in xy. Rings of cells around the cell of the point are scanned until the k'th nearest point found is closer than any cell not scanned yet. */
+/* Output is indices (-1 if less than k points) and distances (HUGE_VAL if less than k points) sorted by distance - k of each pr. point. */
+void pc_knn(double *xy, double *pc_xy, int k, int *idx_out, double *dist_out, int *spatial_index, double *header, int npoints){
+	int i,j,l,n,r,c,r1,c1,c2,rad,ncols,nrows,n_all,*knn_idx;
+	double x1,y2,cs,d,d_out,x,y,*knn_d;
+	ncols=(int) header[0];
+	nrows=(int) header[1];
+	x1=header[2];
+	y2=header[3];
+	cs=header[4];
+	n_all=spatial_index[2*(ncols*nrows-1)+1]; /*end of last cell - all points*/
+	for(i=0; i<npoints; i++){
+		knn_idx=idx_out+i*k;
+		knn_d=dist_out+i*k;
+		x=xy[2*i];
+		y=xy[2*i+1];
+		c=(int) floor((x-x1)/cs);
+		r=(int) floor((y2-y)/cs);
+		n=0;
+		/*start with the first ring which reaches the grid*/
+		rad=MAX((MAX(-c,(c-(ncols-1)))),(MAX(-r,(r-(nrows-1)))));
+		for(rad=MAX(rad,0); ; rad++){
+			/*scan the ring of cells at distance rad (in cells) - the full rows at the top and bottom, and the end cells of the rows in between*/
+			for(r1=MAX((r-rad),0); r1<=MIN((r+rad),(nrows-1)); r1++){
+				for(l=0; l<2; l++){
+					if (r1==r-rad || r1==r+rad){
+						if (l>0)
+							break;
+						c1=MAX((c-rad),0);
+						c2=MIN((c+rad),(ncols-1));
+					}
+					else{
+						c1=(l==0)? c-rad : c+rad;
+						if (c1<0 || c1>=ncols)
+							continue;
+						c2=c1;
+					}
+					if (c1>c2)
+						continue;
+					for(j=spatial_index[2*(r1*ncols+c1)]; j<spatial_index[2*(r1*ncols+c2)+1]; j++){
+						d=SQUARE((pc_xy[2*j]-x))+SQUARE((pc_xy[2*j+1]-y));
+						n=knn_insert(knn_idx,knn_d,n,k,j,d);
+					}
+				}
+			}
+			/*all points or cells scanned?*/
+			if (n==n_all || (c-rad<=0 && c+rad>=ncols-1 && r-rad<=0 && r+rad>=nrows-1))
+				break;
+			/*distance to the cells outside the rings scanned*/
+			d_out=MIN((x-(x1+(c-rad)*cs)),((x1+(c+rad+1)*cs)-x));
+			d_out=MIN(d_out,(((y2-(r-rad)*cs))-y));
+			d_out=MIN(d_out,(y-(y2-(r+rad+1)*cs)));
+			if (n==k && knn_d[k-1]<=SQUARE(d_out))
+				break;
+		}
+		for(j=0; j<k; j++){
+			if (j<n)
+				knn_d[j]=sqrt(knn_d[j]);
+			else{
+				knn_idx[j]=-1;
+				knn_d[j]=HUGE_VAL;
+			}
+		}
+	}
+}
+
 /* A triangle based 'filter' - on  input zout should be a copy of z */
 
 void tri_filter_low(double *z, double *zout, int *tri, double cut_off, int ntri){
@@ -20,14 +20,17 @@ void get_triangle_geometry(double *xy, double *z, int *triangles, float *out , i
 void fill_it_up(unsigned char *out, unsigned int *hmap, int rows, int cols, int stacks);
 void find_floating_voxels(int *lab,  int *out, int gcomp, int rows, int cols, int stacks);
 int fill_spatial_index(int *sorted_flat_indices, int *index, int npoints, int max_index);
-typedef double(*FILTER_FUNC)(double *, double , int*, double* , double* , double, double, void*);
+typedef double(*FILTER_FUNC)(double *, double , int*, int, double* , double* , double, double, void*);
 void pc_min_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, double filter_rad, double nd_val, int *spatial_index, double *header, int npoints);
 void pc_spike_filter(double *xy, double *z, double *pc_xy, double *pc_z, double *z_out, double filter_rad, double tanv2, double zlim, int *spatial_index, double *header, int npoints);
 void pc_mean_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, double filter_rad, double nd_val,int *spatial_index, double *header, int npoints);
-void pc_median_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, double filter_rad, double nd_val, int *spatial_index, double *header, int npoints);
+void pc_median_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, double filter_rad, double nd_val, int *spatial_index, double *header, int npoints);
+void pc_multi_filter(double *xy, double *pc_xy, double *pc_z, double *out, double filter_rad, double nd_val, double nd_dist, int stats, int *spatial_index, double *header, int npoints);
+void pc_percentile_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, double filter_rad, double q, double nd_val, int *spatial_index, double *header, int npoints);
 void pc_idw_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, double filter_rad, double nd_val, int *spatial_index, double *header, int npoints);
 void pc_var_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, double filter_rad, double nd_val, int *spatial_index, double *header, int npoints);
 void pc_density_filter(double *xy, double *pc_xy, double *pc_z, double *z_out, double filter_rad, int *spatial_index, double *header, int npoints);
 void pc_density_filter(double *xy,double *pc_xy, double *pc_z, double *z_out, double filter_rad, int *spatial_index, double *header, int npoints);
+void pc_knn(double *xy, double *pc_xy, int k, int *idx_out, double *dist_out, int *spatial_index, double *header, int npoints);
 void moving_bins(double *z, int *nout, double rad, int n);
 void binary_fill_gaps(char *M, char *out, int nrows, int ncols);
\ No newline at end of file
@@ -444,6 +444,73 @@ void free_index(spatial_index *ind){
 	free(ind);
 }
 
+/* Flatten a spatial index, e.g. for storing it:
+   header: ncols, npoints, ntri, ncells, extent (4), cs.
+   offsets: (ncells+1) start of the triangles of each cell in data.
+   data: the triangles of the cells.
+   offsets and data can be NULL to only get the header and the size of data (which is returned).
+*/
+int dump_index(spatial_index *ind, double *header, int *offsets, int *data){
+	int i,n=0;
+	header[0]=ind->ncols;
+	header[1]=ind->npoints;
+	header[2]=ind->ntri;
+	header[3]=ind->ncells;
+	memcpy(header+4,ind->extent,sizeof(double)*4);
+	header[8]=ind->cs;
+	for (i=0; i<ind->ncells; i++){
+		if (offsets!=NULL)
+			offsets[i]=n;
+		if (ind->index_arr[i]!=NULL){
+			if (data!=NULL)
+				memcpy(data+n,ind->index_arr[i]+2,sizeof(int)*ind->index_arr[i][1]);
+			n+=ind->index_arr[i][1];
+		}
+	}
+	if (offsets!=NULL)
+		offsets[ind->ncells]=n;
+	return n;
+}
+
+/* Rebuild a spatial index from the output of dump_index */
+spatial_index *load_index(double *header, int *offsets, int *data){
+	int i,n,ncells=(int) header[3];
+	int **index_arr;
+	spatial_index *ind;
+	index_arr=calloc(ncells,sizeof(int*));
+	if (!index_arr)
+		return NULL;
+	for (i=0; i<ncells; i++){
+		n=offsets[i+1]-offsets[i];
+		if (n>0){
+			index_arr[i]=malloc(sizeof(int)*(n+2));
+			if (!index_arr[i])
+				goto LOAD_ERR;
+			index_arr[i][0]=n+2;
+			index_arr[i][1]=n;
+			memcpy(index_arr[i]+2,data+offsets[i],sizeof(int)*n);
+		}
+	}
+	ind=malloc(sizeof(struct index));
+	if (!ind)
+		goto LOAD_ERR;
+	ind->ncols=(int) header[0];
+	ind->npoints=(int) header[1];
+	ind->ntri=(int) header[2];
+	ind->ncells=ncells;
+	memcpy(ind->extent,header+4,sizeof(double)*4);
+	ind->cs=header[8];
+	ind->index_arr=index_arr;
+	return ind;
+	LOAD_ERR:
+		for (i=0; i<ncells; i++){
+			if (index_arr[i]!=NULL)
+				free(index_arr[i]);
+		}
+		free(index_arr);
+		return NULL;
+}
+
 void optimize_index(spatial_index *ind){
 	int i;
 	int **arr=ind->index_arr;
@@ -34,4 +34,6 @@ void find_triangle(double *pts, int *out, double *base_pts,int *tri, spatial_ind
 void interpolate(double *pts, double *z, double *out, double nd_val, double *eq, int *tri, spatial_index *ind, int np);*/
 void interpolate(double *pts, double *base_pts, double *base_z, double *out, double nd_val, int *tri, spatial_index *ind, char *mask, int np);
 void optimize_index(spatial_index *ind);
+int dump_index(spatial_index *ind, double *header, int *offsets, int *data);
+spatial_index *load_index(double *header, int *offsets, int *data);
 void free_index(spatial_index *ind);
\ No newline at end of file
@@ -0,0 +1,330 @@
+'''
+Benchmarks of the thatsDEM hot paths on synthetic pointclouds.
+
+Synthetic tiles (smooth terrain with box shaped buildings) are generated offline with a
+given density (points pr. m2) and tile size. Each benchmark is run a few times and the
+best throughput in points/s and the peak memory usage (increase of resident memory while
+running) are printed and optionally appended to a json history file, so that runs before
+and after a change can be compared.
+
+Run from the root of the repository, e.g.:
+    python -m tests.benchmark -density 1 10 50 -history benchmarks.json
+    python -m tests.benchmark -only triangulate make_grid -tile_size 1000
+'''
+from __future__ import print_function
+
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+
+import numpy as np
+import laspy
+
+from qc.thatsDEM import pointcloud
+from qc.thatsDEM import triangle
+from qc.thatsDEM import grid
+from qc.thatsDEM import array_geometry
+from qc.utils.profiling import get_rss
+
+# lower left corner of synthetic tiles
+X0 = 600000.0
+Y0 = 6200000.0
+# buildings are placed on a regular grid with this spacing (m)
+BUILDING_SPACING = 50.0
+# number of building polygons used in the points_in_polygon benchmark
+N_POLYGONS = 20
+FILTER_RAD = 1.0
+
+# name -> function(case), returning the number of points handled.
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    '''Decorator registering a benchmark.'''
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def synthetic_tile(density, tile_size, seed=0):
+    '''
+    Generate a synthetic pointcloud with smooth terrain (class 2) and box shaped
+    buildings (class 6) on a regular grid.
+    Args:
+        density: Points pr. m2.
+        tile_size: Side length of the (square) tile in m.
+        seed: Seed for the random generator.
+    Returns:
+        pointcloud.Pointcloud, list of building polygons (each a list of rings as
+        returned by array_geometry.ogrpoly2array).
+    '''
+    rng = np.random.RandomState(seed)
+    n = int(density * tile_size ** 2)
+    xy = rng.uniform(0, tile_size, size=(n, 2))
+    x, y = xy[:, 0], xy[:, 1]
+    z = 40 + 5 * np.sin(x / 97.0) * np.cos(y / 61.0) + 0.01 * x + rng.normal(0, 0.03, n)
+    c = np.full(n, 2, dtype=np.int32)
+    # buildings of 12 x 18 m, 4-12 m high, in the middle of each cell of the building grid
+    n_b = max(int(tile_size / BUILDING_SPACING), 1)
+    heights = rng.uniform(4, 12, size=(n_b, n_b))
+    i = np.minimum((x / BUILDING_SPACING).astype(np.int64), n_b - 1)
+    j = np.minimum((y / BUILDING_SPACING).astype(np.int64), n_b - 1)
+    cx = (i + 0.5) * BUILDING_SPACING
+    cy = (j + 0.5) * BUILDING_SPACING
+    in_building = (np.fabs(x - cx) < 6) & (np.fabs(y - cy) < 9)
+    z[in_building] += heights[j[in_building], i[in_building]]
+    c[in_building] = 6
+    pid = (x > tile_size / 2).astype(np.int32) + 1
+    rn = np.ones(n, dtype=np.int32)
+    polygons = []
+    for j_b in range(n_b):
+        for i_b in range(n_b):
+            x1 = X0 + (i_b + 0.5) * BUILDING_SPACING - 6
+            y1 = Y0 + (j_b + 0.5) * BUILDING_SPACING - 9
+            ring = np.array(((x1, y1), (x1 + 12, y1), (x1 + 12, y1 + 18), (x1, y1 + 18), (x1, y1)))
+            polygons.append([ring])
+    xy += (X0, Y0)
+    return pointcloud.Pointcloud(xy, z, c=c, pid=pid, rn=rn), polygons
+
+
+def write_las(pc, path):
+    '''Write a pointcloud to a las/laz file with laspy.'''
+    header = laspy.LasHeader(point_format=6, version="1.4")
+    header.scales = np.array((0.01, 0.01, 0.01))
+    header.offsets = np.array((X0, Y0, 0.0))
+    las = laspy.LasData(header)
+    las.x = pc.xy[:, 0]
+    las.y = pc.xy[:, 1]
+    las.z = pc.z
+    las.classification = pc.c
+    las.point_source_id = pc.pid
+    las.return_number = pc.rn
+    las.write(path)
+
+
+class Case(object):
+    '''
+    Input data for the benchmarks at a given density. Derived data (files, sorted
+    pointclouds, ...) are created when first needed, outside of the timing.
+    '''
+
+    def __init__(self, density, tile_size, workdir, seed=0):
+        self.density = density
+        self.tile_size = tile_size
+        self.workdir = workdir
+        self.pc, self.polygons = synthetic_tile(density, tile_size, seed)
+        self._las_path = None
+        self._sorted = None
+
+    def prepare(self, name):
+        if name.startswith("fromLAS"):
+            self.las_path
+        elif name.endswith("filter"):
+            self.sorted_pc
+
+    @property
+    def las_path(self):
+        if self._las_path is None:
+            self._las_path = os.path.join(self.workdir, "synthetic_{0:g}.laz".format(self.density))
+            write_las(self.pc, self._las_path)
+        return self._las_path
+
+    @property
+    def sorted_pc(self):
+        if self._sorted is None:
+            self._sorted = pointcloud.Pointcloud(self.pc.xy.copy(), self.pc.z.copy(), c=self.pc.c)
+            self._sorted.sort_spatially(FILTER_RAD)
+        return self._sorted
+
+
+@benchmark("fromLAS")
+def bench_from_las(case):
+    return pointcloud.fromLAS(case.las_path).size
+
+
+@benchmark("fromLAS_filtered")
+def bench_from_las_filtered(case):
+    half = case.tile_size / 2.0
+    pointcloud.fromLAS(case.las_path, cls=[6], xy_box=(X0, Y0, X0 + half, Y0 + half))
+    return case.pc.size
+
+
+@benchmark("triangulate")
+def bench_triangulate(case):
+    triangle.Triangulation(case.pc.xy)
+    return case.pc.size
+
+
+@benchmark("sort_spatially")
+def bench_sort_spatially(case):
+    pc = pointcloud.Pointcloud(case.pc.xy, case.pc.z)
+    pc.sort_spatially(FILTER_RAD)
+    return pc.size
+
+
+@benchmark("make_grid")
+def bench_make_grid(case):
+    cs = 1.0
+    n = int(case.tile_size / cs)
+    georef = (X0, cs, 0, Y0 + case.tile_size, 0, -cs)
+    grid.make_grid(case.pc.xy, case.pc.z, n, n, georef, method="mean")
+    return case.pc.size
+
+
+@benchmark("min_filter")
+def bench_min_filter(case):
+    return case.sorted_pc.min_filter(FILTER_RAD).size
+
+
+@benchmark("median_filter")
+def bench_median_filter(case):
+    return case.sorted_pc.median_filter(FILTER_RAD).size
+
+
+@benchmark("spike_filter")
+def bench_spike_filter(case):
+    return case.sorted_pc.spike_filter(FILTER_RAD, 1.0, 0.25).size
+
+
+@benchmark("points_in_polygon")
+def bench_points_in_polygon(case):
+    for rings in case.polygons[:N_POLYGONS]:
+        array_geometry.points_in_polygon(case.pc.xy, rings)
+    return case.pc.size * min(len(case.polygons), N_POLYGONS)
+
+
+class MemorySampler(threading.Thread):
+    '''Sample resident memory of this process in a background thread and keep the peak.'''
+
+    def __init__(self, interval=0.002):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.peak = get_rss() or 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, get_rss() or 0)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, get_rss() or 0)
+        return self.peak
+
+
+def run_benchmark(name, case, repeat=3):
+    '''
+    Run a benchmark repeat times.
+    Returns a dict with the best time, the throughput in points/s and
+    the peak increase of resident memory in MB.
+    '''
+    func = BENCHMARKS[name]
+    case.prepare(name)
+    best = None
+    peak = 0
+    for i in range(repeat):
+        baseline = get_rss() or 0
+        sampler = MemorySampler()
+        sampler.start()
+        t1 = time.time()
+        points = func(case)
+        seconds = time.time() - t1
+        peak = max(peak, sampler.stop() - baseline)
+        if best is None or seconds < best:
+            best = seconds
+    return OrderedDict((("name", name),
+                        ("density", case.density),
+                        ("points", int(points)),
+                        ("seconds", best),
+                        ("points_per_s", points / max(best, 1e-9)),
+                        ("peak_mb", peak / 1024.0 ** 2)))
+
+
+def get_commit():
+    '''Return the current git commit of the repository, if available.'''
+    try:
+        out = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                      cwd=os.path.dirname(os.path.abspath(__file__)),
+                                      stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode("ascii").strip()
+
+
+def load_history(path):
+    if path is None or not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def previous_result(history, name, density):
+    '''Return the most recent result of a benchmark at a density in the history.'''
+    for run in reversed(history):
+        for result in run["results"]:
+            if result["name"] == name and result["density"] == density:
+                return result
+    return None
+
+
+parser = argparse.ArgumentParser(description="Benchmark thatsDEM hot paths on synthetic pointclouds.")
+parser.add_argument("-density", type=float, nargs="+", default=[1.0, 10.0],
+                    help="Point densities (points pr. m2) to run at (default 1 10).")
+parser.add_argument("-tile_size", type=float, default=250.0,
+                    help="Side length of synthetic tiles in m (default 250, real tiles are 1000).")
+parser.add_argument("-repeat", type=int, default=3, help="Number of runs of each benchmark (default 3).")
+parser.add_argument("-only", nargs="+", choices=list(BENCHMARKS.keys()), help="Only run these benchmarks.")
+parser.add_argument("-history", help="Append results to this json file and compare with the last run.")
+parser.add_argument("-seed", type=int, default=0, help="Seed for generating synthetic tiles.")
+
+
+def main(args):
+    pargs = parser.parse_args(args[1:])
+    names = pargs.only or list(BENCHMARKS.keys())
+    history = load_history(pargs.history)
+    run = OrderedDict((("time", time.strftime("%Y-%m-%dT%H:%M:%S")),
+                       ("commit", get_commit()),
+                       ("python", platform.python_version()),
+                       ("numpy", np.__version__),
+                       ("machine", platform.node()),
+                       ("tile_size", pargs.tile_size),
+                       ("results", [])))
+    workdir = tempfile.mkdtemp(prefix="dhmqc_bench_")
+    try:
+        for density in pargs.density:
+            case = Case(density, pargs.tile_size, workdir, pargs.seed)
+            print("Density {0:g} pts/m2, {1:d} points:".format(density, case.pc.size))
+            for name in names:
+                result = run_benchmark(name, case, pargs.repeat)
+                run["results"].append(result)
+                line = "    {0:<20s} {1:>14,.0f} pts/s {2:>9.3f} s {3:>9.1f} MB".format(
+                    name, result["points_per_s"], result["seconds"], result["peak_mb"])
+                previous = previous_result(history, name, density)
+                if previous is not None:
+                    line += "  ({0:+.1f}% pts/s)".format(
+                        100.0 * (result["points_per_s"] / previous["points_per_s"] - 1))
+                print(line)
+            del case
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if pargs.history is not None:
+        history.append(run)
+        with open(pargs.history, "w") as f:
+            json.dump(history, f, indent=1)
+        print("Results appended to " + pargs.history)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
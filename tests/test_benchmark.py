@@ -0,0 +1,13 @@
+'''
+Check that the benchmarks in tests/benchmark.py run.
+'''
+from . import benchmark
+
+
+def test_benchmarks(tmpdir):
+    case = benchmark.Case(0.5, 100.0, str(tmpdir))
+    assert case.pc.size == 5000
+    assert (case.pc.c == 6).any() and (case.pc.c == 2).any()
+    for name in benchmark.BENCHMARKS:
+        result = benchmark.run_benchmark(name, case, repeat=1)
+        assert result["points"] > 0 and result["points_per_s"] > 0
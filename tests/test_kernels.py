@@ -10,6 +10,10 @@ them. For functions without return codes we rely on exceptions being raised
 when errors occur.
 '''
 
+import os
+import json
+import sqlite3
+
 from . import conftest
 # from .conftest import LAS_DEMO, WATER_DEMO, ROAD_DEMO, BUILDING_DEMO, OUTDIR
 
@@ -31,6 +35,9 @@ import qc.xy_accuracy_buildings
 import qc.xy_precision_buildings
 import qc.wobbly_water
 import qc.dvr90_wrapper
+import qc.dem_gen
+from qc import dhmqc_constants as constants
+from qc.thatsDEM import grid
 
 def test_density_check(output_ds):
     rc = qc.density_check.main(('density_check', conftest.LAS_DEMO, conftest.WATER_DEMO))
@@ -86,3 +93,23 @@ def test_dvr90_wrapper(outdir, output_ds):
     rc = qc.dvr90_wrapper.main(('dvr90_wrapper', conftest.LAS_DEMO, str(outdir)))
     assert rc == 0
 
+def test_dem_gen_water_threads(outdir):
+    # a tile db with the demo tile as the only tile
+    tile_db = str(outdir / 'tiles.sqlite')
+    con = sqlite3.connect(tile_db)
+    con.execute("CREATE TABLE coverage(tile_name TEXT, row INTEGER, col INTEGER, path TEXT)")
+    con.execute("INSERT INTO coverage VALUES(?, 0, 0, ?)",
+                (constants.get_tilename(conftest.LAS_DEMO), conftest.LAS_DEMO))
+    con.commit()
+    con.close()
+    layer_def = json.dumps({"LAKE_LAYER": [conftest.WATER_DEMO, None]})
+    dtms = []
+    for threads in ('1', '2'):
+        dem_dir = str(outdir / ('dems_' + threads))
+        rc = qc.dem_gen.main(('dem_gen', conftest.LAS_DEMO, tile_db, dem_dir, '-dtm', '-cell_size', '1',
+                              '-layer_def', layer_def, '-threads', threads))
+        assert rc == 0
+        dtm_name = 'dtm_' + constants.get_tilename(conftest.LAS_DEMO) + '.tif'
+        dtms.append(grid.fromGDAL(os.path.join(dem_dir, dtm_name)).grid)
+    assert (dtms[0] == dtms[1]).all()
+
@@ -0,0 +1,188 @@
+'''
+Test process control in qc_wrap.
+'''
+import os
+import time
+import sqlite3
+import multiprocessing
+from collections import Counter
+
+import pytest
+
+import qc_wrap
+from proc_setup import setup_job, QC_WRAP_NAMES, QC_WRAP_DEFAULTS
+from qc.utils.profiling import get_rss
+
+TESTNAME = "dvr90_wrapper"
+WORKER_ARGS = {"testname": TESTNAME, "tests": [], "runid": None, "use_local": False, "schema": None}
+# Memory allocated by the 'alloc' tiles, see fake_run_tests
+ALLOC_BYTES = 400 * 2**20
+
+# The workers must inherit the stubbed run_tests from the test process
+needs_fork = pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                                reason="Requires the fork start method")
+
+
+def create_process_db(path, statuses, names=None):
+    '''Create a process db with a tile pr. (status, retries) pair.'''
+    con = sqlite3.connect(path)
+    with con:
+        con.execute(qc_wrap.CREATE_SQLITE_DB.replace("__tablename__", TESTNAME))
+        for fid, (status, retries) in enumerate(statuses):
+            las_path = names[fid] if names is not None else "tile_%d.las" % fid
+            con.execute("insert into " + TESTNAME + "(id,tile_name,las_path,ref_path,status,msg,retries) "
+                        "values(?,?,?,?,?,?,?)",
+                        (fid, "tile_%d" % fid, las_path, "", status, "msg_%d" % fid, retries))
+    con.close()
+
+
+def get_rows(path):
+    con = sqlite3.connect(path)
+    rows = con.execute("select status,msg,retries from " + TESTNAME + " order by id").fetchall()
+    con.close()
+    return rows
+
+
+def test_resume_process_db(tmpdir):
+    db_name = str(tmpdir / "process.sqlite")
+    create_process_db(db_name, [(qc_wrap.STATUS_OK, 0),
+                                (qc_wrap.STATUS_PROCESSING, 0),
+                                (qc_wrap.STATUS_ERROR, 0),
+                                (qc_wrap.STATUS_ERROR, 1),
+                                (0, 0)])
+    assert qc_wrap.resume_process_db(db_name, TESTNAME, 1) == db_name
+    ok, orphan, error, retried, todo = get_rows(db_name)
+    # done tiles are skipped
+    assert ok == (qc_wrap.STATUS_OK, "msg_0", 0)
+    # orphaned tiles are done again - it is not a retry
+    assert orphan[0] == 0 and orphan[2] == 0
+    # failed tiles are retried, unless already retried max_retries times
+    assert error == (0, None, 1)
+    assert retried == (qc_wrap.STATUS_ERROR, "msg_3", 1)
+    assert todo[0] == 0
+
+
+def test_resume_retries(tmpdir):
+    db_name = str(tmpdir / "process.sqlite")
+    create_process_db(db_name, [(qc_wrap.STATUS_ERROR, 0)])
+    n_retries = 0
+    for i in range(4):
+        qc_wrap.resume_process_db(db_name, TESTNAME, 2)
+        if get_rows(db_name)[0][0] == 0:
+            n_retries += 1
+            # and it fails again
+            con = sqlite3.connect(db_name)
+            with con:
+                con.execute("update " + TESTNAME + " set status=?", (qc_wrap.STATUS_ERROR,))
+            con.close()
+    assert n_retries == 2
+    assert get_rows(db_name)[0][2] == 2
+
+
+def test_resume_process_db_missing(tmpdir):
+    assert qc_wrap.resume_process_db(str(tmpdir / "missing.sqlite"), TESTNAME) is None
+    db_name = str(tmpdir / "process.sqlite")
+    create_process_db(db_name, [(0, 0)])
+    assert qc_wrap.resume_process_db(db_name, "other_test") is None
+
+
+def test_setup_resume():
+    # tiles are not needed when resuming
+    rc, matched_files, args = setup_job(QC_WRAP_NAMES, QC_WRAP_DEFAULTS,
+                                        {"TESTNAME": TESTNAME, "RESUME": "process.sqlite", "RETRIES": 1})
+    assert rc == 0 and matched_files == []
+    assert args["RESUME"] == "process.sqlite" and args["RETRIES"] == 1
+    rc, matched_files, args = setup_job(QC_WRAP_NAMES, QC_WRAP_DEFAULTS, {"TESTNAME": TESTNAME})
+    assert rc == 2
+    # retries only make sense when resuming
+    rc, matched_files, args = setup_job(QC_WRAP_NAMES, QC_WRAP_DEFAULTS,
+                                        {"TESTNAME": TESTNAME, "INPUT_TILE_CONNECTION": "tiles.sqlite",
+                                         "RETRIES": 1})
+    assert rc == 2
+
+
+def fake_run_tests(tests, lasname, vname, stderr):
+    '''Stands in for qc_wrap.run_tests - the name of the tile says what to do.'''
+    kind = lasname.split("_")[0]
+    if kind == "fail":
+        return qc_wrap.STATUS_ERROR, -1, "failed"
+    if kind == "sleep":
+        time.sleep(60)
+    elif kind == "alloc":
+        data = b"x" * ALLOC_BYTES
+        time.sleep(60)
+    elif kind == "crash":
+        os._exit(1)
+    return qc_wrap.STATUS_OK, 0, "ok"
+
+
+class CountingProcessDb(qc_wrap.ProcessDb):
+    '''Process db which counts how many times each tile is started.'''
+
+    def __init__(self, db_name, testname):
+        qc_wrap.ProcessDb.__init__(self, db_name, testname)
+        self.n_started = Counter()
+
+    def set_started(self, fid, p_number, exe_start):
+        self.n_started[fid] += 1
+        qc_wrap.ProcessDb.set_started(self, fid, p_number, exe_start)
+
+
+def run_scheduler(tmpdir, monkeypatch, names, n_workers, **limits):
+    '''Process tiles with the given names. Returns the scheduler, the process db and the rows of the tiles.'''
+    monkeypatch.setattr(qc_wrap, "run_tests", fake_run_tests)
+    monkeypatch.setattr(qc_wrap, "LOGDIR", str(tmpdir))
+    db_name = str(tmpdir / "process.sqlite")
+    create_process_db(db_name, [(0, 0)] * len(names), names)
+    process_db = CountingProcessDb(db_name, TESTNAME)
+    scheduler = qc_wrap.TileScheduler(process_db, WORKER_ARGS, n_workers, **limits)
+    t_start = time.time()
+    while scheduler.n_alive > 0:
+        scheduler.poll(0.1)
+        assert time.time() - t_start < 30, "Scheduler did not finish"
+    process_db.close()
+    return scheduler, process_db, get_rows(db_name)
+
+
+@needs_fork
+def test_scheduler(tmpdir, monkeypatch):
+    names = ["ok_%d" % i for i in range(12)]
+    names[4] = names[9] = "fail"
+    # also replace each worker after 3 tiles
+    scheduler, process_db, rows = run_scheduler(tmpdir, monkeypatch, names, 3, max_tiles=3)
+    assert scheduler.n_done == len(names)
+    assert scheduler.n_err == 2
+    assert scheduler.n_crashes == 0
+    assert scheduler.n_started == 4  # 12 tiles / 3 tiles pr. worker
+    for name, (status, msg, retries) in zip(names, rows):
+        if name == "fail":
+            assert (status, msg) == (qc_wrap.STATUS_ERROR, "failed")
+        else:
+            assert (status, msg) == (qc_wrap.STATUS_OK, "ok")
+    # every tile is handed out exactly once
+    assert sorted(process_db.n_started.items()) == [(fid, 1) for fid in range(len(names))]
+
+
+@needs_fork
+@pytest.mark.parametrize("kind, limits, reason", [
+    ("sleep", {"tile_timeout": 1}, "Tile timed out after 1 s."),
+    ("alloc", {}, "Process used "),
+    ("crash", {}, "Process stopped unexpectedly."),
+])
+def test_scheduler_limits(tmpdir, monkeypatch, kind, limits, reason):
+    if kind == "alloc":
+        rss = get_rss()
+        if rss is None:
+            pytest.skip("Memory usage not available")
+        limits["max_rss"] = rss + ALLOC_BYTES // 2
+    names = ["ok_0", "ok_1", kind, "ok_3", "ok_4", "ok_5"]
+    scheduler, process_db, rows = run_scheduler(tmpdir, monkeypatch, names, 1, **limits)
+    assert scheduler.n_done == len(names)
+    assert scheduler.n_err == 1
+    assert scheduler.n_crashes == (1 if kind == "crash" else 0)
+    # the stopped worker is replaced, and the remaining tiles are done
+    assert scheduler.n_started == 2
+    status, msg, retries = rows[2]
+    assert status == qc_wrap.STATUS_ERROR and msg.startswith(reason)
+    assert all(row[:2] == (qc_wrap.STATUS_OK, "ok") for row in rows[:2] + rows[3:])
+    assert sorted(process_db.n_started.items()) == [(fid, 1) for fid in range(len(names))]
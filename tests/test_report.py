@@ -0,0 +1,27 @@
+'''
+Test buffered reporting.
+'''
+
+from qc.db import report
+
+WKT = "POLYGON((548000 6076000,549000 6076000,549000 6077000,548000 6076000))"
+
+
+def test_batched_reporting(tmpdir):
+    ds = report.create_local_datasource(str(tmpdir / 'test_report.sqlite'))
+    report.set_datasource(ds)
+    try:
+        reporter = report.ReportDensity(True, batch_size=3)
+        layer = ds.GetLayerByName(reporter.layername)
+        for i in range(4):
+            reporter.report("1km_6076_548", 1.0, 2.0, 100.0, wkt_geom=WKT)
+        # first batch written, last feature still buffered
+        assert layer.GetFeatureCount() == 3
+        report.flush_all()
+        assert layer.GetFeatureCount() == 4
+        # opt out of batching
+        reporter = report.ReportDensity(True, batch_size=0)
+        reporter.report("1km_6076_548", 1.0, 2.0, 100.0, wkt_geom=WKT)
+        assert layer.GetFeatureCount() == 5
+    finally:
+        report.close_datasource()
@@ -5,9 +5,19 @@ The unit tests raises AssertionError's upoin failure, hence it is enough
 to just call the test functions here.
 '''
 
+import pickle
+import pytest
+
+import numpy as np
+
 from qc.thatsDEM import triangle
 from qc.thatsDEM import array_geometry
 from qc.thatsDEM import pointcloud
+from qc.thatsDEM import grid
+from qc.utils import profiling
+from qc import z_accuracy_gcp
+from qc import density_check
+from qc import dhmqc_constants as constants
 
 from . import conftest
 
@@ -18,4 +28,314 @@ def test_array_geometry():
     array_geometry.unit_test()
 
 def test_triangle():
-    triangle.unit_test()
\ No newline at end of file
+    triangle.unit_test()
+
+def test_preloaded_pointcloud():
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO, include_return_number=True)
+    pointcloud.set_preloaded(conftest.LAZ_DEMO, pc)
+    try:
+        pc_all = pointcloud.fromAny(conftest.LAZ_DEMO)
+        assert pc_all.xy is pc.xy
+        assert pc_all.rn is None
+        pc_ground = pointcloud.fromAny(conftest.LAZ_DEMO, cls=[2])
+        assert pc_ground.get_size() == pointcloud.fromLAS(conftest.LAZ_DEMO, cls=[2]).get_size()
+    finally:
+        pointcloud.clear_preloaded()
+
+def test_pointcloud_cache():
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO)
+    nbytes = pc.get_nbytes()
+    cache = pointcloud.PointcloudCache(2 * nbytes)
+    cache.put("a", pc)
+    cache.put("b", pc.cut_to_class(2))
+    assert cache.get("a") is pc
+    cache.put("c", pc)  # evicts "b", which is least recently used
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.nbytes <= cache.max_bytes
+    cache.set_max_bytes(0)
+    assert len(cache) == 0 and cache.nbytes == 0
+
+def test_pointcloud_cache_file(tmpdir):
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO, include_return_number=True)
+    path = str(tmpdir.join("1km_6076_548.pcc"))
+    pc.dump_cache(path)
+    header = pointcloud.read_cache_header(path)
+    assert header["count"] == pc.get_size()
+    pc_cached = pointcloud.fromAny(path, include_return_number=True)
+    for attr in pc.pc_attrs:
+        assert (pc.__dict__[attr] == pc_cached.__dict__[attr]).all()
+    assert not pc_cached.xy.flags["OWNDATA"]  # memory mapped, not copied
+    pc_ground = pointcloud.fromAny(path, cls=[2])
+    assert pc_ground.get_size() == pc.cut_to_class(2).get_size()
+    assert pointcloud.fromAny(path, cls=[7]).get_size() == 0
+
+def test_chunked_las_filters():
+    las = pointcloud.laspy.read(conftest.LAZ_DEMO)
+    pc = pointcloud.fromLaspy(las, include_return_number=True)
+    x1, y1, x2, y2 = pc.get_bounds()
+    box = (x1 + 20, y1 + 20, x2 - 20, y2 - 20)
+    for kwargs in ({}, {"cls": [2]}, {"xy_box": box}, {"cls": [2, 4], "xy_box": box, "z_box": (-10, 60)}):
+        pc_full = pointcloud.fromLaspy(las, include_return_number=True, **kwargs)
+        pc_chunked = pointcloud.fromLAS(conftest.LAZ_DEMO, include_return_number=True, chunk_size=1000, **kwargs)
+        for attr in pc.pc_attrs:
+            assert (pc_full.__dict__[attr] == pc_chunked.__dict__[attr]).all()
+
+def test_spatial_index_sidecar(tmpdir):
+    pc_ref = pointcloud.fromAny(conftest.LAZ_DEMO).cut_to_class(2).sort_spatially(1.0)
+    pointcloud.set_spatial_index_dir(str(tmpdir))
+    try:
+        for _ in range(2):  # first run writes the sidecar, second run uses it
+            pc = pointcloud.fromAny(conftest.LAZ_DEMO).cut_to_class(2).sort_spatially(1.0)
+            assert len(tmpdir.listdir()) == 1
+            assert (pc.xy == pc_ref.xy).all()
+            assert (pc.spatial_index == pc_ref.spatial_index).all()
+        # loading with a class filter gives the same points, and hence uses the same sidecar.
+        pc = pointcloud.fromAny(conftest.LAZ_DEMO, cls=[2]).sort_spatially(1.0)
+        assert len(tmpdir.listdir()) == 1
+        assert (pc.min_filter(1.0) == pc_ref.min_filter(1.0)).all()
+    finally:
+        pointcloud.set_spatial_index_dir(None)
+
+def test_class_histogram():
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO)
+    hist = pc.class_histogram(minlength=40)
+    assert hist.shape[0] == 40
+    assert hist.sum() == pc.get_size()
+    for cls in (0, 2, 4, 34):
+        assert hist[cls] == pc.cut_to_class(cls).get_size()
+
+def test_make_grid_reductions():
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO)
+    georef = (548000, 5.0, 0, 6077000, 0, -5.0)
+    for method, callback in (("mean", lambda v: v.mean()), ("max", lambda v: v.max()), ("var", lambda v: v.var()),
+                             ("median", lambda v: np.median(v)), ("percentile", lambda v: np.percentile(v, 90))):
+        fast = grid.make_grid(pc.xy, pc.z, 200, 200, georef, method=method, dtype=np.float64, percentile=90)
+        slow = grid.make_grid(pc.xy, pc.z, 200, 200, georef, method=callback, dtype=np.float64)
+        assert np.allclose(fast.grid, slow.grid)
+
+def test_profiled_stages():
+    profiling.reset()
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO)
+    pc.sort_spatially(2.0)
+    pc.min_filter(1.0, xy=pc.xy[:10])
+    pc.min_filter(1.0, xy=pc.xy[:20])
+    totals = profiling.get_totals()
+    assert totals["read"][0] == 1 and totals["read"][2] == pc.size
+    assert totals["sort_spatially"][2] == pc.size
+    calls, seconds, points, peak_rss = totals["min_filter"]
+    assert calls == 2 and points == 30 and seconds >= 0
+    profiling.reset()
+    assert profiling.get_totals() == {}
+
+def test_stage_peak_rss():
+    profiling.reset()
+    with profiling.stage("outer"):
+        with profiling.stage("alloc"):
+            arr = np.ones(2**24)  # 128 MB
+            del arr
+        with profiling.stage("small"):
+            pass
+    totals = profiling.get_totals()
+    peak_alloc = totals["alloc"][3]
+    if peak_alloc is None:
+        pytest.skip("Memory usage not available")
+    assert peak_alloc >= 2**27
+    # the peak of the inner stage is passed on to the outer stage
+    assert totals["outer"][3] >= peak_alloc
+    if profiling.reset_peak_rss():
+        assert totals["small"][3] < peak_alloc
+    profiling.reset()
+
+def test_grid_in_blocks():
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO, cls=[2])
+    kwargs = dict(x1=547990, x2=549010, y1=6075990, y2=6077010, cx=0.5, cy=0.5, method="return_triangles")
+    pc_blocks = pointcloud.Pointcloud(pc.xy, pc.z)
+    g_blocks, t_blocks = pc_blocks.get_grid(n_threads=4, block_size=200, **kwargs)
+    pc.triangulate()
+    g, t = pc.get_grid(**kwargs)
+    assert (g.grid != -999).any()
+    assert (g.grid == g_blocks.grid).all()
+    assert (t.grid == t_blocks.grid).all()
+
+def test_threaded_filters(monkeypatch):
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO).sort_spatially(1.0)
+    xy = pc.xy + 0.3
+    filters = (lambda: pc.min_filter(1.0, xy), lambda: pc.median_filter(1.0), lambda: pc.idw_filter(1.0, xy),
+               lambda: pc.density_filter(1.0), lambda: pc.spike_filter(1.0, 1.0, 0.25))
+    monkeypatch.setattr(array_geometry, "FILTER_THREADS", 1)
+    serial = [f() for f in filters]
+    monkeypatch.setattr(array_geometry, "FILTER_THREADS", 3)
+    monkeypatch.setattr(array_geometry, "FILTER_MIN_CHUNK", 1000)
+    for f, z in zip(filters, serial):
+        assert (f() == z).all()
+
+def test_filter_radius_larger_than_cell_size():
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO, cls=[2]).sort_spatially(0.5)
+    xy = np.array(((548100.3, 6076900.7), (548200.0, 6076950.0), (548004.0, 6076990.0), (547990.0, 6076800.0)))
+    for rad in (0.4, 1.3, 3.7):
+        d = np.sqrt(((pc.xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis=2))
+        counts = (d <= rad).sum(axis=0)
+        means = np.array([pc.z[d[:, i] <= rad].mean() if counts[i] else -9999 for i in range(xy.shape[0])])
+        assert np.allclose(pc.density_filter(rad, xy) * np.pi * rad ** 2, counts)
+        assert np.allclose(pc.mean_filter(rad, xy), means)
+
+def test_knn():
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO, cls=[2]).sort_spatially(1.0)
+    xy = np.array(((548100.3, 6076900.7), (548200.0, 6076950.0), (548004.0, 6076990.0), (547900.0, 6076800.0)))
+    idx, dist = pc.knn(xy, 7)
+    d = np.sqrt(((pc.xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis=2))
+    assert np.allclose(dist, np.sort(d, axis=0)[:7].T)
+    assert np.allclose(d[idx, np.arange(xy.shape[0])[:, None]], dist)
+    z = pc.knn_idw_filter(7, xy)
+    w = 1.0 / dist ** 2
+    assert np.allclose(z, (w * pc.z[idx]).sum(axis=1) / w.sum(axis=1))
+    small = pointcloud.Pointcloud(pc.xy[:3], pc.z[:3]).sort_spatially(1.0)
+    idx, dist = small.knn(xy[:1], 5)
+    assert (idx[0, 3:] == -1).all() and np.isinf(dist[0, 3:]).all()
+
+def test_percentile_filter():
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO).sort_spatially(1.0)
+    xy = pc.xy[::500] + 0.2
+    d = np.sqrt(((pc.xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis=2))
+    for q in (0, 5, 50, 87.5, 100):
+        expected = [np.percentile(pc.z[d[:, i] <= 1.5], q) if (d[:, i] <= 1.5).any() else -9999
+                    for i in range(xy.shape[0])]
+        assert np.allclose(pc.percentile_filter(1.5, q, xy), expected)
+    assert np.allclose(pc.median_filter(1.5, xy), pc.percentile_filter(1.5, 50, xy))
+
+def test_multi_filter():
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO).sort_spatially(1.0)
+    xy = np.vstack((pc.xy[::50] + 0.3, ((547000.0, 6076000.0),)))
+    stats = pc.multi_filter(1.5, xy)
+    assert np.allclose(stats["min"], pc.min_filter(1.5, xy))
+    # max_filter gives -nd_val with no points around
+    assert np.allclose(stats["max"][:-1], pc.max_filter(1.5, xy)[:-1])
+    assert np.allclose(stats["mean"], pc.mean_filter(1.5, xy))
+    assert np.allclose(stats["var"], pc.var_filter(1.5, xy))
+    assert np.allclose(stats["count"], pc.density_filter(1.5, xy) * np.pi * 1.5 ** 2)
+    assert np.allclose(stats["distance"], pc.distance_filter(1.5, xy))
+    assert stats["count"][-1] == 0 and stats["mean"][-1] == -9999
+    assert pc.multi_filter(1.5, xy, stats=("max", "count")).dtype.names == ("max", "count")
+
+def test_split_by():
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO)
+    strips = pc.split_by("pid")
+    assert list(strips.keys()) == list(pc.get_pids())
+    assert sum(pc_.get_size() for pc_ in strips.values()) == pc.get_size()
+    for pid, pc_ in strips.items():
+        pc_ref = pc.cut_to_strip(pid)
+        assert (pc_.xy == pc_ref.xy).all() and (pc_.z == pc_ref.z).all() and (pc_.c == pc_ref.c).all()
+    first, second = list(strips.values())[:2]
+    assert first.xy.base is not None and first.xy.base is second.xy.base
+    classes = pc.split_by("c")
+    assert (np.array([pc_.get_size() for pc_ in classes.values()]) == pc.class_histogram()[list(classes.keys())]).all()
+    # negative and large values
+    pc.c = np.where(pc.c == 2, -1, np.where(pc.c == 4, 10**9, pc.c)).astype(np.int32)
+    classes = pc.split_by("c")
+    assert list(classes.keys()) == sorted(set(pc.c.tolist()))
+    for c, pc_ in classes.items():
+        assert (pc_.xy == pc.xy[pc.c == c]).all()
+
+def test_bbox_tree():
+    rng = np.random.RandomState(0)
+    xy = rng.uniform(0, 1000, size=(500, 2))
+    boxes = np.hstack((xy, xy + rng.uniform(0, 30, size=(500, 2))))
+    tree = array_geometry.BBoxTree(boxes, node_size=8)
+    for query in ((0, 0, 1000, 1000), (100, 100, 150, 300), (-10, -10, -5, -5), (500, 500, 500, 500)):
+        expected = np.flatnonzero((boxes[:, 0] <= query[2]) & (boxes[:, 2] >= query[0]) &
+                                  (boxes[:, 1] <= query[3]) & (boxes[:, 3] >= query[1]))
+        assert (tree.query(query) == expected).all()
+    assert array_geometry.BBoxTree(np.empty((0, 4))).query((0, 0, 1, 1)).size == 0
+
+def test_tin_cache(tmpdir):
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO).cut_to_class(2)
+    pc_refs = dict((pid, pc_) for pid, pc_ in pc.split_by("pid").items() if pc_.get_size() > 50)
+    for pc_ in pc_refs.values():
+        pc_.triangulate()
+        pc_.calculate_validity_mask(45, 2, 1)
+    pointcloud.set_tin_cache_dir(str(tmpdir))
+    try:
+        for _ in range(2):  # first run writes the cache files, second run uses them
+            strips = pointcloud.fromAny(conftest.LAZ_DEMO, cls=[2]).split_by("pid")
+            for pid, pc_ref in pc_refs.items():
+                pc_ = strips[pid]
+                pc_.triangulate()
+                pc_.calculate_validity_mask(45, 2, 1)
+                assert (pc_.triangulation.get_triangles() == pc_ref.triangulation.get_triangles()).all()
+                assert (pc_.get_validity_mask() == pc_ref.get_validity_mask()).all()
+                xy_in = pc_ref.xy[::7] + 0.1
+                assert (pc_.controlled_interpolation(xy_in) == pc_ref.controlled_interpolation(xy_in)).all()
+            assert len(tmpdir.listdir()) == len(pc_refs)
+        # changing z invalidates the cached geometry, but not the triangles
+        pc_ = pointcloud.fromAny(conftest.LAZ_DEMO, cls=[2]).split_by("pid")[list(pc_refs)[0]]
+        pc_.z = pc_.z * 2
+        pc_.triangulate()
+        assert pc_.triangulation.triangles is not None
+        assert (pc_.get_triangle_geometry()[:, 2] == 2 * list(pc_refs.values())[0].get_triangle_geometry()[:, 2]).all()
+        # so does changing z in place after triangulating
+        pc_.z[:] = 0
+        assert (pc_.get_triangle_geometry()[:, 2] == 0).all()
+        # points moved in place do not match the cache file
+        pc_.xy -= pc_.xy.min(axis=0)
+        path = pointcloud.get_tin_cache_path(pc_.source)
+        assert pointcloud.load_tin(path, pc_.source, pc_.xy, pc_.z) == (None, None, None)
+    finally:
+        pointcloud.set_tin_cache_dir(None)
+
+def test_pickle_triangulation():
+    rng = np.random.RandomState(0)
+    pc = pointcloud.Pointcloud(rng.uniform(0, 100, size=(2000, 2)), rng.uniform(0, 10, size=2000))
+    pc.triangulate()
+    pc.calculate_validity_mask(45, 5, 2)
+    xy = rng.uniform(-5, 105, size=(500, 2))
+    pc2 = pickle.loads(pickle.dumps(pc))
+    assert pc2.triangulation.points is pc2.xy
+    assert (pc2.triangulation.get_triangles() == pc.triangulation.get_triangles()).all()
+    assert (pc2.find_triangles(xy) == pc.find_triangles(xy)).all()
+    assert (pc2.controlled_interpolation(xy) == pc.controlled_interpolation(xy)).all()
+    header, offsets, data = pc.triangulation.dump_index()
+    assert offsets[-1] == data.shape[0]
+    tri = triangle.Triangulation(pc.xy, triangles=pc.triangulation.get_triangles(), index=(header, offsets, data))
+    assert all((a == b).all() for a, b in zip(tri.dump_index(), (header, offsets, data)))
+    try:
+        tri.load_index(header, offsets, data[:-1])
+    except ValueError:
+        pass
+    else:
+        assert False, "Inconsistent index should raise ValueError"
+
+def test_z_accuracy_gcp_batch():
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO).cut_to_class(2)
+    x1, y1, x2, y2 = pc.get_bounds()
+    xy_ref = np.random.RandomState(0).uniform((x1 - 10, y1 - 10), (x2 + 10, y2 + 10), size=(30, 2))
+    ok, z_batch, geom_batch = z_accuracy_gcp.batch_interpolation(pc, xy_ref)
+    assert ok.any()
+    for xy, z, geom in zip(xy_ref[ok], z_batch, geom_batch):
+        z_local, geom_local = z_accuracy_gcp.local_interpolation(pc, xy.reshape(1, 2).copy(), "")
+        assert abs(z - z_local) < 1e-9
+        assert (geom == geom_local).all()
+
+def test_density_grid():
+    x_min, y_min, x_max, y_max = constants.tilename_to_extent(constants.get_tilename(conftest.LAZ_DEMO))
+    pc = pointcloud.fromAny(conftest.LAZ_DEMO, xy_box=(x_min, y_min, x_max, y_max))
+    # also points on cell edges and on the edges and corners of the tile
+    edges = np.array([(x_min, y_min), (x_max, y_max), (x_min, y_max), (x_max, y_min),
+                      (x_min + 300, y_min + 100), (x_max, y_max - 300), (x_max - 100, y_min)])
+    xs, ys = np.vstack((pc.xy, edges)).T
+    for cell_size in (100, 300):
+        den_grid, georef = density_check.density_grid(np.column_stack((xs, ys)), (x_min, y_min, x_max, y_max),
+                                                      cell_size)
+        assert georef == (x_min, cell_size, 0, y_max, 0, -cell_size)
+        ny, nx = den_grid.shape
+        assert nx == ny == int(np.ceil((x_max - x_min) / float(cell_size)))
+        # the per-cell loop which density_check used
+        for i in range(nx):
+            x1 = x_min + i * cell_size
+            x2 = min(x1 + cell_size, x_max)
+            I = (xs >= x1) & ((xs < x2) if i < nx - 1 else (xs <= x2))
+            for j in range(ny):
+                y2 = y_max - j * cell_size
+                y1 = max(y2 - cell_size, y_min)
+                J = I & (ys >= y1) & ((ys < y2) if j > 0 else (ys <= y2))
+                assert abs(den_grid[j, i] - J.sum() / ((x2 - x1) * (y2 - y1))) < 1e-12
@@ -38,22 +38,22 @@ mc.execute("""select count(*) from coverage""")
 amount_of_files=mc.fetchone()[0]
 mconn.close()
 
-exestrings=[]
-exestrings.append("""python %s -testname spike_check -schema %s -targs "-zlim 0.25" -tiles %s -runid %s""" % (qc_wrap, pargs.schema, pargs.tile_index, RUNID))
-exestrings.append("""python %s -testname count_classes -schema %s -tiles %s -runid %s""" % (qc_wrap,pargs.schema, pargs.tile_index, RUNID))
-exestrings.append("""python %s -testname classification_check -schema %s -tiles %s -runid %s -refcon "%s" -targs "-type building -layersql '%s'"  """ % (qc_wrap, pargs.schema, pargs.tile_index, RUNID, rl.REFCON, rl.HOUSES))
-exestrings.append("""python %s -testname classification_check -schema %s -tiles %s -runid %s -refcon "%s" -targs "-type lake -layersql '%s'"  """ % (qc_wrap, pargs.schema, pargs.tile_index, RUNID, rl.REFCON, rl.LAKES))
-exestrings.append("""python %s -testname road_delta_check -schema %s -tiles %s -runid %s -refcon "%s" -targs "-layersql '%s' -zlim 0.5" """ % (qc_wrap, pargs.schema, pargs.tile_index, RUNID, rl.REFCON,rl.ROADS))
-exestrings.append("""python %s -testname classification_check -schema %s -tiles %s -runid %s -refcon "%s" -targs "-layersql '%s' -below_poly -toE" """ % (qc_wrap, pargs.schema, pargs.tile_index, RUNID, rl.REFCON,rl.HOUSES))
-exestrings.append("""python %s -testname las2polygons -schema %s -tiles %s -runid %s""" % (qc_wrap, pargs.schema, pargs.tile_index, RUNID))
-exestrings.append("""python %s -testname wobbly_water -schema %s -tiles %s -runid %s""" % (qc_wrap, pargs.schema, pargs.tile_index, RUNID))
-
-
-for exestring in exestrings:
-	print("-------------------")
-	print(exestring)
-	print("-------------------")
-	subprocess.call(exestring,shell=True)
+# All checks are run in one qc_wrap job, so that each tile is only read once.
+tests=[]
+tests.append(""""spike_check:-zlim 0.25" """)
+tests.append(""""count_classes" """)
+tests.append(""""classification_check:-type building -layersql '%s'" """ % rl.HOUSES)
+tests.append(""""classification_check:-type lake -layersql '%s'" """ % rl.LAKES)
+tests.append(""""road_delta_check:-layersql '%s' -zlim 0.5" """ % rl.ROADS)
+tests.append(""""classification_check:-layersql '%s' -below_poly -toE" """ % rl.HOUSES)
+tests.append(""""las2polygons" """)
+tests.append(""""wobbly_water" """)
+
+exestring="""python %s -tests %s -schema %s -tiles %s -runid %s -refcon "%s" """ % (qc_wrap, " ".join(tests), pargs.schema, pargs.tile_index, RUNID, rl.REFCON)
+print("-------------------")
+print(exestring)
+print("-------------------")
+subprocess.call(exestring,shell=True)
 
 
 end_time = time.time()